@@ -1,9 +1,11 @@
 import sys
 import os
 import hashlib
+import json
 import aiohttp
 import asyncio
 import zipfile
+import shutil
 import re
 import logging
 import ssl
@@ -20,11 +22,12 @@ from io import BytesIO
 from packaging.version import parse as parse_version
 import subprocess
 try:
-    from crypto_verifier import verify_update_integrity
+    from crypto_verifier import verify_update_integrity_async, get_verifier
     CRYPTO_AVAILABLE = True
 except ImportError:
     CRYPTO_AVAILABLE = False
-    verify_update_integrity = None
+    verify_update_integrity_async = None
+    get_verifier = None
 
 try:
     from download_manager import DownloadManager, ResumableDownload
@@ -43,13 +46,22 @@ except ImportError:
     RollbackManager = None
 
 try:
-    from delta_updates import DeltaApplier, is_delta_update_beneficial
+    from delta_updates import (DeltaApplier, is_delta_update_beneficial, find_delta_route,
+                               delta_index_payload, DELTA_INDEX_FILENAME)
+    from delta_codecs import get_available_codecs
     DELTA_UPDATES_AVAILABLE = True
 except ImportError:
     DELTA_UPDATES_AVAILABLE = False
     DeltaApplier = None
     is_delta_update_beneficial = None
 
+try:
+    from chunk_store import ChunkStoreApplier
+    CHUNK_STORE_AVAILABLE = True
+except ImportError:
+    CHUNK_STORE_AVAILABLE = False
+    ChunkStoreApplier = None
+
 try:
     from ui_enhancements import (StatisticsManager, EnhancedProgressBar, 
                                 StatisticsWidget, TabbedInfoWidget)
@@ -70,6 +82,14 @@ except ImportError:
     get_cache_manager = None
     get_metadata_cache = None
 
+try:
+    from prefetch_manager import get_prefetch_manager, parse_staged_version
+    PREFETCH_AVAILABLE = True
+except ImportError:
+    PREFETCH_AVAILABLE = False
+    get_prefetch_manager = None
+    parse_staged_version = None
+
 try:
     from web_content_manager import WebContentManager
     WEB_CONTENT_AVAILABLE = True
@@ -104,12 +124,16 @@ if not BACKUP_AVAILABLE:
     logger.warning("Менеджер резервных копий недоступен. Откат обновлений отключен.")
 if not DELTA_UPDATES_AVAILABLE:
     logger.warning("Модуль delta-обновлений недоступен. Используется полное обновление.")
+if not CHUNK_STORE_AVAILABLE:
+    logger.warning("Модуль хранилища чанков недоступен. Обновление по чанкам отключено.")
 if not UI_ENHANCEMENTS_AVAILABLE:
     logger.warning("Улучшения UI недоступны. Используется обычный интерфейс.")
 if not CACHE_AVAILABLE:
     logger.warning("Кэширование недоступно.")
 if not WEB_CONTENT_AVAILABLE:
     logger.warning("Веб-контент модуль недоступен. Новости не будут отображаться.")
+if not PREFETCH_AVAILABLE:
+    logger.warning("Модуль предзагрузки недоступен. Фоновая загрузка патчей отключена.")
 
 # Константы безопасности
 # Константы безопасности
@@ -121,6 +145,7 @@ ALLOWED_FILE_EXTENSIONS = {
     '.pak', '.bin', '.pack'
 }
 DATA_DIR = "launcher_data"  # Директория для данных лаунчера
+PREFETCH_DIR = os.path.join(DATA_DIR, "prefetch")  # Директория предзагруженных патчей
 BACKUP_DIR = "launcher_backups"  # Директория для резервных копий
 
 def validate_url(url):
@@ -178,8 +203,23 @@ def force_https_config():
     
     return config_updated
 
-def safe_extract_archive(archive_path, extract_to="."):
-    """Безопасная распаковка архива с проверками"""
+def _extract_member_hashed(zip_ref, member, target_path):
+    """Распаковка записи с подсчётом SHA-256 по потоку данных"""
+    os.makedirs(os.path.dirname(target_path) or '.', exist_ok=True)
+    hasher = hashlib.sha256()
+    with zip_ref.open(member) as source, open(target_path, 'wb') as target:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            hasher.update(chunk)
+            target.write(chunk)
+    return hasher.hexdigest()
+
+def safe_extract_archive(archive_path, extract_to=".", hashes=None):
+    """Безопасная распаковка архива с проверками
+
+    Если передан словарь ``hashes``, в него записываются SHA-256
+    распакованных файлов (путь в архиве -> хеш): проверка манифеста и
+    списка файлов берёт их вместо повторного чтения с диска.
+    """
     try:
         # Проверка размера архива
         archive_size = os.path.getsize(archive_path)
@@ -206,12 +246,17 @@ def safe_extract_archive(archive_path, extract_to="."):
                     raise Exception(f"Общий размер распакованных файлов превышает лимит: {extracted_size}")
                 
                 # Безопасная распаковка
-                safe_path = os.path.normpath(os.path.join(extract_to, member.filename))
+                safe_path = os.path.abspath(os.path.join(extract_to, member.filename))
                 if not safe_path.startswith(os.path.abspath(extract_to)):
                     logger.warning(f"Попытка записи за пределы директории: {safe_path}")
                     continue
                 
-                zip_ref.extract(member, extract_to)
+                if hashes is None:
+                    zip_ref.extract(member, extract_to)
+                elif member.is_dir():
+                    os.makedirs(safe_path, exist_ok=True)
+                else:
+                    hashes[member.filename] = _extract_member_hashed(zip_ref, member, safe_path)
                 
         logger.info(f"Архив {archive_path} успешно распакован")
         return True
@@ -220,6 +265,45 @@ def safe_extract_archive(archive_path, extract_to="."):
         logger.error(f"Ошибка распаковки архива {archive_path}: {e}")
         raise
 
+def extract_version_number(version_string):
+    """Номер версии вида 1.0.3 из строки version.txt (GameVersion=..., LauncherVersion=...)"""
+    version_parts = re.findall(r'\d+\.\d+\.\d+', version_string)
+    return version_parts[0] if version_parts else None
+
+async def verify_delta_index(config, delta_index):
+    """Проверка подписи индекса дельт
+
+    Пакеты из индекса проверяются только по его sha256, поэтому при
+    доступной криптографии неподписанный индекс отвергается, если
+    это явно не разрешено (``[Update] allow_unsigned_delta_index``).
+    """
+    signature = delta_index.get('signature')
+    if not signature:
+        if CRYPTO_AVAILABLE and not config.getboolean('Update', 'allow_unsigned_delta_index', fallback=False):
+            logger.error("Индекс дельт не подписан")
+            return False
+        logger.warning("Индекс дельт не подписан")
+        return True
+    if not CRYPTO_AVAILABLE:
+        logger.warning("Криптография недоступна, подпись индекса дельт не проверяется")
+        return True
+    public_key_url = config.get('Update', 'public_key_url', fallback=None)
+    return await get_verifier(public_key_url=public_key_url).verify_data_signature_async(
+        delta_index_payload(delta_index), signature)
+
+def install_staged_files(staging_dir, target_dir="."):
+    """Перенос проверенных файлов из каталога подготовки в целевой каталог
+
+    Каталог подготовки лежит внутри каталога игры, поэтому каждый файл
+    заменяется атомарно через os.replace.
+    """
+    for root, _, files in os.walk(staging_dir):
+        for name in files:
+            staged_path = os.path.join(root, name)
+            target_path = os.path.join(target_dir, os.path.relpath(staged_path, staging_dir))
+            os.makedirs(os.path.dirname(target_path) or '.', exist_ok=True)
+            os.replace(staged_path, target_path)
+
 class UpdateThread(QThread):
     file_progress = pyqtSignal(int)
     overall_progress = pyqtSignal(int)
@@ -239,7 +323,8 @@ class UpdateThread(QThread):
         
         # Инициализация менеджера резервных копий
         if BACKUP_AVAILABLE:
-            self.backup_manager = BackupManager()
+            self.backup_manager = BackupManager(
+                compression=self.config.get('Backup', 'compression', fallback='deflate:6'))
             self.rollback_manager = RollbackManager(self.backup_manager)
         else:
             self.backup_manager = None
@@ -251,6 +336,12 @@ class UpdateThread(QThread):
         else:
             self.delta_applier = None
             
+        # Инициализация обновлений по чанкам (CDC)
+        if CHUNK_STORE_AVAILABLE:
+            self.chunk_applier = ChunkStoreApplier(os.path.join(DATA_DIR, "chunk_cache"))
+        else:
+            self.chunk_applier = None
+            
         # Инициализация статистики
         if UI_ENHANCEMENTS_AVAILABLE:
             self.stats_manager = StatisticsManager()
@@ -267,6 +358,15 @@ class UpdateThread(QThread):
             self.cache_manager = None
             self.metadata_cache = None
             
+        # Инициализация предзагрузки
+        if PREFETCH_AVAILABLE and config.getboolean('Prefetch', 'enabled', fallback=True):
+            self.prefetch_manager = get_prefetch_manager(
+                config.get('Prefetch', 'staging_dir', fallback=PREFETCH_DIR),
+                config.getfloat('Prefetch', 'bandwidth_limit_kbps', fallback=512)
+            )
+        else:
+            self.prefetch_manager = None
+            
         self.current_download_start = None
         self.current_file_name = ""
         self.update_start_time = None
@@ -300,15 +400,16 @@ class UpdateThread(QThread):
                 logger.info(f"Скачиваем обновление лаунчера версии {new_launcher_version}")
                 # Используем возобновляемую загрузку если доступно
                 if RESUMABLE_DOWNLOADS:
-                    await self.fetch_file_resumable(full_url, launcher_update_filename)
+                    launcher_hash = await self.fetch_file_resumable(full_url, launcher_update_filename)
                 else:
-                    await self.fetch_file(session, full_url, launcher_update_filename)
+                    launcher_hash = await self.fetch_file(session, full_url, launcher_update_filename)
 
                 # Проверка целостности обновления лаунчера
                 if CRYPTO_AVAILABLE:
                     try:
                         public_key_url = self.config.get('Update', 'public_key_url', fallback=None)
-                        if verify_update_integrity(launcher_update_filename, public_key_url=public_key_url):
+                        if await verify_update_integrity_async(launcher_update_filename, public_key_url=public_key_url,
+                                                               archive_hash=launcher_hash):
                             logger.info("Целостность обновления лаунчера подтверждена")
                         else:
                             logger.warning("Не удалось проверить подпись обновления лаунчера")
@@ -331,12 +432,11 @@ class UpdateThread(QThread):
                 self.update_finished_launcher.emit(False, f"Ошибка обновления лаунчера: {e}")
 
     async def fetch_file_resumable(self, url, dest):
-        """Загрузка файла с поддержкой паузы/возобновления"""
+        """Загрузка файла с поддержкой паузы/возобновления; возвращает SHA-256 загруженного файла"""
         if not RESUMABLE_DOWNLOADS:
             # Используем старый метод
             async with aiohttp.ClientSession() as session:
-                await self.fetch_file(session, url, dest)
-            return
+                return await self.fetch_file(session, url, dest)
         
         try:
             async with DownloadManager() as dm:
@@ -361,15 +461,86 @@ class UpdateThread(QThread):
                 if not success:
                     raise Exception("Ошибка загрузки")
                 
+                file_hash = dm.get_download_hash(self.current_download_id)
                 self.current_download_id = None
                 self.download_manager = None
+                return file_hash
                 
         except Exception as e:
             logger.error(f"Ошибка возобновляемой загрузки: {e}")
             raise
 
+    @staticmethod
+    def read_files_list_paths(files_list_path):
+        """Пути файлов из локального списка файлов версии (None, если списка нет)"""
+        if not os.path.exists(files_list_path):
+            return None
+        with open(files_list_path, 'r', encoding='utf-8') as f:
+            return [parts[0] for parts in (line.split() for line in f)
+                    if len(parts) == 3 and parts[0] != 'version']
+
+    async def load_delta_index(self, session, update_url):
+        """Загрузка (или кэш) индекса deltas.json с проверкой подписи; None, если индекс не используется"""
+        delta_index = self.metadata_cache.get_delta_index(update_url) if self.metadata_cache else None
+        if delta_index:
+            logger.debug("Индекс дельт из кэша")
+        else:
+            index_url = os.path.join(update_url, DELTA_INDEX_FILENAME).replace('\\', '/')
+            try:
+                await self.fetch_file(session, index_url, DELTA_INDEX_FILENAME)
+                with open(DELTA_INDEX_FILENAME, 'r', encoding='utf-8') as f:
+                    delta_index = json.load(f)
+            except Exception as e:
+                logger.info(f"Индекс дельт недоступен, обновляем по версиям: {e}")
+                return None
+            finally:
+                if os.path.exists(DELTA_INDEX_FILENAME):
+                    os.remove(DELTA_INDEX_FILENAME)
+        
+        if not await verify_delta_index(self.config, delta_index):
+            logger.error("Подпись индекса дельт недействительна, индекс не используется")
+            if self.metadata_cache:
+                self.metadata_cache.cache_manager.delete(f"{update_url}/{DELTA_INDEX_FILENAME}")
+            return None
+        if self.metadata_cache:
+            self.metadata_cache.set_delta_index(update_url, delta_index)
+        return delta_index
+
+    def plan_update_route(self, delta_index, current_version, latest_version):
+        """Выбор самой дешёвой цепочки дельт и архивов по подписанному индексу deltas.json
+
+        Доступность дельт и манифестов чанков определяется по индексу
+        локально, без пробных загрузок для каждой версии.
+        """
+        route = find_delta_route(delta_index, current_version, latest_version, get_available_codecs())
+        if route:
+            total_size = sum(step.size for step in route)
+            logger.info(f"Маршрут обновления: {' -> '.join([current_version] + [s.to_version for s in route])} "
+                        f"({total_size} байт)")
+        return route
+
+    async def fetch_update_file(self, session, url, dest, version, expected_sha256=None):
+        """Загрузка файла обновления с использованием предзагруженной копии
+
+        Предзагруженная копия используется, только если известен хеш из
+        подписанного индекса дельт (``expected_sha256``). Возвращает
+        SHA-256, посчитанный при загрузке, или сверенный хеш из индекса.
+        """
+        if (self.prefetch_manager and expected_sha256
+                and self.prefetch_manager.take_staged_file(version, os.path.basename(dest), dest, expected_sha256)):
+            logger.info(f"Файл {dest} взят из предзагрузки, загрузка не требуется")
+            return expected_sha256
+        
+        if RESUMABLE_DOWNLOADS:
+            return await self.fetch_file_resumable(url, dest)
+        return await self.fetch_file(session, url, dest)
+
     async def fetch_file(self, session, url, dest):
-        """Безопасная загрузка файла с проверками и статистикой"""
+        """Безопасная загрузка файла с проверками и статистикой
+
+        SHA-256 считается по потоку при записи и возвращается: проверке
+        целостности не нужно перечитывать файл с диска.
+        """
         try:
             logger.info(f"Начинаем загрузку файла: {url}")
             
@@ -396,6 +567,7 @@ class UpdateThread(QThread):
                 
                 # Создаем временный файл для безопасной загрузки
                 temp_dest = f"{dest}.tmp"
+                hasher = hashlib.sha256()
                 try:
                     with open(temp_dest, 'wb') as f:
                         downloaded_size = 0
@@ -408,6 +580,7 @@ class UpdateThread(QThread):
                                 break
                             
                             f.write(chunk)
+                            hasher.update(chunk)
                             downloaded_size += len(chunk)
                             self.total_downloaded += len(chunk)
                             
@@ -447,6 +620,7 @@ class UpdateThread(QThread):
                     os.rename(temp_dest, dest)
                     
                     logger.info(f"Файл успешно загружен: {dest} ({downloaded_size} байт)")
+                    return hasher.hexdigest()
                     
                 except Exception as e:
                     # Удаляем временный файл в случае ошибки
@@ -485,11 +659,7 @@ class UpdateThread(QThread):
         return '.'.join([major, minor, str(int(micro) + 1)])
 
     def extract_version(self, version_string):
-        version_parts = re.findall(r'\d+\.\d+\.\d+', version_string)
-        if version_parts:
-            return version_parts[0]
-        else:
-            return None
+        return extract_version_number(version_string)
 
     async def create_pre_update_backup(self):
         """Создание резервной копии перед обновлением"""
@@ -537,6 +707,11 @@ class UpdateThread(QThread):
             try:
                 logger.info("Начинаем проверку обновлений игры")
                 
+                # Ключ подписи обновляется в фоне, пока загружаются метаданные
+                if CRYPTO_AVAILABLE:
+                    public_key_url = self.config.get('Update', 'public_key_url', fallback=None)
+                    get_verifier(public_key_url=public_key_url).start_key_refresh()
+                
                 # Запоминаем время начала обновления
                 self.update_start_time = asyncio.get_event_loop().time()
                 
@@ -577,7 +752,23 @@ class UpdateThread(QThread):
 
                 if latest_version != current_version:
                     versions_to_update = self.get_versions_to_update(current_version, latest_version)
+                    
+                    # Маршрут по индексу дельт может пропускать промежуточные версии
+                    route_steps = {}
+                    delta_index = None
+                    # version.txt содержит не только номер версии (GameVersion=..., LauncherVersion=...)
+                    route_from = self.extract_version(current_version)
+                    route_to = self.extract_version(latest_version)
+                    if DELTA_UPDATES_AVAILABLE and route_from and route_to:
+                        delta_index = await self.load_delta_index(session, update_url)
+                        route = self.plan_update_route(delta_index, route_from, route_to) if delta_index else None
+                        if route:
+                            route_steps = {step.to_version: step for step in route}
+                            versions_to_update = [step.to_version for step in route]
                     logger.info(f"Версии для обновления: {versions_to_update}")
+                    # Манифесты чанков публикуются в подписанном индексе вместе с их sha256
+                    chunk_manifests = {entry['version']: entry
+                                       for entry in (delta_index or {}).get('chunk_manifests', [])}
 
                     total_files_to_process = 0
                     processed_files = 0
@@ -618,25 +809,84 @@ class UpdateThread(QThread):
                     for version in versions_to_update:
                         logger.info(f"Обрабатываем версию {version}")
                         
-                        # Проверяем наличие delta-обновления
+                        # Проверяем наличие обновления по чанкам (CDC)
                         delta_processed = False
-                        if DELTA_UPDATES_AVAILABLE and self.delta_applier:
-                            delta_filename = f"delta_{current_version}_to_{version}.zip"
+                        archive_hash = None
+                        route_step = route_steps.get(version)
+                        chunk_entry = chunk_manifests.get(version)
+                        # Предзагруженный файл маршрута уже на диске - чанки не нужны
+                        if (chunk_entry and route_step and self.prefetch_manager
+                                and self.prefetch_manager.get_staged_file(version, route_step.file_name)):
+                            logger.info(f"Для версии {version} есть предзагруженный {route_step.file_name}, "
+                                        f"хранилище чанков не используется")
+                            chunk_entry = None
+                        if CHUNK_STORE_AVAILABLE and self.chunk_applier and chunk_entry:
+                            chunk_manifest_filename = chunk_entry['file']
+                            chunk_manifest_url = os.path.join(update_url, chunk_manifest_filename).replace('\\', '/')
+                            chunk_store_url = self.config.get('Update', 'chunk_store_url', fallback=update_url)
+                            
+                            try:
+                                chunk_manifest_hash = await self.fetch_file(session, chunk_manifest_url,
+                                                                            chunk_manifest_filename)
+                                if (chunk_entry.get('sha256')
+                                        and (chunk_manifest_hash or self.hash_file(chunk_manifest_filename))
+                                        != chunk_entry['sha256']):
+                                    raise Exception("хеш манифеста чанков не совпадает с индексом")
+                                with open(chunk_manifest_filename, 'r', encoding='utf-8') as f:
+                                    chunk_manifest = json.load(f)
+                                
+                                logger.info(f"Найден манифест чанков: {chunk_manifest_filename}")
+                                # Файлы из чанков не проходят проверку архива ниже:
+                                # подпись манифеста чанков проверяется до применения
+                                public_key_url = self.config.get('Update', 'public_key_url', fallback=None)
+                                if chunk_manifest.get('version') != version:
+                                    logger.error(f"Манифест чанков относится к версии {chunk_manifest.get('version')}, "
+                                                 f"ожидалась {version}")
+                                elif CRYPTO_AVAILABLE and not await get_verifier(
+                                        public_key_url=public_key_url).verify_manifest_signature_async(chunk_manifest):
+                                    logger.error(f"Подпись манифеста чанков недействительна: {chunk_manifest_filename}")
+                                elif await self.chunk_applier.apply_chunk_manifest(
+                                        chunk_manifest, chunk_store_url, os.getcwd(), session,
+                                        lambda p: self.file_progress.emit(p),
+                                        installed_version=current_version,
+                                        installed_files=self.read_files_list_paths(
+                                            f"{files_list_prefix}{current_version}.txt")):
+                                    logger.info("Обновление по чанкам применено успешно")
+                                    delta_processed = True
+                                    # В кэше остаются только чанки текущей версии
+                                    removed_chunks = self.chunk_applier.prune_cache(chunk_manifest)
+                                    if removed_chunks:
+                                        logger.info(f"Удалено устаревших чанков из кэша: {removed_chunks}")
+                                else:
+                                    logger.warning("Ошибка обновления по чанкам, пробуем delta/полное обновление")
+                            except Exception as chunk_error:
+                                logger.warning(f"Ошибка обновления по чанкам для версии {version}: {chunk_error}")
+                            finally:
+                                if os.path.exists(chunk_manifest_filename):
+                                    os.remove(chunk_manifest_filename)
+                        
+                        # Проверяем наличие delta-обновления
+                        if (not delta_processed and DELTA_UPDATES_AVAILABLE and self.delta_applier
+                                and (route_step is None or route_step.kind == 'delta')):
+                            delta_filename = route_step.file_name if route_step else f"delta_{current_version}_to_{version}.zip"
                             delta_url = os.path.join(update_url, delta_filename).replace('\\', '/')
                             
                             try:
                                 # Пытаемся скачать delta-обновление
-                                if RESUMABLE_DOWNLOADS:
-                                    await self.fetch_file_resumable(delta_url, delta_filename)
-                                else:
-                                    await self.fetch_file(session, delta_url, delta_filename)
+                                delta_hash = await self.fetch_update_file(session, delta_url, delta_filename, version,
+                                                                          route_step.sha256 if route_step else None)
+                                if (route_step and route_step.sha256
+                                        and (delta_hash or self.hash_file(delta_filename)) != route_step.sha256):
+                                    os.remove(delta_filename)
+                                    raise Exception("хеш delta-пакета не совпадает с индексом")
                                 
                                 logger.info(f"Найдено delta-обновление: {delta_filename}")
                                 
                                 # Применяем delta-обновление
                                 current_dir = os.getcwd()
                                 if self.delta_applier.apply_delta_package(delta_filename, current_dir, 
-                                                                         lambda p: self.file_progress.emit(p)):
+                                                                         lambda p: self.file_progress.emit(p),
+                                                                         workers=os.cpu_count() or 1):
                                     logger.info(f"Delta-обновление применено успешно")
                                     delta_processed = True
                                     
@@ -655,15 +905,23 @@ class UpdateThread(QThread):
                         
                         # Если delta-обновление не сработало, делаем полное обновление
                         if not delta_processed:
-                            zip_filename = f"{files_list_prefix}{version}.zip"
-                            zip_url = os.path.join(update_url, zip_filename).replace('\\', '/')
-                            if RESUMABLE_DOWNLOADS:
-                                await self.fetch_file_resumable(zip_url, zip_filename)
+                            if route_step and route_step.kind == 'full':
+                                zip_filename = route_step.file_name
                             else:
-                                await self.fetch_file(session, zip_url, zip_filename)
-
-                        # Проверка целостности архива
-                        if CRYPTO_AVAILABLE:
+                                zip_filename = f"{files_list_prefix}{version}.zip"
+                            zip_url = os.path.join(update_url, zip_filename).replace('\\', '/')
+                            # Хеш шага-дельты к запасному полному архиву не относится
+                            index_hash = route_step.sha256 if route_step and route_step.kind == 'full' else None
+                            archive_hash = await self.fetch_update_file(session, zip_url, zip_filename, version,
+                                                                        index_hash)
+                            if index_hash and (archive_hash or self.hash_file(zip_filename)) != index_hash:
+                                raise Exception(f"Хеш архива {zip_filename} не совпадает с индексом дельт")
+
+                        # Архив распаковывается в каталог подготовки и переносится в
+                        # каталог игры только после проверки по подписанному манифесту
+                        # (или по sha256 из подписанного индекса дельт)
+                        manifest_to_verify = None
+                        if CRYPTO_AVAILABLE and not delta_processed:
                             manifest_path = f"{zip_filename}.manifest"
                             # Пытаемся скачать манифест для проверки
                             try:
@@ -694,21 +952,41 @@ class UpdateThread(QThread):
                                         except Exception as cache_error:
                                             logger.warning(f"Ошибка сохранения манифеста в кэш: {cache_error}")
                                 
-                                public_key_url = self.config.get('Update', 'public_key_url', fallback=None)
-                                if verify_update_integrity(zip_filename, manifest_path, public_key_url):
-                                    logger.info(f"Целостность архива подтверждена: {zip_filename}")
-                                else:
-                                    logger.error(f"Нарушена целостность архива: {zip_filename}")
-                                    # Инвалидируем кэш при ошибке
-                                    if self.metadata_cache:
-                                        self.metadata_cache.cache_manager.delete(manifest_url)
-                                    raise Exception("Неверная подпись архива")
+                                manifest_to_verify = manifest_path
                             except Exception as manifest_error:
-                                logger.warning(f"Не удалось проверить подпись: {manifest_error}")
-                                # Продолжаем без проверки подписи
+                                logger.warning(f"Не удалось загрузить манифест: {manifest_error}")
                         
-                        # Безопасная распаковка архива
-                        safe_extract_archive(zip_filename)
+                        # Безопасная распаковка архива (delta/чанки уже применены к файлам)
+                        extracted_hashes = {}
+                        if not delta_processed:
+                            staging_dir = os.path.join(DATA_DIR, "update_staging", version)
+                            shutil.rmtree(staging_dir, ignore_errors=True)
+                            try:
+                                safe_extract_archive(zip_filename, staging_dir, hashes=extracted_hashes)
+
+                                # Проверка целостности до переноса файлов в каталог игры
+                                if manifest_to_verify:
+                                    public_key_url = self.config.get('Update', 'public_key_url', fallback=None)
+                                    if not await verify_update_integrity_async(zip_filename, manifest_to_verify,
+                                                                               public_key_url,
+                                                                               files_directory=staging_dir,
+                                                                               known_hashes=extracted_hashes,
+                                                                               archive_hash=archive_hash):
+                                        logger.error(f"Нарушена целостность архива: {zip_filename}")
+                                        # Инвалидируем кэш при ошибке
+                                        if self.metadata_cache:
+                                            self.metadata_cache.cache_manager.delete(manifest_url)
+                                        raise Exception("Неверная подпись архива")
+                                    logger.info(f"Целостность архива подтверждена: {zip_filename}")
+                                elif index_hash:
+                                    logger.info(f"Архив подтверждён подписанным индексом дельт: {zip_filename}")
+                                elif CRYPTO_AVAILABLE and not self.config.getboolean('Update', 'allow_unsigned_archives',
+                                                                                     fallback=False):
+                                    raise Exception(f"Нет подписанного манифеста для архива {zip_filename}")
+
+                                install_staged_files(staging_dir, os.getcwd())
+                            finally:
+                                shutil.rmtree(staging_dir, ignore_errors=True)
 
                         files_list = f"{files_list_prefix}{version}.txt"
                         with open(files_list, 'r', encoding='utf-8') as f:
@@ -737,7 +1015,7 @@ class UpdateThread(QThread):
                             file_valid = False
                             if os.path.exists(local_file):
                                 try:
-                                    local_hash = self.hash_file(local_file)
+                                    local_hash = extracted_hashes.get(file_name) or self.hash_file(local_file)
                                     file_valid = (local_hash == expected_hash)
                                     if file_valid:
                                         logger.debug(f"Файл {file_name} актуален")
@@ -863,31 +1141,31 @@ class UpdateThread(QThread):
                 return False, str(e)
 
     async def _run_update_flow(self):
-        logger.info("  ")
+        logger.info("Старт процесса обновления")
         if self.isInterruptionRequested():
-            self.update_finished.emit(False, " ")
+            self.update_finished.emit(False, "Обновление прервано")
             return
         needs_update, latest_version = await self.check_for_launcher_update()
         if self.isInterruptionRequested():
-            self.update_finished.emit(False, " ")
+            self.update_finished.emit(False, "Обновление прервано")
             return
         if needs_update:
-            logger.info(f"  : {latest_version}")
+            logger.info(f"Доступно обновление лаунчера: {latest_version}")
             await self.update_launcher()
         else:
-            logger.info(f" .  : {latest_version}")
+            logger.info(f"Лаунчер актуален. Последняя версия: {latest_version}")
             await self.update_files()
 
     def run(self):
-        """ event loop  QThread    ."""
+        """Единый event loop внутри QThread для асинхронных задач обновления."""
         loop = None
         try:
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             loop.run_until_complete(self._run_update_flow())
         except Exception as e:
-            logger.error(f"   : {e}")
-            self.update_finished.emit(False, f": {e}")
+            logger.error(f"Ошибка в процессе обновления: {e}")
+            self.update_finished.emit(False, f"Ошибка: {e}")
         finally:
             if loop is not None:
                 try:
@@ -895,7 +1173,7 @@ class UpdateThread(QThread):
                 except Exception:
                     pass
 
-    def pause_download(self):self):
+    def pause_download(self):
         """Приостановить загрузку"""
         if self.download_manager and self.current_download_id:
             self.download_manager.pause_download(self.current_download_id)
@@ -998,6 +1276,116 @@ class UpdateThread(QThread):
         else:
             logger.info("Поток обновления завершен корректно")
 
+class PrefetchThread(QThread):
+    """Фоновая предзагрузка анонсированной версии с низким приоритетом"""
+    prefetch_finished = pyqtSignal(bool, str)
+
+    def __init__(self, config, prefetch_manager):
+        super().__init__()
+        self.config = config
+        self.prefetch_manager = prefetch_manager
+        self._loop = None
+        self._task = None
+
+    async def _run_prefetch(self):
+        update_url = self.config.get('Update', 'update_url')
+        version_file = self.config.get('Update', 'version_file')
+
+        url_valid, secure_update_url = validate_url(update_url)
+        if not url_valid:
+            self.prefetch_finished.emit(False, "Небезопасный URL сервера обновлений")
+            return
+        update_url = secure_update_url
+
+        version_url = os.path.join(update_url, version_file).replace('\\', '/')
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+            async with session.get(version_url) as response:
+                if response.status != 200:
+                    raise Exception(f"HTTP {response.status}")
+                version_content = await response.text()
+
+            staged_version = parse_staged_version(version_content)
+            current_version = self.config.get('Server', 'version')
+            if not staged_version or staged_version == current_version:
+                self.prefetch_manager.cleanup()
+                self.prefetch_finished.emit(True, "Анонсированных обновлений нет")
+                return
+
+            # Предзагружаются ровно файлы маршрута, который выберет update_files:
+            # без подписанного индекса дельт их хеши неизвестны и файлы не пригодятся
+            delta_index = None
+            if DELTA_UPDATES_AVAILABLE:
+                index_url = os.path.join(update_url, DELTA_INDEX_FILENAME).replace('\\', '/')
+                async with session.get(index_url) as response:
+                    if response.status == 200:
+                        delta_index = await response.json(content_type=None)
+            if not delta_index or not await verify_delta_index(self.config, delta_index):
+                logger.info("Нет подписанного индекса дельт, предзагрузка пропущена")
+                self.prefetch_finished.emit(True, "Предзагрузка пропущена: нет подписанного индекса дельт")
+                return
+
+        route_from = extract_version_number(current_version)
+        route_to = extract_version_number(staged_version)
+        route = find_delta_route(delta_index, route_from, route_to,
+                                 get_available_codecs()) if route_from and route_to else None
+        if not route:
+            logger.info(f"Нет маршрута {current_version} -> {staged_version} в индексе дельт, предзагрузка пропущена")
+            self.prefetch_finished.emit(True, f"Предзагрузка версии {staged_version} не требуется")
+            return
+
+        # Удаляем предзагрузки, которые уже не понадобятся
+        self.prefetch_manager.cleanup(keep_versions=[step.to_version for step in route])
+
+        logger.info(f"Фоновая предзагрузка версии {staged_version}: "
+                    f"{', '.join(step.file_name for step in route)}")
+        if await self.prefetch_manager.prefetch_version(update_url, route_from, staged_version, route):
+            self.prefetch_finished.emit(True, f"Версия {staged_version} предзагружена")
+        else:
+            self.prefetch_finished.emit(False, f"Предзагрузка версии {staged_version} не завершена")
+
+    def run(self):
+        loop = None
+        try:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self._task = loop.create_task(self._run_prefetch())
+            self._loop = loop
+            loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            logger.info("Предзагрузка остановлена")
+            self.prefetch_finished.emit(False, "Предзагрузка остановлена")
+        except Exception as e:
+            logger.warning(f"Ошибка фоновой предзагрузки: {e}")
+            self.prefetch_finished.emit(False, str(e))
+        finally:
+            self._loop = None
+            self._task = None
+            if loop is not None:
+                try:
+                    loop.close()
+                except Exception:
+                    pass
+
+    def stop_safely(self):
+        """Остановка предзагрузки (частичные файлы сохраняются)
+
+        Задача предзагрузки отменяется в её цикле событий: поток не
+        прерывается посреди записи, и ``.part`` остаётся пригодным для
+        докачки.
+        """
+        if not self.isRunning():
+            return
+        self.prefetch_manager.cancel()
+        loop, task = self._loop, self._task
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # Цикл уже закрыт - поток завершается сам
+        if not self.wait(5000):
+            logger.warning("Поток предзагрузки ещё завершает текущую операцию")
+
+
 class LauncherWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -1235,6 +1623,26 @@ class LauncherWindow(QMainWindow):
     def update_launcher_on_startup(self):
         self.update_thread.start()
 
+    def start_prefetch(self):
+        """Запуск фоновой предзагрузки следующего патча"""
+        if not self.update_thread.prefetch_manager:
+            return
+        if getattr(self, 'prefetch_thread', None) and self.prefetch_thread.isRunning():
+            return
+        try:
+            self.prefetch_thread = PrefetchThread(self.config, self.update_thread.prefetch_manager)
+            self.prefetch_thread.prefetch_finished.connect(
+                lambda success, message: logger.info(f"Предзагрузка: {message}")
+            )
+            self.prefetch_thread.start(QThread.LowestPriority)
+        except Exception as e:
+            logger.warning(f"Не удалось запустить фоновую предзагрузку: {e}")
+
+    def stop_prefetch(self):
+        """Остановка фоновой предзагрузки"""
+        if getattr(self, 'prefetch_thread', None):
+            self.prefetch_thread.stop_safely()
+
     def open_telegram(self):
         QDesktopServices.openUrl(QUrl(self.telegram_url))
 
@@ -1481,6 +1889,9 @@ class LauncherWindow(QMainWindow):
             if not self.is_updating:
                 logger.info("Запуск процесса обновления")
                 
+                # Предзагрузка не должна конкурировать с обновлением за файлы и канал
+                self.stop_prefetch()
+                
                 # Создаем новый поток если предыдущий завершился
                 if not self.update_thread.isRunning():
                     self.update_thread = UpdateThread(self.config)
@@ -1576,6 +1987,10 @@ class LauncherWindow(QMainWindow):
         if hasattr(self, 'pause_button') and self.pause_button:
             self.pause_button.setVisible(False)
         
+        # После успешного обновления в фоне готовим следующий патч
+        if success:
+            self.start_prefetch()
+        
         # Обновляем статистику в расширенном UI
         if hasattr(self, 'enhanced_info_widget') and self.enhanced_info_widget:
             try:
@@ -1860,6 +2275,9 @@ class LauncherWindow(QMainWindow):
                 self.web_content_manager.stop_auto_refresh()
                 logger.info("Веб-контент остановлен")
             
+            # Останавливаем фоновую предзагрузку
+            self.stop_prefetch()
+            
             # Безопасно останавливаем поток обновления
             if hasattr(self, 'update_thread') and self.update_thread.isRunning():
                 logger.info("Останавливаем поток обновления...")
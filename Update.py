@@ -1,9 +1,16 @@
 import os
 import sys
 import hashlib
-import zipfile
+
+# С аргументами командной строки - консольный конвейер без Qt (сборочные серверы)
+if __name__ == "__main__" and len(sys.argv) > 1:
+    from release_pipeline import main
+    sys.exit(main(sys.argv[1:]))
+
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QVBoxLayout, QPushButton, QLabel, QProgressBar, QWidget, QLineEdit, QMessageBox, QCheckBox
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from archive_packer import ArchivePacker, DEFAULT_COMPRESSION
+from release_builder import ReleaseBuilder, load_files_list_hashes
 try:
     from crypto_signer import Signer as CryptoManager
     CRYPTO_AVAILABLE = True
@@ -13,23 +20,36 @@ except ImportError:
     CryptoManager = None
 
 try:
-    from delta_updates import DeltaGenerator
+    from delta_updates import DeltaGenerator, build_delta_index
     DELTA_AVAILABLE = True
 except ImportError:
     print("Delta-обновления недоступны.")
     DELTA_AVAILABLE = False
     DeltaGenerator = None
+    build_delta_index = None
+
+try:
+    from chunk_store import ChunkStoreGenerator
+    CHUNK_STORE_AVAILABLE = True
+except ImportError:
+    print("Хранилище чанков недоступно.")
+    CHUNK_STORE_AVAILABLE = False
+    ChunkStoreGenerator = None
 
 class HashGeneratorThread(QThread):
     progress = pyqtSignal(int)
     finished = pyqtSignal(str)
     
-    def __init__(self, directory, output_file, version, create_signatures=False):
+    def __init__(self, directory, output_file, version, create_signatures=False, compression=DEFAULT_COMPRESSION,
+                 incremental=True, chunk_store=False):
         super().__init__()
         self.directory = directory
         self.output_file = output_file
         self.version = version
         self.create_signatures = create_signatures
+        self.incremental = incremental
+        self.chunk_store = chunk_store
+        self.packer = ArchivePacker.from_spec(compression)
         self.crypto_manager = CryptoManager() if CRYPTO_AVAILABLE and create_signatures else None
     
     def run(self):
@@ -46,18 +66,7 @@ class HashGeneratorThread(QThread):
                 except Exception:
                     self.finished.emit("Ошибка подготовки ключей для подписи")
                     return
-            # Подсчитываем общее количество файлов
-            total_files = 0
-            for root, dirs, files in os.walk(self.directory):
-                # Пропускаем скрытые папки и системные файлы
-                dirs[:] = [d for d in dirs if not d.startswith('.')]
-                total_files += len([f for f in files if not f.startswith('.') and not f.endswith('.tmp')])
             
-            if total_files == 0:
-                self.finished.emit("Выбранный каталог пуст или не содержит подходящих файлов.")
-                return
-
-            processed_files = 0
             # Создаем имя ZIP файла на основе версии
             base_name = os.path.splitext(os.path.basename(self.output_file))[0]
             if base_name.startswith('files_list'):
@@ -69,52 +78,47 @@ class HashGeneratorThread(QThread):
             output_dir = os.path.dirname(self.output_file)
             if output_dir:
                 zip_filename = os.path.join(output_dir, zip_filename)
-            else:
-                zip_filename = zip_filename
             
-            # Используем компрессию для уменьшения размера архива
-            with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zipf:
-                with open(self.output_file, 'w', encoding='utf-8') as f:
-                    f.write(f"version {self.version}\n")
-                    
-                    for root, dirs, files in os.walk(self.directory):
-                        # Пропускаем скрытые папки
-                        dirs[:] = [d for d in dirs if not d.startswith('.')]
-                        
-                        for file in files:
-                            # Пропускаем системные и временные файлы
-                            if file.startswith('.') or file.endswith('.tmp'):
-                                continue
-                                
-                            file_path = os.path.join(root, file)
-                            
-                            try:
-                                file_size = os.path.getsize(file_path)
-                                file_hash = self.hash_file(file_path)
-                                relative_path = os.path.relpath(file_path, self.directory)
-                                
-                                # Нормализуем путь для кроссплатформенности
-                                relative_path = relative_path.replace('\\', '/')
-                                
-                                f.write(f"{relative_path} {file_hash} {file_size}\n")
-                                zipf.write(file_path, relative_path)
-                                
-                                processed_files += 1
-                                progress_percent = int((processed_files / total_files) * 100)
-                                self.progress.emit(progress_percent)
-                                
-                            except (OSError, IOError) as e:
-                                print(f"Ошибка обработки файла {file_path}: {e}")
-                                continue
+            # Один обход дерева; неизменённые файлы берутся из кэша предыдущей сборки
+            builder = ReleaseBuilder(self.directory, self.packer, incremental=self.incremental,
+                                     progress_callback=self.progress.emit)
+            build_stats = builder.build(self.version, self.output_file, zip_filename,
+                                        workers=os.cpu_count() or 1)
+            if build_stats is None:
+                self.finished.emit("Ошибка сборки архива обновления")
+                return
+            if build_stats.files == 0:
+                self.finished.emit("Выбранный каталог пуст или не содержит подходящих файлов.")
+                return
+            
+            result_message = f"Файл обновлений с хешами и архив {zip_filename} успешно созданы.\nОбработано файлов: {build_stats.files}"
+            result_message += f"\n{build_stats.summary()}"
+            result_message += f"\n{self.packer.stats.summary()}"
             
-            result_message = f"Файл обновлений с хешами и архив {zip_filename} успешно созданы.\nОбработано файлов: {processed_files}"
+            # Хранилище чанков в каталоге публикации: дописываются только новые чанки,
+            # манифест версии попадает в индекс дельт
+            if self.chunk_store and CHUNK_STORE_AVAILABLE:
+                chunk_manifest_path = os.path.join(output_dir or '.', f"chunk_manifest_v{self.version}.json")
+                chunk_info = ChunkStoreGenerator().build_chunk_manifest(self.directory, self.version, output_dir or '.',
+                                                                        chunk_manifest_path, signer=self.crypto_manager)
+                if chunk_info:
+                    result_message += (f"\nМанифест чанков создан: {chunk_manifest_path} "
+                                       f"(новых чанков: {chunk_info.new_chunks}, {chunk_info.new_size} байт)")
+                else:
+                    result_message += "\nОшибка создания манифеста чанков"
+            
+            # Обновляем индекс дельт и архивов каталога публикации
+            if DELTA_AVAILABLE and build_delta_index(output_dir or '.', signer=self.crypto_manager):
+                result_message += "\nИндекс дельт обновлён"
             
             # Создаем манифест с подписями
             if self.crypto_manager:
                 try:
                     manifest_path = f"{zip_filename}.manifest"
-                    if self.crypto_manager.create_manifest(self.directory, manifest_path):
+                    known_hashes = load_files_list_hashes(self.output_file)
+                    if self.crypto_manager.create_manifest(self.directory, manifest_path, known_hashes=known_hashes):
                         result_message += f"\nМанифест с подписями создан: {manifest_path}"
+                        result_message += f"\n{self.crypto_manager.stats.summary()}"
                         
                         # Создаем хеш-файл для архива
                         archive_hash = self.hash_file(zip_filename)
@@ -182,6 +186,25 @@ class UpdateGeneratorApp(QMainWindow):
             self.create_signatures_checkbox.setToolTip("Криптографические модули недоступны")
         self.layout.addWidget(self.create_signatures_checkbox)
         
+        # Метод сжатия архива (несжимаемые файлы всегда хранятся без сжатия)
+        self.compression_label = QLabel("Сжатие архива (deflate:0-9, bzip2:1-9, lzma, stored):")
+        self.layout.addWidget(self.compression_label)
+        
+        self.compression_input = QLineEdit(DEFAULT_COMPRESSION)
+        self.layout.addWidget(self.compression_input)
+        
+        # Инкрементальная сборка: кэш хешей и перенос неизменённых записей из прошлого архива
+        self.incremental_checkbox = QCheckBox("Инкрементальная сборка (использовать предыдущий архив)")
+        self.incremental_checkbox.setChecked(True)
+        self.layout.addWidget(self.incremental_checkbox)
+        
+        # Хранилище чанков (CDC) в каталоге выходного файла
+        self.chunk_store_checkbox = QCheckBox("Публиковать хранилище чанков (CDC) для крупных файлов")
+        self.chunk_store_checkbox.setEnabled(CHUNK_STORE_AVAILABLE)
+        if not CHUNK_STORE_AVAILABLE:
+            self.chunk_store_checkbox.setToolTip("Хранилище чанков недоступно")
+        self.layout.addWidget(self.chunk_store_checkbox)
+        
         # Поля для delta-обновлений
         if DELTA_AVAILABLE:
             self.old_version_label = QLabel("Предыдущая версия (для delta):")
@@ -284,7 +307,9 @@ class UpdateGeneratorApp(QMainWindow):
             self.create_delta_update(old_version, new_version)
         else:
             # Обычное обновление
-            self.thread = HashGeneratorThread(self.directory, self.output_file, self.version_input.text(), create_sigs)
+            self.thread = HashGeneratorThread(self.directory, self.output_file, self.version_input.text(), create_sigs,
+                                              self.get_compression(), self.incremental_checkbox.isChecked(),
+                                              self.chunk_store_checkbox.isChecked())
             self.thread.progress.connect(self.update_progress)
             self.thread.finished.connect(self.update_status)
             self.thread.start()
@@ -294,7 +319,7 @@ class UpdateGeneratorApp(QMainWindow):
         try:
             self.status_label.setText("Статус: Создание delta-обновления...")
             
-            delta_generator = DeltaGenerator()
+            delta_generator = DeltaGenerator(packer=ArchivePacker.from_spec(self.get_compression()))
             
             # Создаем имя для delta-пакета
             base_name = os.path.splitext(self.output_file)[0]
@@ -308,7 +333,8 @@ class UpdateGeneratorApp(QMainWindow):
                 new_dir=self.directory,
                 old_version=old_version,
                 new_version=new_version,
-                output_path=delta_output
+                output_path=delta_output,
+                workers=os.cpu_count() or 1
             )
             
             self.progress_bar.setValue(90)
@@ -318,11 +344,20 @@ class UpdateGeneratorApp(QMainWindow):
                 message += f"Размер delta: {delta_info.delta_size} байт\n"
                 message += f"Оригинальный размер: {delta_info.original_size} байт\n"
                 message += f"Коэффициент сжатия: {delta_info.compression_ratio:.2f}\n"
-                message += f"Файлов обработано: {delta_info.files_count}"
+                message += f"Файлов обработано: {delta_info.files_count}\n"
+                message += f"Время генерации: {delta_info.generation_time:.1f} с"
+                if delta_info.file_timings:
+                    slowest_file = max(delta_info.file_timings, key=delta_info.file_timings.get)
+                    message += f" (самый долгий файл: {slowest_file}, {delta_info.file_timings[slowest_file]:.1f} с)"
+                if delta_info.packing_stats:
+                    message += (f"\nУпаковка: без сжатия {delta_info.packing_stats['stored_files']} файлов, "
+                                f"сэкономлено ~{delta_info.packing_stats['estimated_seconds_saved']:.1f} с")
                 
                 # Также создаем обычное обновление
                 create_sigs = self.create_signatures_checkbox.isChecked()
-                self.thread = HashGeneratorThread(self.directory, self.output_file, new_version, create_sigs)
+                self.thread = HashGeneratorThread(self.directory, self.output_file, new_version, create_sigs,
+                                                  self.get_compression(), self.incremental_checkbox.isChecked(),
+                                              self.chunk_store_checkbox.isChecked())
                 self.thread.progress.connect(self.update_progress)
                 self.thread.finished.connect(lambda msg: self.update_status(message + "\n\n" + msg))
                 self.thread.start()
@@ -338,6 +373,16 @@ class UpdateGeneratorApp(QMainWindow):
             self.generate_button.setEnabled(True)
             QMessageBox.critical(self, "Ошибка", error_message)
     
+    def get_compression(self):
+        """Метод сжатия из поля ввода (при ошибке - по умолчанию)"""
+        spec = self.compression_input.text().strip() or DEFAULT_COMPRESSION
+        try:
+            ArchivePacker.from_spec(spec)
+            return spec
+        except ValueError:
+            QMessageBox.warning(self, "Сжатие", f"Неизвестный метод сжатия '{spec}', используется {DEFAULT_COMPRESSION}")
+            return DEFAULT_COMPRESSION
+    
     def update_progress(self, value):
         self.progress_bar.setValue(value)
         
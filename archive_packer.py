@@ -0,0 +1,248 @@
+"""
+Упаковка архивов обновлений с выбором сжатия для каждого файла
+"""
+
+import os
+import copy
+import time
+import zlib
+import struct
+import logging
+import zipfile
+import tempfile
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Методы сжатия, которые читает zipfile любой поддерживаемой версии Python
+ZIP_CODECS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+
+# Форматы, которые уже сжаты и почти не ужимаются повторно
+INCOMPRESSIBLE_EXTENSIONS = frozenset({
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ogg', '.mp3', '.opus', '.mp4', '.webm',
+    '.avi', '.mkv', '.bik', '.zip', '.7z', '.rar', '.gz', '.bz2', '.xz', '.zst', '.cab', '.pak',
+})
+
+# Допустимые уровни сжатия (lzma и stored уровень не принимают)
+COMPRESSION_LEVELS = {'deflate': range(0, 10), 'bzip2': range(1, 10)}
+
+DEFAULT_COMPRESSION = 'deflate:6'
+# Выборка, которая быстрым zlib ужимается меньше чем на 5%, считается несжимаемой.
+# Пробное сжатие надёжнее побайтовой энтропии: периодические данные
+# имеют энтропию 8 бит/байт, но отлично сжимаются.
+DEFAULT_SAMPLE_RATIO_THRESHOLD = 0.95
+
+def parse_compression_spec(spec: str) -> Tuple[str, Optional[int]]:
+    """Разбор строки вида ``deflate:6``, ``bzip2:9``, ``lzma`` или ``stored``"""
+    codec, _, level = (spec or DEFAULT_COMPRESSION).strip().lower().partition(':')
+    if codec not in ZIP_CODECS:
+        raise ValueError(f"Неизвестный метод сжатия: {codec}")
+    if not level:
+        return codec, None
+    if not level.isdigit() or int(level) not in COMPRESSION_LEVELS.get(codec, ()):
+        raise ValueError(f"Недопустимый уровень сжатия для {codec}: {level}")
+    return codec, int(level)
+
+@dataclass
+class PackingStats:
+    """Статистика упаковки архива"""
+    files: int = 0
+    stored_files: int = 0
+    original_bytes: int = 0
+    packed_bytes: int = 0
+    stored_bytes: int = 0  # Несжимаемые данные, записанные без сжатия
+    reused_files: int = 0  # Записи, скопированные из предыдущего архива без пересжатия
+    reused_compressed_bytes: int = 0  # Исходный объём сжатых записей, не сжимавшихся повторно
+    compressed_input_bytes: int = 0
+    compress_seconds: float = 0.0  # Время записи сжимаемых файлов
+
+    @property
+    def bytes_saved(self) -> int:
+        """Сколько байт сэкономило сжатие"""
+        return self.original_bytes - self.packed_bytes
+
+    @property
+    def estimated_seconds_saved(self) -> float:
+        """Оценка времени, которое ушло бы на сжатие несжимаемых и перенесённых файлов"""
+        if not self.compressed_input_bytes:
+            return 0.0
+        skipped_bytes = self.stored_bytes + self.reused_compressed_bytes
+        return skipped_bytes * self.compress_seconds / self.compressed_input_bytes
+
+    def merge(self, other: 'PackingStats'):
+        """Добавление статистики другого упаковщика (шарды параллельной упаковки)"""
+        for name in asdict(other):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data['bytes_saved'] = self.bytes_saved
+        data['estimated_seconds_saved'] = round(self.estimated_seconds_saved, 3)
+        return data
+
+    def summary(self) -> str:
+        return (f"Упаковано файлов: {self.files} (без сжатия: {self.stored_files}, "
+                f"из предыдущего архива: {self.reused_files}), "
+                f"{self.original_bytes} -> {self.packed_bytes} байт, "
+                f"сжатие сэкономило {self.bytes_saved} байт, "
+                f"пропуск сжатия сэкономил ~{self.estimated_seconds_saved:.1f} с")
+
+class ArchivePacker:
+    """Запись файлов в zip с выбором метода сжатия по содержимому
+
+    Файлы с расширением из списка уже сжатых форматов или выборка которых
+    не ужимается пробным сжатием хранятся без сжатия (ZIP_STORED), остальные
+    сжимаются настроенным методом. Для распаковки ничего менять не нужно:
+    метод записан в каждой записи архива.
+    """
+
+    def __init__(self, codec: str = 'deflate', level: Optional[int] = 6,
+                 sample_size: int = 64 * 1024, sample_ratio_threshold: float = DEFAULT_SAMPLE_RATIO_THRESHOLD,
+                 incompressible_extensions: Optional[frozenset] = None):
+        if codec not in ZIP_CODECS:
+            raise ValueError(f"Неизвестный метод сжатия: {codec}")
+        self.codec = codec
+        self.compress_type = ZIP_CODECS[codec]
+        self.level = level
+        self.sample_size = sample_size
+        self.sample_ratio_threshold = sample_ratio_threshold
+        self.incompressible_extensions = incompressible_extensions or INCOMPRESSIBLE_EXTENSIONS
+        self.stats = PackingStats()
+
+    @property
+    def spec(self) -> str:
+        """Строка настройки сжатия (обратная from_spec)"""
+        return f"{self.codec}:{self.level}" if self.level is not None else self.codec
+
+    @classmethod
+    def from_spec(cls, spec: str = DEFAULT_COMPRESSION) -> 'ArchivePacker':
+        """Создание упаковщика по строке настройки (``deflate:6``, ``lzma`` ...)"""
+        codec, level = parse_compression_spec(spec)
+        return cls(codec, level)
+
+    def open(self, archive_path: str) -> zipfile.ZipFile:
+        """Открытие архива на запись с методом сжатия по умолчанию"""
+        self.stats = PackingStats()
+        return zipfile.ZipFile(archive_path, 'w', self.compress_type, compresslevel=self.level)
+
+    def sample_compression_ratio(self, file_path: str) -> float:
+        """Коэффициент пробного сжатия выборки из начала и середины файла"""
+        file_size = os.path.getsize(file_path)
+        half = self.sample_size // 2
+        with open(file_path, 'rb') as f:
+            sample = f.read(half)
+            if file_size > self.sample_size:
+                f.seek(file_size // 2)
+                sample += f.read(half)
+        if not sample:
+            return 0.0
+        return len(zlib.compress(sample, 1)) / len(sample)
+
+    def is_incompressible(self, file_path: str) -> bool:
+        """Проверка, что сжатие файла не даст выигрыша"""
+        if os.path.splitext(file_path)[1].lower() in self.incompressible_extensions:
+            return True
+        try:
+            return self.sample_compression_ratio(file_path) >= self.sample_ratio_threshold
+        except OSError:
+            return False
+
+    def write(self, zipf: zipfile.ZipFile, file_path: str, arcname: str) -> zipfile.ZipInfo:
+        """Добавление файла в архив с подходящим методом сжатия"""
+        stored = self.compress_type == zipfile.ZIP_STORED or self.is_incompressible(file_path)
+        started = time.perf_counter()
+        if stored:
+            zipf.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
+        else:
+            zipf.write(file_path, arcname, compress_type=self.compress_type, compresslevel=self.level)
+        elapsed = time.perf_counter() - started
+
+        info = zipf.infolist()[-1]
+        self.stats.files += 1
+        self.stats.original_bytes += info.file_size
+        self.stats.packed_bytes += info.compress_size
+        if stored:
+            self.stats.stored_files += 1
+            self.stats.stored_bytes += info.file_size
+        else:
+            self.stats.compressed_input_bytes += info.file_size
+            self.stats.compress_seconds += elapsed
+        return info
+
+    def copy_member(self, source_zip: zipfile.ZipFile, info: zipfile.ZipInfo,
+                    target_zip: zipfile.ZipFile) -> zipfile.ZipInfo:
+        """Перенос готовой сжатой записи из предыдущего архива"""
+        new_info = copy_raw_member(source_zip, info, target_zip)
+        self.stats.files += 1
+        self.stats.reused_files += 1
+        self.stats.original_bytes += new_info.file_size
+        self.stats.packed_bytes += new_info.compress_size
+        if new_info.compress_type == zipfile.ZIP_STORED:
+            self.stats.stored_files += 1
+        else:
+            self.stats.reused_compressed_bytes += new_info.file_size
+        return new_info
+
+def copy_raw_member(source_zip: zipfile.ZipFile, info: zipfile.ZipInfo,
+                    target_zip: zipfile.ZipFile, chunk_size: int = 1024 * 1024) -> zipfile.ZipInfo:
+    """Копирование записи между архивами без распаковки и повторного сжатия
+
+    Сжатые данные переносятся байт в байт, заголовок пишется заново с
+    известными размером и CRC. Используются внутренние поля ZipFile
+    (``start_dir``, ``_writecheck``, ``_lock``) - стабильны в CPython 3.8+.
+    """
+    source_fp = source_zip.fp
+    source_fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, source_fp.read(zipfile.sizeFileHeader))
+    if header[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Повреждён локальный заголовок записи {info.filename}")
+    # Пропускаем имя и extra-поле локального заголовка
+    source_fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+    new_info = copy.copy(info)
+    new_info.flag_bits &= ~0x08  # Размеры известны заранее - дескриптор данных не нужен
+    new_info.extra = b''
+    zip64 = info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT
+
+    with target_zip._lock:
+        target_zip._writecheck(new_info)
+        target_zip._didModify = True
+        target_zip.fp.seek(target_zip.start_dir)
+        new_info.header_offset = target_zip.fp.tell()
+        target_zip.fp.write(new_info.FileHeader(zip64))
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = source_fp.read(min(chunk_size, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Запись {info.filename} обрезана")
+            target_zip.fp.write(chunk)
+            remaining -= len(chunk)
+        target_zip.start_dir = target_zip.fp.tell()
+        target_zip.filelist.append(new_info)
+        target_zip.NameToInfo[new_info.filename] = new_info
+    return new_info
+
+def benchmark_packing(directory: str, specs=('deflate:6', 'deflate:9', 'bzip2:9', 'lzma')) -> Dict[str, dict]:
+    """Сравнение методов сжатия на каталоге: размер архива и время упаковки"""
+    results = {}
+    files = [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for spec in specs:
+            packer = ArchivePacker.from_spec(spec)
+            archive_path = os.path.join(temp_dir, 'bench.zip')
+            started = time.perf_counter()
+            with packer.open(archive_path) as zipf:
+                for file_path in files:
+                    packer.write(zipf, file_path, os.path.relpath(file_path, directory))
+            results[spec] = {
+                'seconds': time.perf_counter() - started,
+                'archive_bytes': os.path.getsize(archive_path),
+                **packer.stats.to_dict()
+            }
+    return results
@@ -11,14 +11,21 @@ from datetime import datetime
 from typing import List, Optional, Dict
 from pathlib import Path
 
+from archive_packer import ArchivePacker, DEFAULT_COMPRESSION
+
 logger = logging.getLogger(__name__)
 
 class BackupManager:
     """Менеджер резервных копий"""
     
-    def __init__(self, backup_dir: str = "launcher_backups"):
+    def __init__(self, backup_dir: str = "launcher_backups", compression: str = DEFAULT_COMPRESSION):
         self.backup_dir = Path(backup_dir)
         self.backup_dir.mkdir(exist_ok=True)
+        try:
+            self.packer = ArchivePacker.from_spec(compression)
+        except ValueError as e:
+            logger.warning(f"{e}, используется {DEFAULT_COMPRESSION}")
+            self.packer = ArchivePacker.from_spec(DEFAULT_COMPRESSION)
         self.index_file = self.backup_dir / "backup_index.json"
         self.backups_index = self.load_index()
     
@@ -50,7 +57,7 @@ class BackupManager:
             
             logger.info(f"Создание резервной копии: {backup_filename}")
             
-            with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as backup_zip:
+            with self.packer.open(backup_path) as backup_zip:
                 # Создаем манифест файлов для восстановления
                 manifest = {
                     'version': version,
@@ -65,8 +72,8 @@ class BackupManager:
                             rel_path = os.path.relpath(file_path)
                             file_size = os.path.getsize(file_path)
                             
-                            # Добавляем файл в архив
-                            backup_zip.write(file_path, rel_path)
+                            # Добавляем файл в архив (несжимаемые - без сжатия)
+                            self.packer.write(backup_zip, file_path, rel_path)
                             
                             # Обновляем манифест
                             manifest['files'].append({
@@ -90,7 +97,8 @@ class BackupManager:
                 'created_at': datetime.now().isoformat(),
                 'description': description,
                 'files_count': len(manifest['files']),
-                'size_bytes': os.path.getsize(backup_path)
+                'size_bytes': os.path.getsize(backup_path),
+                'packing': self.packer.stats.to_dict()
             }
             
             self.backups_index[version] = backup_info
@@ -99,6 +107,7 @@ class BackupManager:
             logger.info(f"Резервная копия создана: {backup_filename} "
                        f"({len(manifest['files'])} файлов, "
                        f"{backup_info['size_bytes']} байт)")
+            logger.info(self.packer.stats.summary())
             
             return str(backup_path)
             
@@ -45,20 +45,128 @@ class DownloadChunk:
     speed: float = 0.0
     retry_count: int = 0
 
+class SlidingWindowStats:
+    """Скользящая статистика скорости с амортизированной сложностью O(1) на образец
+
+    Хранит окно последних ``window_size`` значений с накопленной суммой,
+    монотонную очередь для максимума, EWMA и кольцевой буфер секундных
+    корзин для усреднения за произвольное окно времени.
+    """
+    
+    def __init__(self, window_size: int = 100, ewma_alpha: float = 0.3,
+                 max_window_seconds: int = 300):
+        self.window_size = window_size
+        self.ewma_alpha = ewma_alpha
+        self.values: deque = deque(maxlen=window_size)
+        self.count = 0  # Общее количество образцов за всё время
+        self.total = 0.0  # Сумма значений в окне
+        self.ewma = 0.0
+        self.last_value = 0.0
+        # Монотонно убывающая очередь пар (номер образца, значение)
+        self._max_queue: deque = deque()
+        # Кольцевой буфер секундных корзин: секунда, сумма, количество
+        self._bucket_count = max_window_seconds
+        self._bucket_second = [-1] * max_window_seconds
+        self._bucket_sum = [0.0] * max_window_seconds
+        self._bucket_samples = [0] * max_window_seconds
+    
+    def add(self, value: float, timestamp: float):
+        """Добавление значения"""
+        if len(self.values) == self.window_size:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+        
+        seq = self.count
+        self.count += 1
+        while self._max_queue and self._max_queue[-1][1] <= value:
+            self._max_queue.pop()
+        self._max_queue.append((seq, value))
+        while self._max_queue[0][0] <= seq - self.window_size:
+            self._max_queue.popleft()
+        
+        if self.count == 1:
+            self.ewma = value
+        else:
+            self.ewma += self.ewma_alpha * (value - self.ewma)
+        self.last_value = value
+        
+        second = int(timestamp)
+        idx = second % self._bucket_count
+        if self._bucket_second[idx] != second:
+            self._bucket_second[idx] = second
+            self._bucket_sum[idx] = 0.0
+            self._bucket_samples[idx] = 0
+        self._bucket_sum[idx] += value
+        self._bucket_samples[idx] += 1
+    
+    @property
+    def mean(self) -> float:
+        """Среднее значение в окне образцов"""
+        return self.total / len(self.values) if self.values else 0.0
+    
+    @property
+    def peak(self) -> float:
+        """Максимальное значение в окне образцов"""
+        return self._max_queue[0][1] if self._max_queue else 0.0
+    
+    def time_window_mean(self, window_seconds: int, now: float) -> float:
+        """Среднее значение за последние ``window_seconds`` секунд"""
+        current_second = int(now)
+        window = min(max(int(window_seconds), 1), self._bucket_count)
+        total = 0.0
+        samples = 0
+        for second in range(current_second - window + 1, current_second + 1):
+            idx = second % self._bucket_count
+            if self._bucket_second[idx] == second:
+                total += self._bucket_sum[idx]
+                samples += self._bucket_samples[idx]
+        return total / samples if samples else 0.0
+    
+    def percentile(self, percent: float) -> float:
+        """Перцентиль значений в окне образцов (вычисляется при запросе)"""
+        if not self.values:
+            return 0.0
+        ordered = sorted(self.values)
+        rank = (len(ordered) - 1) * percent / 100.0
+        lower = int(rank)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+    
+    def to_dict(self) -> dict:
+        """Сводка статистики в МБ/с"""
+        return {
+            'current_speed_mbps': self.last_value,
+            'ewma_speed_mbps': self.ewma,
+            'average_speed_mbps': self.mean,
+            'peak_speed_mbps': self.peak,
+            'p50_speed_mbps': self.percentile(50),
+            'p95_speed_mbps': self.percentile(95),
+            'samples_count': len(self.values)
+        }
+
 class BandwidthMonitor:
     """Мониторинг пропускной способности"""
     
-    def __init__(self, sample_size: int = 100):
+    def __init__(self, sample_size: int = 100, ewma_alpha: float = 0.3,
+                 max_window_seconds: int = 300):
         self.samples: deque = deque(maxlen=sample_size)
         self.current_speed = 0.0
         self.peak_speed = 0.0
         self.average_speed = 0.0
+        self.ewma_speed = 0.0
+        self._sample_size = sample_size
+        self._ewma_alpha = ewma_alpha
+        self._max_window_seconds = max_window_seconds
+        self._stats = SlidingWindowStats(sample_size, ewma_alpha, max_window_seconds)
+        self._source_stats: Dict[str, SlidingWindowStats] = {}
         self._lock = threading.Lock()
     
     def add_sample(self, bytes_downloaded: int, time_elapsed: float, source: str = "download"):
         """Добавление образца скорости"""
         if time_elapsed > 0:
             bytes_per_second = bytes_downloaded / time_elapsed
+            speed_mbps = bytes_per_second / 1024 / 1024
             
             with self._lock:
                 sample = BandwidthSample(
@@ -68,35 +176,47 @@ class BandwidthMonitor:
                 )
                 
                 self.samples.append(sample)
-                self.current_speed = bytes_per_second / 1024 / 1024  # МБ/с
+                self._stats.add(speed_mbps, sample.timestamp)
+                
+                source_stats = self._source_stats.get(source)
+                if source_stats is None:
+                    source_stats = SlidingWindowStats(
+                        self._sample_size, self._ewma_alpha, self._max_window_seconds
+                    )
+                    self._source_stats[source] = source_stats
+                source_stats.add(speed_mbps, sample.timestamp)
                 
                 # Обновляем статистику
-                if self.samples:
-                    speeds = [s.bytes_per_second / 1024 / 1024 for s in self.samples]
-                    self.peak_speed = max(speeds)
-                    self.average_speed = statistics.mean(speeds)
+                self.current_speed = speed_mbps  # МБ/с
+                self.peak_speed = self._stats.peak
+                self.average_speed = self._stats.mean
+                self.ewma_speed = self._stats.ewma
     
     def get_current_bandwidth(self) -> float:
         """Получение текущей пропускной способности в МБ/с"""
         with self._lock:
             return self.current_speed
     
+    def get_smoothed_bandwidth(self) -> float:
+        """Получение сглаженной (EWMA) пропускной способности в МБ/с"""
+        with self._lock:
+            return self.ewma_speed
+    
     def get_average_bandwidth(self, window_seconds: int = 60) -> float:
         """Получение средней пропускной способности за окно времени"""
-        current_time = time.time()
-        cutoff_time = current_time - window_seconds
-        
         with self._lock:
-            recent_samples = [
-                s for s in self.samples 
-                if s.timestamp >= cutoff_time
-            ]
-            
-            if recent_samples:
-                speeds = [s.bytes_per_second / 1024 / 1024 for s in recent_samples]
-                return statistics.mean(speeds)
-            
-            return 0.0
+            return self._stats.time_window_mean(window_seconds, time.time())
+    
+    def get_percentile(self, percent: float, source: Optional[str] = None) -> float:
+        """Получение перцентиля скорости в МБ/с (по всем источникам или по одному)"""
+        with self._lock:
+            stats = self._stats if source is None else self._source_stats.get(source)
+            return stats.percentile(percent) if stats else 0.0
+    
+    def get_source_statistics(self) -> Dict[str, dict]:
+        """Статистика в разрезе источников ("download", "peer", ...)"""
+        with self._lock:
+            return {source: stats.to_dict() for source, stats in self._source_stats.items()}
     
     def get_statistics(self) -> dict:
         """Получение статистики мониторинга"""
@@ -105,10 +225,31 @@ class BandwidthMonitor:
                 'current_speed_mbps': self.current_speed,
                 'average_speed_mbps': self.average_speed,
                 'peak_speed_mbps': self.peak_speed,
+                'ewma_speed_mbps': self.ewma_speed,
+                'p50_speed_mbps': self._stats.percentile(50),
+                'p95_speed_mbps': self._stats.percentile(95),
                 'samples_count': len(self.samples),
-                'last_sample_time': self.samples[-1].timestamp if self.samples else 0
+                'last_sample_time': self.samples[-1].timestamp if self.samples else 0,
+                'sources': {source: stats.to_dict() for source, stats in self._source_stats.items()}
             }
 
+def benchmark_bandwidth_monitor(samples: int = 100000, sample_size: int = 100) -> dict:
+    """Микро-бенчмарк стоимости add_sample (наносекунд на образец)"""
+    monitor = BandwidthMonitor(sample_size=sample_size)
+    sources = ("download", "peer", "parallel_download")
+    
+    start = time.perf_counter()
+    for i in range(samples):
+        monitor.add_sample(1024 * (i % 512 + 1), 0.1, sources[i % len(sources)])
+    elapsed = time.perf_counter() - start
+    
+    return {
+        'samples': samples,
+        'sample_size': sample_size,
+        'total_seconds': elapsed,
+        'ns_per_sample': elapsed / samples * 1e9 if samples else 0.0
+    }
+
 class AdaptiveBandwidthController:
     """Адаптивный контроллер пропускной способности"""
     
@@ -189,6 +330,104 @@ class AdaptiveBandwidthController:
         """Получение оптимального количества соединений"""
         return self.current_connections
 
+class TokenBucket:
+    """Ограничитель скорости по алгоритму token bucket (для фоновых загрузок)"""
+    
+    def __init__(self, rate_bytes_per_second: float, capacity: Optional[float] = None):
+        self.rate = rate_bytes_per_second
+        self.capacity = capacity if capacity is not None else max(rate_bytes_per_second, 64 * 1024)
+        self.tokens = self.capacity
+        self._last_refill = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+    
+    async def consume(self, nbytes: int):
+        """Ожидание разрешения на передачу ``nbytes`` байт"""
+        if self.rate <= 0:
+            return  # Ограничение отключено
+        
+        while True:
+            self._refill()
+            # Запрос крупнее ёмкости ведра пропускаем, как только ведро заполнено
+            needed = min(nbytes, self.capacity)
+            if self.tokens >= needed:
+                self.tokens -= nbytes
+                return
+            await asyncio.sleep((needed - self.tokens) / self.rate)
+
+class ProgressAggregator:
+    """Агрегированный канал прогресса для параллельной загрузки
+
+    Воркеры чанков передают дельты байт через ``push``, единственный
+    потребитель ``run`` суммирует их и не чаще ``interval`` секунд
+    публикует прогресс и образцы в монитор пропускной способности.
+    """
+    
+    def __init__(self, total_size: int, progress_callback: Optional[Callable] = None,
+                 bandwidth_monitor: Optional[BandwidthMonitor] = None,
+                 source: str = "download", interval: float = 0.1):
+        self.total_size = total_size
+        self.progress_callback = progress_callback
+        self.bandwidth_monitor = bandwidth_monitor
+        self.source = source
+        self.interval = interval
+        self.downloaded = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._start_time = time.time()
+    
+    def push(self, nbytes: int):
+        """Передача дельты байт от воркера (отрицательная при откате попытки)"""
+        self._queue.put_nowait(nbytes)
+    
+    def close(self):
+        """Сигнал потребителю о завершении"""
+        self._queue.put_nowait(None)
+    
+    async def run(self):
+        """Потребитель дельт: ожидает события вместо периодического опроса"""
+        last_emit_time = self._start_time
+        last_emit_bytes = 0
+        
+        while True:
+            delta = await self._queue.get()
+            if delta is None:
+                break
+            self.downloaded += delta
+            
+            # Забираем всё накопившееся без ожидания
+            closed = False
+            while not self._queue.empty():
+                delta = self._queue.get_nowait()
+                if delta is None:
+                    closed = True
+                    break
+                self.downloaded += delta
+            if closed:
+                break
+            
+            now = time.time()
+            if now - last_emit_time >= self.interval:
+                self._emit(now, now - last_emit_time, self.downloaded - last_emit_bytes)
+                last_emit_time = now
+                last_emit_bytes = self.downloaded
+        
+        now = time.time()
+        self._emit(now, now - last_emit_time, self.downloaded - last_emit_bytes)
+    
+    def _emit(self, now: float, interval_elapsed: float, interval_bytes: int):
+        """Публикация прогресса и образца скорости"""
+        if self.bandwidth_monitor and interval_bytes > 0 and interval_elapsed > 0:
+            self.bandwidth_monitor.add_sample(interval_bytes, interval_elapsed, self.source)
+        
+        if self.progress_callback and self.total_size > 0:
+            progress = min(max(self.downloaded, 0) / self.total_size, 1.0)
+            elapsed = now - self._start_time
+            speed = self.downloaded / elapsed / 1024 / 1024 if elapsed > 0 else 0
+            self.progress_callback(progress, speed)
+
 class ParallelDownloader:
     """Параллельный загрузчик с оптимизацией пропускной способности"""
     
@@ -292,7 +531,6 @@ class ParallelDownloader:
                                       total_size: int) -> bool:
         """Параллельная загрузка чанков"""
         
-        total_downloaded = 0
         download_start_time = time.time()
         
         # Временные файлы для чанков
@@ -301,44 +539,36 @@ class ParallelDownloader:
             chunk_file = f"{local_path}.chunk{i}"
             chunk_files.append(chunk_file)
         
+        # Воркеры передают дельты байт, единственный потребитель публикует прогресс
+        aggregator = ProgressAggregator(
+            total_size, progress_callback, self.bandwidth_monitor, "parallel_download"
+        )
+        consumer = asyncio.create_task(aggregator.run())
+        tasks = []
+        
         try:
             # Запускаем загрузку всех чанков параллельно
-            tasks = []
             for i, chunk in enumerate(chunks):
-                task = self._download_single_chunk(chunk, chunk_files[i])
+                task = asyncio.create_task(
+                    self._download_single_chunk(chunk, chunk_files[i], aggregator)
+                )
                 tasks.append(task)
             
-            # Мониторим прогресс
-            while not all(chunk.completed for chunk in chunks):
-                await asyncio.sleep(0.1)
-                
-                # Обновляем статистику
-                current_downloaded = sum(chunk.bytes_downloaded for chunk in chunks)
-                if progress_callback:
-                    progress = current_downloaded / total_size
-                    elapsed = time.time() - download_start_time
-                    speed = current_downloaded / elapsed / 1024 / 1024 if elapsed > 0 else 0
-                    progress_callback(progress, speed)
-                
-                # Обновляем мониторинг пропускной способности
-                if current_downloaded > total_downloaded:
-                    bytes_diff = current_downloaded - total_downloaded
-                    self.bandwidth_monitor.add_sample(bytes_diff, 0.1, "parallel_download")
-                    total_downloaded = current_downloaded
-            
-            # Ждем завершения всех задач
-            await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Проверяем успешность загрузки всех чанков
-            if not all(chunk.completed for chunk in chunks):
-                raise Exception("Не все чанки загружены успешно")
+            # Завершение определяется результатами задач: первая неудача отменяет остальные
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
             
             # Объединяем чанки в финальный файл
             await self._merge_chunks(chunk_files, local_path)
             
             # Обновляем контроллер производительности
             total_elapsed = time.time() - download_start_time
-            actual_speed = total_size / total_elapsed / 1024 / 1024
+            actual_speed = total_size / total_elapsed / 1024 / 1024 if total_elapsed > 0 else 0
             target_speed = self.bandwidth_monitor.get_average_bandwidth()
             self.controller.analyze_performance(actual_speed, target_speed)
             
@@ -350,6 +580,9 @@ class ParallelDownloader:
             return False
         
         finally:
+            aggregator.close()
+            await consumer
+            
             # Удаляем временные файлы
             for chunk_file in chunk_files:
                 try:
@@ -358,11 +591,17 @@ class ParallelDownloader:
                 except Exception as e:
                     logger.warning(f"Не удалось удалить временный файл {chunk_file}: {e}")
     
-    async def _download_single_chunk(self, chunk: DownloadChunk, chunk_file: str):
+    async def _download_single_chunk(self, chunk: DownloadChunk, chunk_file: str,
+                                     aggregator: Optional['ProgressAggregator'] = None):
         """Загрузка одного чанка"""
         max_retries = 3
         
         for attempt in range(max_retries):
+            # Повторная попытка перезаписывает файл чанка, откатываем учтённые байты
+            if chunk.bytes_downloaded and aggregator:
+                aggregator.push(-chunk.bytes_downloaded)
+            chunk.bytes_downloaded = 0
+            
             try:
                 headers = {
                     'Range': f'bytes={chunk.start}-{chunk.end}'
@@ -379,6 +618,8 @@ class ParallelDownloader:
                             async for data in response.content.iter_chunked(8192):
                                 f.write(data)
                                 chunk.bytes_downloaded += len(data)
+                                if aggregator:
+                                    aggregator.push(len(data))
                         
                         elapsed = time.time() - start_time
                         chunk.speed = chunk.bytes_downloaded / elapsed / 1024 / 1024 if elapsed > 0 else 0
@@ -395,6 +636,7 @@ class ParallelDownloader:
                     await asyncio.sleep(2 ** attempt)  # Экспоненциальная задержка
         
         logger.error(f"Не удалось загрузить чанк {chunk.start}-{chunk.end} после {max_retries} попыток")
+        raise Exception(f"Чанк {chunk.start}-{chunk.end} не загружен")
     
     async def _merge_chunks(self, chunk_files: List[str], output_file: str):
         """Объединение чанков в финальный файл"""
@@ -259,10 +259,19 @@ class MetadataCache:
         """Сохранение манифеста в кэш"""
         return self.cache_manager.set(manifest_url, manifest_data, ttl=3600)
     
+    def get_delta_index(self, server_url: str) -> Optional[dict]:
+        """Получение индекса дельт из кэша"""
+        return self.cache_manager.get(f"{server_url}/deltas.json", ttl=300)  # 5 минут, как версия
+    
+    def set_delta_index(self, server_url: str, delta_index: dict) -> bool:
+        """Сохранение индекса дельт в кэш"""
+        return self.cache_manager.set(f"{server_url}/deltas.json", delta_index, ttl=300)
+    
     def invalidate_version(self, server_url: str, version: str = None):
         """Инвалидация кэша для конкретной версии"""
-        # Удаляем информацию о версии
+        # Удаляем информацию о версии и индекс дельт
         self.cache_manager.delete(f"{server_url}/version.txt")
+        self.cache_manager.delete(f"{server_url}/deltas.json")
         
         # Если указана версия, удаляем связанные с ней данные
         if version:
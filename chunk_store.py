@@ -0,0 +1,730 @@
+"""
+Хранилище чанков с content-defined chunking (CDC) для крупных архивов игры
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import functools
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Callable, Iterator, BinaryIO, Tuple
+from dataclasses import dataclass
+from datetime import datetime
+
+from merkle_manifest import manifest_tree, manifest_header_payload
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+    logging.warning("aiohttp недоступен - загрузка чанков отключена")
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+CHUNK_MANIFEST_FORMAT = 'cdc-v1'
+CHUNKER_ALGORITHM = 'fastcdc-gear64'
+
+# Те же исключения, что и при создании манифеста дельт
+EXCLUDED_DIRS = {'logs', 'launcher_data', 'launcher_backups', '__pycache__'}
+EXCLUDED_SUFFIXES = ('.tmp', '.log', '.pyc')
+
+_MASK64 = (1 << 64) - 1
+_GEAR_BLOCK = 32 * 1024  # позиций на блок векторного gear-хеша
+
+def _build_gear_table() -> List[int]:
+    """Детерминированная таблица gear-хеша (одинаковая на сервере и клиенте)"""
+    return [
+        int.from_bytes(hashlib.sha256(b'launcher-cdc-gear' + bytes([i])).digest()[:8], 'little')
+        for i in range(256)
+    ]
+
+GEAR_TABLE = _build_gear_table()
+GEAR_TABLE_NP = np.array(GEAR_TABLE, dtype=np.uint64) if NUMPY_AVAILABLE else None
+
+# Имя сохранённого манифеста установленной версии в кэше чанков
+INSTALLED_MANIFEST_NAME = 'installed_manifest.json'
+
+@dataclass
+class ChunkRef:
+    """Ссылка на чанк в составе файла"""
+    hash: str
+    size: int
+
+@dataclass
+class ChunkStoreInfo:
+    """Информация о собранном хранилище чанков версии"""
+    version: str
+    files_count: int
+    chunks_count: int
+    unique_chunks: int
+    total_size: int
+    unique_size: int
+    new_chunks: int
+    new_size: int
+    dedup_ratio: float
+    created_at: str
+
+class CDCChunker:
+    """Разбиение потока на чанки по содержимому (FastCDC с нормализацией)
+
+    Граница чанка определяется скользящим gear-хешем, поэтому вставка или
+    удаление байтов в середине файла сдвигает лишь соседние границы, а
+    остальные чанки совпадают с предыдущей версией.
+    """
+
+    def __init__(self, min_size: int = 16 * 1024, avg_size: int = 64 * 1024,
+                 max_size: int = 256 * 1024):
+        if not (0 < min_size <= avg_size <= max_size):
+            raise ValueError("Ожидается min_size <= avg_size <= max_size")
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+
+        bits = max(avg_size.bit_length() - 1, 4)
+        # Используются старшие биты: в них накоплено влияние последних 64 байт
+        self.mask_small = ((1 << (bits + 2)) - 1) << (64 - bits - 2)
+        self.mask_large = ((1 << (bits - 2)) - 1) << (64 - bits + 2)
+
+    def get_params(self) -> dict:
+        return {
+            'algorithm': CHUNKER_ALGORITHM,
+            'min_size': self.min_size,
+            'avg_size': self.avg_size,
+            'max_size': self.max_size
+        }
+
+    @classmethod
+    def from_params(cls, params: dict) -> 'CDCChunker':
+        if params.get('algorithm', CHUNKER_ALGORITHM) != CHUNKER_ALGORITHM:
+            raise ValueError(f"Неизвестный алгоритм чанкинга: {params.get('algorithm')}")
+        return cls(params['min_size'], params['avg_size'], params['max_size'])
+
+    def _gear_hits(self, data) -> tuple:
+        """Позиции буфера, где gear-хеш окна 64 байт проходит маски (numpy)
+
+        После 64 сдвигов байт выпадает из хеша, поэтому хеш позиции зависит
+        только от последних 64 байт и считается для всего буфера сразу
+        удвоением окна: H_2w(i) = H_w(i) + (H_w(i - w) << w).
+        """
+        values = np.frombuffer(data, dtype=np.uint8)
+        # Обе маски - старшие биты, поэтому проверка - сравнение, а позиции
+        # малой маски (больше бит) - подмножество позиций большой
+        large_limit = np.uint64(_MASK64 ^ self.mask_large)
+        small_limit = np.uint64(_MASK64 ^ self.mask_small)
+        shifted = np.empty(_GEAR_BLOCK + 63, dtype=np.uint64)
+        small_parts, large_parts = [], []
+        # Блоками с перекрытием в 63 байта: рабочий набор остаётся в кэше процессора
+        for block_start in range(0, len(values), _GEAR_BLOCK):
+            context_start = max(0, block_start - 63)
+            hashes = GEAR_TABLE_NP[values[context_start:block_start + _GEAR_BLOCK]]
+            width = 1
+            while width < 64:
+                np.left_shift(hashes[:-width], np.uint64(width), out=shifted[width:len(hashes)])
+                hashes[width:] += shifted[width:len(hashes)]
+                width *= 2
+            hashes = hashes[block_start - context_start:]
+            positions = np.flatnonzero(hashes <= large_limit)
+            small_parts.append(positions[hashes[positions] <= small_limit] + block_start)
+            large_parts.append(positions + block_start)
+        if not large_parts:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        return np.concatenate(small_parts), np.concatenate(large_parts)
+
+    def _cut_point(self, data, start: int, end: int, hits: Optional[tuple] = None) -> int:
+        """Длина очередного чанка, начинающегося с ``start``
+
+        ``hits`` - результат ``_gear_hits`` для ``data``: побайтово
+        считаются лишь первые 63 позиции после сброса хеша (в их окне
+        меньше 64 байт), дальше граница ищется по готовым позициям.
+        """
+        length = end - start
+        if length <= self.min_size:
+            return length
+        if length > self.max_size:
+            length = self.max_size
+        normal = min(self.avg_size, length)
+
+        gear = GEAR_TABLE
+        mask = self.mask_small
+        h = 0
+        i = start + self.min_size
+        if hits is not None:
+            stop = min(i + 63, start + length)
+            while i < stop:
+                h = ((h << 1) + gear[data[i]]) & _MASK64
+                if not h & (self.mask_small if i < start + normal else self.mask_large):
+                    return i - start + 1
+                i += 1
+            small_hits, large_hits = hits
+            for positions, low, high in ((small_hits, i, start + normal),
+                                         (large_hits, max(i, start + normal), start + length)):
+                if low < high:
+                    index = int(np.searchsorted(positions, low))
+                    if index < len(positions) and positions[index] < high:
+                        return int(positions[index]) - start + 1
+            return length
+
+        stop = start + normal
+        while i < stop:
+            h = ((h << 1) + gear[data[i]]) & _MASK64
+            if not h & mask:
+                return i - start + 1
+            i += 1
+
+        mask = self.mask_large
+        stop = start + length
+        while i < stop:
+            h = ((h << 1) + gear[data[i]]) & _MASK64
+            if not h & mask:
+                return i - start + 1
+            i += 1
+        return length
+
+    def iter_chunks(self, stream: BinaryIO, read_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """Потоковое разбиение: в памяти не больше read_size + max_size байт"""
+        buffer = bytearray()
+        offset = 0
+        eof = False
+        hits = None
+        while True:
+            if not eof and len(buffer) - offset < self.max_size:
+                data = stream.read(read_size)
+                if data:
+                    del buffer[:offset]
+                    offset = 0
+                    buffer += data
+                    hits = None
+                    continue
+                eof = True
+
+            if offset >= len(buffer):
+                return
+            if NUMPY_AVAILABLE and hits is None:
+                hits = self._gear_hits(buffer)
+            cut = self._cut_point(buffer, offset, len(buffer), hits)
+            yield bytes(buffer[offset:offset + cut])
+            offset += cut
+
+    def chunk_file(self, file_path: str) -> Tuple[str, int, List[ChunkRef]]:
+        """Разбиение файла: (sha256 файла, размер, список чанков)"""
+        file_hasher = hashlib.sha256()
+        chunks = []
+        size = 0
+        with open(file_path, 'rb') as f:
+            for chunk in self.iter_chunks(f):
+                file_hasher.update(chunk)
+                size += len(chunk)
+                chunks.append(ChunkRef(hashlib.sha256(chunk).hexdigest(), len(chunk)))
+        return file_hasher.hexdigest(), size, chunks
+
+class ChunkStore:
+    """Хранилище чанков с адресацией по SHA-256 (chunks/ab/abcdef...)"""
+
+    def __init__(self, store_dir: str):
+        self.store_dir = Path(store_dir)
+        self.chunks_dir = self.store_dir / "chunks"
+        self.chunks_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def relative_chunk_path(chunk_hash: str) -> str:
+        """Путь чанка относительно корня хранилища (совпадает с URL на сервере)"""
+        return f"chunks/{chunk_hash[:2]}/{chunk_hash}"
+
+    def chunk_path(self, chunk_hash: str) -> Path:
+        return self.store_dir / self.relative_chunk_path(chunk_hash)
+
+    def has_chunk(self, chunk_hash: str) -> bool:
+        return self.chunk_path(chunk_hash).exists()
+
+    def put_chunk(self, chunk_hash: str, data: bytes) -> bool:
+        """Сохранение чанка; False если он уже был в хранилище"""
+        path = self.chunk_path(chunk_hash)
+        if path.exists():
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = Path(f"{path}.tmp")
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return True
+
+    def get_chunk(self, chunk_hash: str) -> Optional[bytes]:
+        path = self.chunk_path(chunk_hash)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+def _iter_tree(directory: str) -> Iterator[Tuple[str, str]]:
+    """Обход дерева файлов: (полный путь, относительный путь с '/')"""
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d not in EXCLUDED_DIRS]
+        for file in files:
+            if file.startswith('.') or file.endswith(EXCLUDED_SUFFIXES):
+                continue
+            file_path = os.path.join(root, file)
+            relative_path = os.path.relpath(file_path, directory).replace('\\', '/')
+            yield file_path, relative_path
+
+def _is_excluded(relative_path: str) -> bool:
+    """Путь, который ``_iter_tree`` не включает в манифест (и, значит, не удаляется)"""
+    parts = relative_path.split('/')
+    if any(part.startswith('.') for part in parts) or any(part in EXCLUDED_DIRS for part in parts[:-1]):
+        return True
+    return parts[-1].endswith(EXCLUDED_SUFFIXES)
+
+class ChunkStoreGenerator:
+    """Серверная сборка хранилища чанков и манифеста версии
+
+    Альтернатива ``DeltaGenerator``: вместо пар дельт "A -> B" публикуется
+    общее хранилище чанков и для каждой версии список чанков каждого файла.
+    Одинаковые чанки разных файлов и версий хранятся один раз.
+    """
+
+    def __init__(self, chunker: Optional[CDCChunker] = None):
+        self.chunker = chunker or CDCChunker()
+
+    def build_chunk_manifest(self, directory: str, version: str, store_dir: str,
+                             manifest_path: str, signer=None) -> Optional[ChunkStoreInfo]:
+        """Разбиение дерева версии на чанки и запись манифеста
+
+        Записи файлов становятся листьями дерева Меркла (merkle_manifest);
+        при переданном ``signer`` (``crypto_signer.Signer``) подписывается
+        заголовок с корнем, как у манифеста релиза. Списки чанков подписью
+        не покрываются: собранный файл сверяется с подписанным хешем.
+        """
+        try:
+            store = ChunkStore(store_dir)
+            manifest = {
+                'format': CHUNK_MANIFEST_FORMAT,
+                'version': version,
+                'chunker': self.chunker.get_params(),
+                'created_at': datetime.now().isoformat(),
+                'files': {}
+            }
+            seen: Dict[str, int] = {}
+            total_size = 0
+            chunks_count = 0
+            new_chunks = 0
+            new_size = 0
+
+            for file_path, relative_path in _iter_tree(directory):
+                file_hasher = hashlib.sha256()
+                chunk_list = []
+                file_size = 0
+                try:
+                    with open(file_path, 'rb') as f:
+                        for chunk in self.chunker.iter_chunks(f):
+                            chunk_hash = hashlib.sha256(chunk).hexdigest()
+                            file_hasher.update(chunk)
+                            file_size += len(chunk)
+                            chunk_list.append([chunk_hash, len(chunk)])
+                            if chunk_hash not in seen:
+                                seen[chunk_hash] = len(chunk)
+                                if store.put_chunk(chunk_hash, chunk):
+                                    new_chunks += 1
+                                    new_size += len(chunk)
+                except OSError as e:
+                    logger.warning(f"Ошибка обработки файла {file_path}: {e}")
+                    continue
+
+                manifest['files'][relative_path] = {
+                    'size': file_size,
+                    'hash': file_hasher.hexdigest(),
+                    'chunks': chunk_list
+                }
+                total_size += file_size
+                chunks_count += len(chunk_list)
+
+            for index, relative_path in enumerate(sorted(manifest['files'])):
+                manifest['files'][relative_path]['leaf'] = index
+            manifest['hash_algorithm'] = 'sha256'
+            manifest['leaf_count'] = len(manifest['files'])
+            manifest['merkle_root'] = manifest_tree(manifest['files']).root.hex()
+            if signer is not None:
+                signature = signer.sign_data(manifest_header_payload(manifest))
+                if not signature:
+                    logger.error("Не удалось подписать манифест чанков")
+                    return None
+                manifest['signature'] = signature
+
+            unique_size = sum(seen.values())
+            manifest['chunks_count'] = chunks_count
+            manifest['unique_chunks'] = len(seen)
+            manifest['unique_size'] = unique_size
+
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+
+            info = ChunkStoreInfo(
+                version=version,
+                files_count=len(manifest['files']),
+                chunks_count=chunks_count,
+                unique_chunks=len(seen),
+                total_size=total_size,
+                unique_size=unique_size,
+                new_chunks=new_chunks,
+                new_size=new_size,
+                dedup_ratio=unique_size / total_size if total_size > 0 else 1.0,
+                created_at=manifest['created_at']
+            )
+            logger.info(f"Манифест чанков создан: {manifest_path}")
+            logger.info(f"Файлов: {info.files_count}, чанков: {chunks_count}, уникальных: {len(seen)}, "
+                        f"новых в хранилище: {new_chunks} ({new_size} байт)")
+            return info
+
+        except Exception as e:
+            logger.error(f"Ошибка создания манифеста чанков: {e}")
+            return None
+
+class ChunkStoreApplier:
+    """Клиентское обновление по манифесту чанков
+
+    Локальные файлы разбиваются тем же чанкером, совпадающие чанки берутся
+    с диска, недостающие скачиваются в кэш чанков. Файлы собираются во
+    временные копии, проверяются по хешу и только затем подменяются через
+    ``os.replace``.
+    """
+
+    def __init__(self, cache_dir: str = "launcher_data/chunk_cache", max_concurrency: int = 8):
+        self.cache = ChunkStore(cache_dir)
+        self.max_concurrency = max_concurrency
+        self.installed_manifest_path = self.cache.store_dir / INSTALLED_MANIFEST_NAME
+
+    def load_installed_manifest(self, version: Optional[str] = None) -> Optional[dict]:
+        """Манифест последней применённой версии (None, если он не от ``version``)"""
+        try:
+            with open(self.installed_manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if version is not None and manifest.get('version') != version:
+            return None
+        return manifest
+
+    def save_installed_manifest(self, manifest: dict):
+        temp_path = Path(f"{self.installed_manifest_path}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, self.installed_manifest_path)
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _target_path(target_dir: str, relative_path: str) -> str:
+        """Путь файла манифеста внутри ``target_dir``; путь за её пределами - исключение"""
+        target_root = os.path.abspath(target_dir)
+        target_file = os.path.abspath(os.path.join(target_root, relative_path))
+        if not target_file.startswith(target_root + os.sep):
+            raise Exception(f"Путь за пределами целевой директории: {relative_path}")
+        return target_file
+
+    def plan_update(self, manifest: dict, target_dir: str,
+                    previous_manifest: Optional[dict] = None) -> Tuple[Dict[str, dict], Dict[str, tuple], Dict[str, int]]:
+        """Определение изменённых файлов, локальных источников чанков и недостающих чанков
+
+        Локальный файл сначала сверяется по SHA-256 (hashlib, без
+        чанкинга): неизменённые файлы не проходят через gear-хеш. Если
+        файл совпадает с записью ``previous_manifest`` (манифест
+        установленной версии), смещения его чанков берутся оттуда.
+        Чанкер запускается только для файлов, не совпавших ни с одним
+        манифестом.
+        """
+        chunker = CDCChunker.from_params(manifest['chunker'])
+        previous_files = previous_manifest.get('files', {}) if previous_manifest else {}
+        changed_files = {}
+        local_chunks: Dict[str, tuple] = {}  # hash -> (путь, смещение, размер)
+
+        for relative_path, file_info in manifest['files'].items():
+            local_path = self._target_path(target_dir, relative_path)
+            if os.path.isfile(local_path):
+                try:
+                    local_size = os.path.getsize(local_path)
+                    previous_info = previous_files.get(relative_path)
+                    local_hash = None
+                    if local_size == file_info['size'] or (previous_info and local_size == previous_info['size']):
+                        local_hash = self.hash_file(local_path)
+                    if local_size == file_info['size'] and local_hash == file_info['hash']:
+                        continue  # Файл актуален
+                    offset = 0
+                    file_chunks = []
+                    if previous_info and local_hash == previous_info['hash']:
+                        for chunk_hash, chunk_size in previous_info['chunks']:
+                            file_chunks.append((chunk_hash, offset, chunk_size))
+                            offset += chunk_size
+                    else:
+                        with open(local_path, 'rb') as f:
+                            for chunk in chunker.iter_chunks(f):
+                                file_chunks.append((hashlib.sha256(chunk).hexdigest(), offset, len(chunk)))
+                                offset += len(chunk)
+                    for chunk_hash, chunk_offset, chunk_size in file_chunks:
+                        local_chunks.setdefault(chunk_hash, (local_path, chunk_offset, chunk_size))
+                except OSError as e:
+                    logger.warning(f"Не удалось прочитать локальный файл {local_path}: {e}")
+            changed_files[relative_path] = file_info
+
+        missing_chunks = {}
+        for file_info in changed_files.values():
+            for chunk_hash, chunk_size in file_info['chunks']:
+                if chunk_hash not in local_chunks and not self.cache.has_chunk(chunk_hash):
+                    missing_chunks[chunk_hash] = chunk_size
+
+        return changed_files, local_chunks, missing_chunks
+
+    def plan_deletions(self, manifest: dict, target_dir: str, installed_files) -> List[str]:
+        """Файлы установленной версии, которых нет в новом манифесте (глубокие пути первыми)"""
+        deleted_files = []
+        for relative_path in set(installed_files) - set(manifest['files']):
+            if _is_excluded(relative_path):
+                continue
+            target_file = self._target_path(target_dir, relative_path)
+            if os.path.isfile(target_file):
+                deleted_files.append(target_file)
+        deleted_files.sort(key=lambda path: path.count(os.sep), reverse=True)
+        return deleted_files
+
+    async def download_chunks(self, missing_chunks: Dict[str, int], base_url: str,
+                              session: 'aiohttp.ClientSession',
+                              progress_callback: Optional[Callable] = None) -> bool:
+        """Параллельная загрузка недостающих чанков в кэш с проверкой хеша"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        total_bytes = sum(missing_chunks.values())
+        downloaded = 0
+
+        async def fetch(chunk_hash: str):
+            nonlocal downloaded
+            url = f"{base_url.rstrip('/')}/{ChunkStore.relative_chunk_path(chunk_hash)}"
+            async with semaphore:
+                for attempt in range(3):
+                    try:
+                        async with session.get(url) as response:
+                            if response.status != 200:
+                                raise Exception(f"HTTP {response.status}")
+                            data = await response.read()
+                        if hashlib.sha256(data).hexdigest() != chunk_hash:
+                            raise Exception("несовпадение хеша чанка")
+                        self.cache.put_chunk(chunk_hash, data)
+                        downloaded += len(data)
+                        if progress_callback and total_bytes > 0:
+                            progress_callback(int(downloaded / total_bytes * 100))
+                        return
+                    except Exception as e:
+                        logger.warning(f"Ошибка загрузки чанка {chunk_hash[:12]} (попытка {attempt + 1}): {e}")
+                        await asyncio.sleep(2 ** attempt)
+                raise Exception(f"Не удалось загрузить чанк {chunk_hash}")
+
+        results = await asyncio.gather(*(fetch(h) for h in missing_chunks), return_exceptions=True)
+        failures = [r for r in results if isinstance(r, Exception)]
+        if failures:
+            logger.error(f"Не загружено чанков: {len(failures)}")
+            return False
+        return True
+
+    def _read_chunk(self, chunk_hash: str, local_chunks: Dict[str, tuple]) -> bytes:
+        data = self.cache.get_chunk(chunk_hash)
+        if data is not None:
+            return data
+        local_path, offset, size = local_chunks[chunk_hash]
+        with open(local_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(size)
+        if hashlib.sha256(data).hexdigest() != chunk_hash:
+            raise Exception(f"Локальный чанк изменился: {local_path}@{offset}")
+        return data
+
+    @staticmethod
+    def _commit_files(staged: List[tuple], deleted_files: List[str], target_dir: str):
+        """Удаления, затем подмены с откатом уже выполненных при ошибке
+
+        Оригиналы до конца фиксации переносятся во временную директорию
+        внутри ``target_dir``; если откат не удался, она остаётся на диске
+        с резервными копиями.
+        """
+        backup_dir = tempfile.mkdtemp(prefix='.chunk_staging_', dir=os.path.abspath(target_dir))
+        committed = []  # (целевой файл, резервная копия оригинала или None)
+        try:
+            for index, target_file in enumerate(deleted_files):
+                if os.path.isfile(target_file):
+                    backup_file = os.path.join(backup_dir, f"{index}.orig")
+                    os.replace(target_file, backup_file)
+                    committed.append((target_file, backup_file))
+                    logger.debug(f"Удален файл: {target_file}")
+            for index, (temp_file, target_file) in enumerate(staged, len(deleted_files)):
+                backup_file = None
+                if os.path.isfile(target_file):
+                    backup_file = os.path.join(backup_dir, f"{index}.orig")
+                    os.replace(target_file, backup_file)
+                elif os.path.isdir(target_file) and not os.listdir(target_file):
+                    os.rmdir(target_file)  # Директория, ставшая файлом после удалений
+                committed.append((target_file, backup_file))
+                os.replace(temp_file, target_file)
+        except Exception as e:
+            logger.error(f"Ошибка фиксации файлов, откат {len(committed)} файлов: {e}")
+            rollback_complete = True
+            for target_file, backup_file in reversed(committed):
+                try:
+                    if os.path.isfile(target_file):
+                        os.remove(target_file)
+                    if backup_file:
+                        os.makedirs(os.path.dirname(target_file), exist_ok=True)
+                        os.replace(backup_file, target_file)
+                except OSError as rollback_error:
+                    rollback_complete = False
+                    logger.error(f"Не удалось откатить {target_file}: {rollback_error}")
+            if rollback_complete:
+                shutil.rmtree(backup_dir, ignore_errors=True)
+            else:
+                logger.error(f"Резервные копии оригиналов оставлены в {backup_dir}")
+            raise
+        shutil.rmtree(backup_dir, ignore_errors=True)
+
+    def assemble_files(self, changed_files: Dict[str, dict], local_chunks: Dict[str, tuple],
+                       target_dir: str, deleted_files: Optional[List[str]] = None) -> bool:
+        """Сборка изменённых файлов во временные копии и атомарная подмена
+
+        ``deleted_files`` (результат ``plan_deletions``) удаляются после
+        сборки всех файлов и до подмены, как в
+        ``delta_updates.DeltaApplier._commit_changes``; при ошибке фиксации
+        удалённые и заменённые файлы восстанавливаются.
+        """
+        staged = []
+        try:
+            for relative_path, file_info in changed_files.items():
+                target_file = self._target_path(target_dir, relative_path)
+                temp_file = f"{target_file}.cdc.tmp"
+                os.makedirs(os.path.dirname(target_file) or '.', exist_ok=True)
+                file_hasher = hashlib.sha256()
+                with open(temp_file, 'wb') as out:
+                    staged.append((temp_file, target_file))
+                    for chunk_hash, _ in file_info['chunks']:
+                        data = self._read_chunk(chunk_hash, local_chunks)
+                        file_hasher.update(data)
+                        out.write(data)
+                if file_hasher.hexdigest() != file_info['hash']:
+                    raise Exception(f"Хеш собранного файла не совпадает: {relative_path}")
+
+            # Все файлы собраны - удаляем и подменяем (локальные чанки больше не нужны)
+            self._commit_files(staged, deleted_files or [], target_dir)
+            return True
+
+        except Exception as e:
+            logger.error(f"Ошибка сборки файлов из чанков: {e}")
+            for temp_file, _ in staged:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+            return False
+
+    async def apply_chunk_manifest(self, manifest: dict, base_url: str, target_dir: str,
+                                   session: Optional['aiohttp.ClientSession'] = None,
+                                   progress_callback: Optional[Callable] = None,
+                                   installed_version: Optional[str] = None,
+                                   installed_files: Optional[List[str]] = None) -> bool:
+        """Обновление дерева файлов до версии из манифеста чанков
+
+        ``installed_version`` - установленная версия: если для неё сохранён
+        манифест чанков, смещения чанков неизменённых с тех пор файлов
+        берутся из него. Файлы установленной версии (из сохранённого
+        манифеста, иначе ``installed_files``), которых нет в новом
+        манифесте, удаляются. Планирование и сборка (чтение и хеширование
+        файлов) выполняются в пуле потоков, не блокируя цикл событий.
+        """
+        if manifest.get('format') != CHUNK_MANIFEST_FORMAT:
+            logger.error(f"Неподдерживаемый формат манифеста чанков: {manifest.get('format')}")
+            return False
+
+        try:
+            loop = asyncio.get_running_loop()
+            previous_manifest = self.load_installed_manifest(installed_version) if installed_version else None
+            changed_files, local_chunks, missing_chunks = await loop.run_in_executor(
+                None, functools.partial(self.plan_update, manifest, target_dir, previous_manifest))
+            if previous_manifest:
+                installed_files = list(previous_manifest['files'])
+            if installed_files is None:
+                logger.info("Список файлов установленной версии неизвестен, удаление файлов пропущено")
+                installed_files = []
+            deleted_files = self.plan_deletions(manifest, target_dir, installed_files)
+            if not changed_files and not deleted_files:
+                logger.info("Все файлы актуальны, загрузка чанков не требуется")
+                self.save_installed_manifest(manifest)
+                return True
+
+            logger.info(f"Изменённых файлов: {len(changed_files)}, удаляемых: {len(deleted_files)}, "
+                        f"недостающих чанков: {len(missing_chunks)} ({sum(missing_chunks.values())} байт)")
+
+            if missing_chunks:
+                if not AIOHTTP_AVAILABLE:
+                    logger.error("Загрузка чанков недоступна без aiohttp")
+                    return False
+                if session is None:
+                    async with aiohttp.ClientSession() as own_session:
+                        ok = await self.download_chunks(missing_chunks, base_url, own_session, progress_callback)
+                else:
+                    ok = await self.download_chunks(missing_chunks, base_url, session, progress_callback)
+                if not ok:
+                    return False
+
+            if not await loop.run_in_executor(
+                    None, functools.partial(self.assemble_files, changed_files, local_chunks, target_dir,
+                                            deleted_files)):
+                return False
+            self.save_installed_manifest(manifest)
+
+            logger.info(f"Обновление по чанкам применено: {len(changed_files)} файлов, "
+                        f"удалено {len(deleted_files)}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Ошибка применения манифеста чанков: {e}")
+            return False
+
+    def prune_cache(self, keep_manifest: Optional[dict] = None) -> int:
+        """Удаление из кэша чанков, не используемых манифестом"""
+        keep = set()
+        if keep_manifest:
+            for file_info in keep_manifest.get('files', {}).values():
+                keep.update(chunk_hash for chunk_hash, _ in file_info['chunks'])
+        removed = 0
+        for chunk_path in self.cache.chunks_dir.glob('*/*'):
+            if chunk_path.name not in keep:
+                try:
+                    chunk_path.unlink()
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"Не удалось удалить чанк {chunk_path}: {e}")
+        return removed
+
+# Глобальные экземпляры
+_chunk_store_generator = None
+_chunk_store_applier = None
+
+def get_chunk_store_generator() -> ChunkStoreGenerator:
+    """Получение экземпляра генератора хранилища чанков"""
+    global _chunk_store_generator
+    if _chunk_store_generator is None:
+        _chunk_store_generator = ChunkStoreGenerator()
+    return _chunk_store_generator
+
+def get_chunk_store_applier() -> ChunkStoreApplier:
+    """Получение экземпляра применения обновлений по чанкам"""
+    global _chunk_store_applier
+    if _chunk_store_applier is None:
+        _chunk_store_applier = ChunkStoreApplier()
+    return _chunk_store_applier
@@ -1,26 +1,66 @@
+import os
 import json
+import time
 import base64
+import hashlib
 import logging
+import tempfile
 from pathlib import Path
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
 
+from merkle_manifest import build_manifest, manifest_header_payload, hash_pieces
+from signature_algorithms import (DEFAULT_SIGNATURE_ALGORITHM, SIGNATURE_ALGORITHMS, generate_private_key,
+                                  key_algorithm, sign_message)
+
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class ManifestStats:
+    """Время этапов создания манифеста"""
+    files: int = 0
+    hashed_files: int = 0
+    reused_hashes: int = 0
+    signatures: int = 0
+    scan_seconds: float = 0.0
+    hash_seconds: float = 0.0
+    sign_seconds: float = 0.0
+    write_seconds: float = 0.0
+    total_seconds: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def summary(self) -> str:
+        return (f"Файлов: {self.files} (хешировано {self.hashed_files}, хешей из сборки {self.reused_hashes}), "
+                f"подписей: {self.signatures}; обход {self.scan_seconds:.1f} с, "
+                f"хеширование {self.hash_seconds:.1f} с, подпись {self.sign_seconds:.1f} с, "
+                f"запись {self.write_seconds:.1f} с")
+
+
 class Signer:
     """Создание пары ключей и подпись файлов/манифеста (офлайн-утилита)."""
 
-    def __init__(self, keys_dir: str = "crypto_keys"):
+    def __init__(self, keys_dir: str = "crypto_keys", algorithm: Optional[str] = None):
+        if algorithm and algorithm not in SIGNATURE_ALGORITHMS:
+            raise ValueError(f"Неизвестный алгоритм подписи: {algorithm}")
+        # Требуемый алгоритм (None - алгоритм существующего ключа); см. signature_algorithms
+        self.algorithm = algorithm
         self.keys_dir = Path(keys_dir)
         self.keys_dir.mkdir(exist_ok=True)
         self.private_key_path = self.keys_dir / "private_key.pem"
         self.public_key_path = self.keys_dir / "public_key.pem"
+        # Разобранный приватный ключ: PEM читается один раз на экземпляр
+        self._private_key = None
+        self.stats = ManifestStats()
 
     def generate_keys(self) -> bool:
         try:
-            private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            private_key = generate_private_key(self.algorithm or DEFAULT_SIGNATURE_ALGORITHM)
             public_key = private_key.public_key()
 
             pem_private = private_key.private_bytes(
@@ -37,8 +77,9 @@ class Signer:
             )
             with open(self.public_key_path, 'wb') as f:
                 f.write(pem_public)
+            self._private_key = private_key
 
-            logger.info("Сгенерирована пара ключей (private/public)")
+            logger.info(f"Сгенерирована пара ключей (private/public), алгоритм {key_algorithm(private_key)}")
             return True
         except Exception as e:
             logger.error(f"Ошибка генерации ключей: {e}")
@@ -52,11 +93,19 @@ class Signer:
 
     def load_private_key(self):
         try:
+            if self._private_key:
+                return self._private_key
             if not self.private_key_path.exists():
                 logger.warning("Приватный ключ отсутствует. Сгенерируйте его через generate_keys().")
                 return None
             with open(self.private_key_path, 'rb') as f:
-                return load_pem_private_key(f.read(), password=None)
+                private_key = load_pem_private_key(f.read(), password=None)
+            if self.algorithm and key_algorithm(private_key) != self.algorithm:
+                logger.error(f"Ключ {self.private_key_path} не подходит для алгоритма {self.algorithm} "
+                             f"(ключ {key_algorithm(private_key)})")
+                return None
+            self._private_key = private_key
+            return self._private_key
         except Exception as e:
             logger.error(f"Ошибка загрузки приватного ключа: {e}")
             return None
@@ -64,16 +113,25 @@ class Signer:
     @staticmethod
     def hash_file(file_path: str):
         try:
-            import hashlib
             h = hashlib.sha256()
             with open(file_path, 'rb') as f:
-                for chunk in iter(lambda: f.read(4096), b""):
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
                     h.update(chunk)
             return h.hexdigest()
         except Exception as e:
             logger.error(f"Ошибка хеширования файла {file_path}: {e}")
             return None
 
+    @staticmethod
+    def _sign_hash(private_key, hex_hash: str) -> dict:
+        """Подпись hex-хеша (формат подписи файлов и данных); алгоритм определяется ключом"""
+        signature = sign_message(private_key, hex_hash.encode('utf-8'))
+        return {
+            'file_hash': hex_hash,
+            'signature': base64.b64encode(signature).decode('utf-8'),
+            'algorithm': key_algorithm(private_key),
+        }
+
     def sign_file(self, file_path: str):
         try:
             private_key = self.load_private_key()
@@ -82,38 +140,167 @@ class Signer:
             file_hash = self.hash_file(file_path)
             if not file_hash:
                 return None
-            signature = private_key.sign(
-                file_hash.encode('utf-8'),
-                padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
-                hashes.SHA256(),
-            )
-            return {
-                'file_hash': file_hash,
-                'signature': base64.b64encode(signature).decode('utf-8'),
-                'algorithm': 'RSA-PSS-SHA256',
-            }
+            return self._sign_hash(private_key, file_hash)
         except Exception as e:
             logger.error(f"Ошибка подписи файла {file_path}: {e}")
             return None
 
-    def create_manifest(self, files_directory: str, manifest_path: str) -> bool:
+    def sign_data(self, data: bytes):
+        """Подпись произвольных данных (например, индекса дельт)"""
+        try:
+            private_key = self.load_private_key()
+            if not private_key:
+                return None
+            return self._sign_hash(private_key, hashlib.sha256(data).hexdigest())
+        except Exception as e:
+            logger.error(f"Ошибка подписи данных: {e}")
+            return None
+
+    def _collect_hashes(self, files_directory: str, known_hashes: Optional[Dict[str, str]],
+                        workers: int, stats: ManifestStats,
+                        piece_size: Optional[int] = None) -> Optional[Tuple[Dict[str, tuple], Dict[str, list]]]:
+        """Обход каталога и хеши файлов: (путь -> (размер, SHA-256), путь -> хеши кусков)
+
+        При ``piece_size`` файлы крупнее куска читаются всегда: хеш файла
+        и хеши кусков считаются за одно чтение.
+        """
+        started = time.perf_counter()
+        entries = []
+        for file_path in Path(files_directory).rglob('*'):
+            if file_path.is_file() and not file_path.name.startswith('.'):
+                rel = str(file_path.relative_to(files_directory)).replace('\\', '/')
+                entries.append((rel, str(file_path), file_path.stat().st_size))
+        stats.files = len(entries)
+        stats.scan_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        file_hashes = {}
+        pieces = {}
+        to_hash = []
+        to_split = []
+        for rel, full_path, size in entries:
+            known_hash = known_hashes.get(rel) if known_hashes else None
+            if piece_size and size > piece_size:
+                to_split.append((rel, full_path, size))
+            elif known_hash:
+                file_hashes[rel] = (size, known_hash)
+                stats.reused_hashes += 1
+            else:
+                to_hash.append((rel, full_path, size))
+
+        # hashlib отпускает GIL на блоках по 1 МБ - чтение и хеширование идут параллельно
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (rel, full_path, size), file_hash in zip(to_hash, pool.map(self.hash_file,
+                                                                           [item[1] for item in to_hash])):
+                if not file_hash:
+                    return None
+                file_hashes[rel] = (size, file_hash)
+            for (rel, full_path, size), (file_hash, file_pieces) in zip(
+                    to_split, pool.map(lambda path: hash_pieces(path, piece_size), [item[1] for item in to_split])):
+                file_hashes[rel] = (size, file_hash)
+                pieces[rel] = file_pieces
+        stats.hashed_files = len(to_hash) + len(to_split)
+        stats.hash_seconds = time.perf_counter() - started
+        return file_hashes, pieces
+
+    def create_manifest(self, files_directory: str, manifest_path: str, merkle: bool = True,
+                        known_hashes: Optional[Dict[str, str]] = None, workers: Optional[int] = None,
+                        piece_size: Optional[int] = None) -> bool:
+        """Создание манифеста файлов каталога
+
+        По умолчанию хеши файлов становятся листьями дерева Меркла и
+        подписывается только заголовок с корнем - одна операция RSA на
+        релиз (см. merkle_manifest). ``merkle=False`` - прежний формат
+        с подписью каждого файла для старых лаунчеров.
+
+        Ключ загружается один раз, файлы хешируются в пуле из ``workers``
+        потоков. ``known_hashes`` (относительный путь -> SHA-256) - хеши из
+        сборки архива (files_list), такие файлы не перечитываются. Время
+        этапов сохраняется в ``self.stats``.
+
+        ``piece_size`` (только для дерева Меркла) добавляет в записи файлов
+        крупнее куска хеши кусков этого размера: P2P-загрузка проверяет и
+        перезапрашивает каждый кусок отдельно.
+        """
+        stats = ManifestStats()
+        self.stats = stats
+        started = time.perf_counter()
+        workers = max(1, workers or os.cpu_count() or 1)
         try:
-            manifest = {'version': '1.0', 'files': {}, 'created_at': str(Path().cwd())}
-            for file_path in Path(files_directory).rglob('*'):
-                if file_path.is_file() and not file_path.name.startswith('.'):
-                    rel = str(file_path.relative_to(files_directory)).replace('\\', '/')
-                    sig = self.sign_file(str(file_path))
-                    if sig:
+            private_key = self.load_private_key()
+            if not private_key:
+                return False
+            collected = self._collect_hashes(files_directory, known_hashes, workers, stats,
+                                             piece_size if merkle else None)
+            if collected is None:
+                logger.error("Не удалось вычислить хеши файлов манифеста")
+                return False
+            file_hashes, pieces = collected
+
+            phase_started = time.perf_counter()
+            if merkle:
+                manifest = build_manifest(file_hashes, pieces=pieces, piece_size=piece_size)
+                manifest['signature'] = self._sign_hash(
+                    private_key, hashlib.sha256(manifest_header_payload(manifest)).hexdigest())
+                stats.signatures = 1
+            else:
+                manifest = {'version': '1.0', 'files': {}, 'created_at': str(Path().cwd())}
+                paths = sorted(file_hashes)
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    signatures = pool.map(lambda rel: self._sign_hash(private_key, file_hashes[rel][1]), paths)
+                    for rel, sig in zip(paths, signatures):
                         manifest['files'][rel] = {
-                            'size': file_path.stat().st_size,
+                            'size': file_hashes[rel][0],
                             'hash': sig['file_hash'],
                             'signature': sig['signature'],
                             'algorithm': sig['algorithm'],
                         }
+                stats.signatures = len(paths)
+            stats.sign_seconds = time.perf_counter() - phase_started
+
+            phase_started = time.perf_counter()
             with open(manifest_path, 'w', encoding='utf-8') as f:
                 json.dump(manifest, f, ensure_ascii=False, indent=2)
-            logger.info(f"Манифест создан: {manifest_path}")
+            stats.write_seconds = time.perf_counter() - phase_started
+            stats.total_seconds = time.perf_counter() - started
+            logger.info(f"Манифест создан: {manifest_path}. {stats.summary()}")
             return True
         except Exception as e:
             logger.error(f"Ошибка создания манифеста: {e}")
             return False
+
+
+def benchmark_signature_algorithms(files_directory: str, algorithms=SIGNATURE_ALGORITHMS,
+                                   merkle: bool = False, workers: Optional[int] = None) -> Dict[str, dict]:
+    """Сравнение алгоритмов: время подписи и проверки манифеста и его размер
+
+    По умолчанию строится манифест с подписью каждого файла - в нём
+    разница алгоритмов заметнее всего. Ключи создаются во временном
+    каталоге, рабочие ключи не затрагиваются.
+    """
+    from crypto_verifier import Verifier
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='sign_bench_') as temp_dir:
+        for algorithm in algorithms:
+            keys_dir = os.path.join(temp_dir, algorithm)
+            manifest_path = os.path.join(temp_dir, f"{algorithm}.manifest")
+            signer = Signer(keys_dir, algorithm)
+            if not signer.generate_keys():
+                results[algorithm] = {'error': "не удалось создать ключи"}
+                continue
+            if not signer.create_manifest(files_directory, manifest_path, merkle=merkle, workers=workers):
+                results[algorithm] = {'error': "не удалось создать манифест"}
+                continue
+
+            verifier = Verifier(keys_dir)
+            started = time.perf_counter()
+            report = verifier.verify_manifest_report(manifest_path, files_directory, workers=workers)
+            results[algorithm] = {
+                'files': signer.stats.files,
+                'sign_seconds': signer.stats.sign_seconds,
+                'verify_seconds': time.perf_counter() - started,
+                'manifest_bytes': os.path.getsize(manifest_path),
+                'verified': report.ok
+            }
+    return results
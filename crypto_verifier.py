@@ -1,18 +1,54 @@
 import os
 import json
+import time
+import asyncio
 import hashlib
 import base64
 import logging
+import threading
+import functools
 import requests
 from pathlib import Path
-from typing import Optional
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Union
 from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from cryptography.exceptions import InvalidSignature
 
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+from signature_algorithms import verify_message
+from merkle_manifest import (is_merkle_manifest, manifest_tree, manifest_header_payload,
+                             check_inclusion_proof, check_file_pieces)
+
 logger = logging.getLogger(__name__)
 
+# Как часто проверять обновление публичного ключа на сервере (секунды)
+PUBLIC_KEY_REFRESH_INTERVAL = 3600
+
+
+@dataclass
+class VerificationReport:
+    """Итог проверки манифеста: все найденные нарушения, а не только первое"""
+    total_files: int = 0
+    verified_files: int = 0
+    reused_hashes: int = 0  # Хеши, переданные вызывающим кодом (без повторного чтения файла)
+    failures: Dict[str, str] = field(default_factory=dict)  # путь -> причина
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+    def summary(self) -> str:
+        return (f"Проверено файлов: {self.verified_files}/{self.total_files}, "
+                f"хешей переиспользовано: {self.reused_hashes}, нарушений: {len(self.failures)}, "
+                f"время: {self.seconds:.2f} с")
+
 
 class Verifier:
     """Проверка подписи и целостности обновлений (только публичный ключ)."""
@@ -22,8 +58,43 @@ class Verifier:
         self.keys_dir.mkdir(exist_ok=True)
         self.public_key_path = self.keys_dir / "public_key.pem"
         self.cached_public_key_path = self.keys_dir / "cached_public_key.pem"
+        # ETag/Last-Modified закешированного ключа и время последней проверки
+        self.key_meta_path = self.keys_dir / "cached_public_key.json"
         self.public_key_url = public_key_url
         self._cached_public_key = None
+        self._key_lock = threading.RLock()
+        self._refresh_task = None
+        # Корни манифестов с уже проверенной подписью: доказательства
+        # включения для файлов того же релиза не требуют повторной проверки RSA
+        self._verified_roots = set()
+
+    def _load_key_meta(self) -> dict:
+        try:
+            with open(self.key_meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_key_meta(self, meta: dict):
+        try:
+            with open(self.key_meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        except OSError as e:
+            logger.warning(f"Ошибка сохранения метаданных публичного ключа: {e}")
+
+    def _store_public_key(self, key_data: str, etag: str = '', last_modified: str = ''):
+        """Проверка, кеширование и установка загруженного ключа"""
+        if not key_data.startswith('-----BEGIN PUBLIC KEY-----'):
+            raise ValueError("Некорректный формат публичного ключа (ожидается PEM)")
+        public_key = load_pem_public_key(key_data.encode('utf-8'))
+        with open(self.cached_public_key_path, 'w', encoding='utf-8') as f:
+            f.write(key_data)
+        self._save_key_meta({'etag': etag, 'last_modified': last_modified, 'checked_at': time.time()})
+        with self._key_lock:
+            # Ключ сменился - ранее проверенные корни манифестов недействительны
+            self._verified_roots.clear()
+            self._cached_public_key = public_key
+        return public_key
 
     def download_public_key(self):
         if not self.public_key_url:
@@ -32,12 +103,8 @@ class Verifier:
         try:
             resp = requests.get(self.public_key_url, timeout=30, verify=True, headers={'User-Agent': 'GameLauncher/1.0'})
             resp.raise_for_status()
-            key_data = resp.text
-            if not key_data.startswith('-----BEGIN PUBLIC KEY-----'):
-                raise ValueError("Некорректный формат публичного ключа (ожидается PEM)")
-            public_key = load_pem_public_key(key_data.encode('utf-8'))
-            with open(self.cached_public_key_path, 'w', encoding='utf-8') as f:
-                f.write(key_data)
+            public_key = self._store_public_key(resp.text, resp.headers.get('ETag', ''),
+                                                resp.headers.get('Last-Modified', ''))
             logger.info("Публичный ключ загружен и закеширован")
             return public_key
         except requests.RequestException as e:
@@ -47,38 +114,118 @@ class Verifier:
             logger.error(f"Ошибка обработки публичного ключа: {e}")
             return None
 
-    def load_public_key(self):
+    async def refresh_public_key_async(self, session=None, force: bool = False) -> bool:
+        """Неблокирующая проверка обновления ключа условным запросом
+
+        Сервер отвечает 304 по ETag/If-Modified-Since, если ключ не
+        менялся; чаще PUBLIC_KEY_REFRESH_INTERVAL сервер не опрашивается.
+        """
+        if not self.public_key_url or not AIOHTTP_AVAILABLE:
+            return False
+        meta = self._load_key_meta()
+        has_cached_key = self.cached_public_key_path.exists()
+        if (not force and has_cached_key
+                and time.time() - meta.get('checked_at', 0) < PUBLIC_KEY_REFRESH_INTERVAL):
+            return True
+
+        headers = {'User-Agent': 'GameLauncher/1.0'}
+        if has_cached_key:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        own_session = session is None
         try:
-            if self._cached_public_key:
-                return self._cached_public_key
-            if self.cached_public_key_path.exists():
-                try:
-                    with open(self.cached_public_key_path, 'rb') as f:
+            if own_session:
+                session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+            async with session.get(self.public_key_url, headers=headers) as response:
+                if response.status == 304:
+                    meta['checked_at'] = time.time()
+                    self._save_key_meta(meta)
+                    logger.debug("Публичный ключ не изменился")
+                    return True
+                response.raise_for_status()
+                key_data = await response.text()
+                etag = response.headers.get('ETag', '')
+                last_modified = response.headers.get('Last-Modified', '')
+            self._store_public_key(key_data, etag, last_modified)
+            logger.info("Публичный ключ обновлён и закеширован")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка обновления публичного ключа: {e}")
+            return False
+        finally:
+            if own_session and session:
+                await session.close()
+
+    def start_key_refresh(self):
+        """Фоновое обновление ключа в текущем цикле событий (проверки дождутся его)
+
+        Задача открывает собственную сессию: она может пережить сессию
+        вызывающего кода. Задача другого (в том числе закрытого) цикла
+        событий отбрасывается - она уже никогда не завершится.
+        """
+        if not self.public_key_url or not AIOHTTP_AVAILABLE:
+            return
+        task = self._refresh_task
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            return
+        self._refresh_task = asyncio.ensure_future(self.refresh_public_key_async())
+
+    async def _await_key_refresh(self):
+        task, self._refresh_task = self._refresh_task, None
+        if task is None:
+            return
+        if task.done() or task.get_loop() is asyncio.get_running_loop():
+            try:
+                await task
+            except Exception as e:
+                logger.warning(f"Фоновое обновление публичного ключа завершилось ошибкой: {e}")
+
+    async def load_public_key_async(self):
+        """Публичный ключ без блокировки цикла событий сетевым запросом"""
+        await self._await_key_refresh()
+        if self._cached_public_key:
+            return self._cached_public_key
+        if (not self.cached_public_key_path.exists() and not self.public_key_path.exists()
+                and self.public_key_url and AIOHTTP_AVAILABLE):
+            await self.refresh_public_key_async(force=True)
+        return self.load_public_key()
+
+    def load_public_key(self):
+        with self._key_lock:
+            try:
+                if self._cached_public_key:
+                    return self._cached_public_key
+                if self.cached_public_key_path.exists():
+                    try:
+                        with open(self.cached_public_key_path, 'rb') as f:
+                            self._cached_public_key = load_pem_public_key(f.read())
+                        logger.info("Публичный ключ взят из кеша")
+                        return self._cached_public_key
+                    except Exception as e:
+                        logger.warning(f"Ошибка чтения кеша публичного ключа: {e}")
+                if self.public_key_path.exists():
+                    with open(self.public_key_path, 'rb') as f:
                         self._cached_public_key = load_pem_public_key(f.read())
-                    logger.info("Публичный ключ взят из кеша")
+                    logger.info("Публичный ключ загружен с диска")
                     return self._cached_public_key
-                except Exception as e:
-                    logger.warning(f"Ошибка чтения кеша публичного ключа: {e}")
-            if self.public_key_path.exists():
-                with open(self.public_key_path, 'rb') as f:
-                    self._cached_public_key = load_pem_public_key(f.read())
-                logger.info("Публичный ключ загружен с диска")
-                return self._cached_public_key
-            if self.public_key_url:
-                self._cached_public_key = self.download_public_key()
-                return self._cached_public_key
-            logger.error("Публичный ключ недоступен: нет ни локального, ни URL")
-            return None
-        except Exception as e:
-            logger.error(f"Ошибка загрузки публичного ключа: {e}")
-            return None
+                if self.public_key_url:
+                    self._cached_public_key = self.download_public_key()
+                    return self._cached_public_key
+                logger.error("Публичный ключ недоступен: нет ни локального, ни URL")
+                return None
+            except Exception as e:
+                logger.error(f"Ошибка загрузки публичного ключа: {e}")
+                return None
 
     @staticmethod
     def hash_file(file_path: str) -> Optional[str]:
         try:
             h = hashlib.sha256()
             with open(file_path, 'rb') as f:
-                for chunk in iter(lambda: f.read(4096), b""):
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
                     h.update(chunk)
             return h.hexdigest()
         except Exception as e:
@@ -96,12 +243,7 @@ class Verifier:
                 logger.error(f"Хеш файла не совпадает: {file_path}")
                 return False
             signature = base64.b64decode(signature_data['signature'])
-            public_key.verify(
-                signature,
-                current_hash.encode('utf-8'),
-                padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
-                hashes.SHA256(),
-            )
+            verify_message(public_key, signature_data.get('algorithm'), signature, current_hash.encode('utf-8'))
             return True
         except InvalidSignature:
             logger.error(f"Подпись файла недействительна: {file_path}")
@@ -110,47 +252,244 @@ class Verifier:
             logger.error(f"Ошибка проверки подписи {file_path}: {e}")
             return False
 
-    def verify_manifest(self, manifest_path: str, files_directory: Optional[str] = None) -> bool:
+    def verify_data_signature(self, data: bytes, signature_data: dict) -> bool:
+        """Проверка подписи произвольных данных, подписанных Signer.sign_data"""
+        try:
+            public_key = self.load_public_key()
+            if not public_key:
+                logger.error("Публичный ключ отсутствует — проверка невозможна")
+                return False
+            data_hash = hashlib.sha256(data).hexdigest()
+            if data_hash != signature_data.get('file_hash'):
+                logger.error("Хеш данных не совпадает с подписанным")
+                return False
+            signature = base64.b64decode(signature_data['signature'])
+            verify_message(public_key, signature_data.get('algorithm'), signature, data_hash.encode('utf-8'))
+            return True
+        except InvalidSignature:
+            logger.error("Подпись данных недействительна")
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка проверки подписи данных: {e}")
+            return False
+
+    def verify_manifest_signature(self, manifest: dict) -> bool:
+        """Проверка манифеста на дереве Меркла без чтения файлов
+
+        Корень пересчитывается по записям файлов и сверяется с заголовком,
+        затем одной операцией RSA проверяется подпись заголовка.
+        """
         try:
-            with open(manifest_path, 'r', encoding='utf-8') as f:
-                manifest = json.load(f)
-            for relative_path, info in manifest.get('files', {}).items():
-                full_path = Path(files_directory) / relative_path if files_directory else Path(relative_path)
-                if not full_path.exists():
-                    logger.warning(f"Файл отсутствует: {full_path}")
+            if manifest.get('files') is not None:
+                if len(manifest['files']) != manifest.get('leaf_count'):
+                    logger.error("Число файлов манифеста не совпадает с числом листьев")
                     return False
-                if full_path.stat().st_size != info['size']:
-                    logger.error(f"Несовпадение размера файла: {full_path}")
+                if manifest_tree(manifest['files']).root.hex() != manifest.get('merkle_root'):
+                    logger.error("Корень дерева Меркла не совпадает с записями манифеста")
                     return False
-                signature_data = {
-                    'file_hash': info['hash'],
-                    'signature': info['signature'],
-                    'algorithm': info['algorithm'],
-                }
-                if not self.verify_file_signature(str(full_path), signature_data):
+                piece_size = manifest.get('piece_size')
+                if piece_size:
+                    for relative_path, info in manifest['files'].items():
+                        if not check_file_pieces(info, piece_size):
+                            logger.error(f"Список кусков не совпадает с корнем кусков: {relative_path}")
+                            return False
+            return self._verify_root_signature(manifest, manifest.get('signature'))
+        except Exception as e:
+            logger.error(f"Ошибка проверки манифеста: {e}")
+            return False
+
+    def _verify_root_signature(self, header: dict, signature_data: Optional[dict]) -> bool:
+        """Проверка подписи заголовка с корнем (с кэшем проверенных корней)"""
+        if not signature_data:
+            logger.error("Манифест не подписан")
+            return False
+        payload = manifest_header_payload(header)
+        if payload in self._verified_roots:
+            return True
+        if not self.verify_data_signature(payload, signature_data):
+            return False
+        self._verified_roots.add(payload)
+        return True
+
+    def verify_inclusion_proof(self, bundle: dict, file_path: Optional[str] = None) -> bool:
+        """Проверка файла по доказательству включения (merkle_manifest.build_inclusion_proof)
+
+        Подпись корня проверяется один раз на релиз; при ``file_path``
+        дополнительно сверяются размер и хеш файла.
+        """
+        try:
+            if not self._verify_root_signature(bundle['header'], bundle.get('signature')):
+                return False
+            if not check_inclusion_proof(bundle):
+                logger.error(f"Доказательство включения недействительно: {bundle['path']}")
+                return False
+            if file_path is not None:
+                if os.path.getsize(file_path) != bundle['size']:
+                    logger.error(f"Несовпадение размера файла: {file_path}")
+                    return False
+                if self.hash_file(file_path) != bundle['hash']:
+                    logger.error(f"Хеш файла не совпадает: {file_path}")
                     return False
             return True
         except Exception as e:
-            logger.error(f"Ошибка проверки манифеста: {e}")
+            logger.error(f"Ошибка проверки доказательства включения: {e}")
             return False
 
+    def _check_manifest_file(self, relative_path: str, info: dict, files_directory: Optional[str],
+                             known_hashes: Optional[Dict[str, str]], public_key) -> tuple:
+        """Проверка одного файла манифеста; возвращает (причина ошибки или None, хеш переиспользован)"""
+        full_path = Path(files_directory) / relative_path if files_directory else Path(relative_path)
+        try:
+            if full_path.stat().st_size != info['size']:
+                return "несовпадение размера", False
+        except OSError:
+            return "файл отсутствует", False
 
-def verify_update_integrity(update_archive: str, manifest_path: Optional[str] = None, public_key_url: Optional[str] = None) -> bool:
-    verifier = Verifier(public_key_url=public_key_url)
+        file_hash = known_hashes.get(relative_path) if known_hashes else None
+        reused = file_hash is not None
+        if file_hash is None:
+            file_hash = self.hash_file(str(full_path))
+            if file_hash is None:
+                return "ошибка чтения файла", False
+        if file_hash != info['hash']:
+            return "хеш не совпадает", reused
+
+        # Прежний формат: подпись у каждого файла
+        if public_key is not None:
+            try:
+                verify_message(public_key, info.get('algorithm'), base64.b64decode(info['signature']),
+                               file_hash.encode('utf-8'))
+            except InvalidSignature:
+                return "подпись файла недействительна", reused
+            except Exception as e:
+                return f"ошибка проверки подписи: {e}", reused
+        return None, reused
+
+    def verify_manifest_report(self, manifest: Union[str, dict], files_directory: Optional[str] = None,
+                               known_hashes: Optional[Dict[str, str]] = None,
+                               workers: Optional[int] = None) -> VerificationReport:
+        """Проверка всех файлов манифеста в пуле потоков
+
+        hashlib отпускает GIL на больших блоках, поэтому чтение и
+        хеширование файлов идёт параллельно. Проверка не прерывается на
+        первой ошибке: в отчёт попадают все нарушения. ``known_hashes``
+        (относительный путь -> SHA-256) - хеши, посчитанные локально при
+        загрузке или распаковке; такие файлы повторно не читаются.
+        """
+        report = VerificationReport()
+        started = time.perf_counter()
+        try:
+            if isinstance(manifest, str):
+                with open(manifest, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            files = manifest.get('files', {})
+            report.total_files = len(files)
+
+            public_key = None
+            if is_merkle_manifest(manifest):
+                if not self.verify_manifest_signature(manifest):
+                    report.failures['<manifest>'] = "подпись манифеста недействительна"
+                    return report
+            else:
+                public_key = self.load_public_key()
+                if not public_key:
+                    report.failures['<manifest>'] = "публичный ключ отсутствует"
+                    return report
+
+            items = list(files.items())
+            with ThreadPoolExecutor(max_workers=max(1, workers or os.cpu_count() or 1)) as pool:
+                results = pool.map(lambda item: self._check_manifest_file(item[0], item[1], files_directory,
+                                                                          known_hashes, public_key), items)
+                for (relative_path, _), (reason, reused) in zip(items, results):
+                    if reused:
+                        report.reused_hashes += 1
+                    if reason:
+                        report.failures[relative_path] = reason
+                    else:
+                        report.verified_files += 1
+        except Exception as e:
+            report.failures['<manifest>'] = f"ошибка проверки манифеста: {e}"
+        finally:
+            report.seconds = time.perf_counter() - started
+            for relative_path, reason in report.failures.items():
+                logger.error(f"Проверка манифеста: {relative_path}: {reason}")
+        return report
+
+    async def _run_blocking(self, func, *args):
+        """Выполнение проверки в пуле потоков, не блокируя цикл событий"""
+        await self.load_public_key_async()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args))
+
+    async def verify_manifest_async(self, manifest: Union[str, dict], files_directory: Optional[str] = None,
+                                    known_hashes: Optional[Dict[str, str]] = None,
+                                    workers: Optional[int] = None) -> VerificationReport:
+        return await self._run_blocking(self.verify_manifest_report, manifest, files_directory,
+                                        known_hashes, workers)
+
+    async def verify_data_signature_async(self, data: bytes, signature_data: dict) -> bool:
+        return await self._run_blocking(self.verify_data_signature, data, signature_data)
+
+    async def verify_manifest_signature_async(self, manifest: dict) -> bool:
+        return await self._run_blocking(self.verify_manifest_signature, manifest)
+
+    def verify_manifest(self, manifest_path: str, files_directory: Optional[str] = None,
+                        known_hashes: Optional[Dict[str, str]] = None, workers: Optional[int] = None) -> bool:
+        report = self.verify_manifest_report(manifest_path, files_directory, known_hashes, workers)
+        logger.info(report.summary())
+        return report.ok
+
+
+# Общие экземпляры по (каталог ключей, URL ключа): ключ разбирается один раз за процесс
+_verifiers: Dict[tuple, Verifier] = {}
+_verifiers_lock = threading.Lock()
+
+def get_verifier(keys_dir: str = "crypto_keys", public_key_url: Optional[str] = None) -> Verifier:
+    """Получение общего экземпляра проверяющего"""
+    key = (str(Path(keys_dir).resolve()), public_key_url)
+    with _verifiers_lock:
+        if key not in _verifiers:
+            _verifiers[key] = Verifier(keys_dir, public_key_url)
+        return _verifiers[key]
+
+def verify_update_integrity(update_archive: str, manifest_path: Optional[str] = None, public_key_url: Optional[str] = None,
+                            files_directory: Optional[str] = None,
+                            known_hashes: Optional[Dict[str, str]] = None,
+                            archive_hash: Optional[str] = None) -> bool:
+    """Проверка архива по манифесту или по файлу ``.hash``
+
+    ``archive_hash`` - SHA-256 архива, посчитанный при загрузке: архив
+    не перечитывается с диска.
+    """
+    verifier = get_verifier(public_key_url=public_key_url)
     if manifest_path and os.path.exists(manifest_path):
-        return verifier.verify_manifest(manifest_path)
+        return verifier.verify_manifest(manifest_path, files_directory, known_hashes)
     expected_hash_file = f"{update_archive}.hash"
     if os.path.exists(expected_hash_file):
         with open(expected_hash_file, 'r') as f:
             expected_hash = f.read().strip()
-        actual_hash = verifier.hash_file(update_archive)
+        actual_hash = archive_hash or verifier.hash_file(update_archive)
         return actual_hash == expected_hash
     logger.warning(f"Нет доступных данных для проверки целостности: {update_archive}")
     return False
 
 
+async def verify_update_integrity_async(update_archive: str, manifest_path: Optional[str] = None,
+                                        public_key_url: Optional[str] = None,
+                                        files_directory: Optional[str] = None,
+                                        known_hashes: Optional[Dict[str, str]] = None,
+                                        archive_hash: Optional[str] = None) -> bool:
+    """verify_update_integrity для цикла событий: ключ загружается асинхронно, проверка - в пуле потоков"""
+    if manifest_path and os.path.exists(manifest_path):
+        await get_verifier(public_key_url=public_key_url).load_public_key_async()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(
+        verify_update_integrity, update_archive, manifest_path, public_key_url,
+        files_directory, known_hashes, archive_hash))
+
+
 def refresh_public_key(public_key_url: str) -> bool:
-    verifier = Verifier(public_key_url=public_key_url)
+    verifier = get_verifier(public_key_url=public_key_url)
     if verifier.cached_public_key_path.exists():
         verifier.cached_public_key_path.unlink()
     verifier._cached_public_key = None
@@ -0,0 +1,205 @@
+"""
+Кодеки бинарных дельт: bsdiff4, zstd patch-from и xdelta3 (VCDIFF)
+"""
+
+import os
+import time
+import shutil
+import logging
+import subprocess
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import bsdiff4
+    BSDIFF4_AVAILABLE = True
+except ImportError:
+    BSDIFF4_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Кодек по умолчанию: дельты без явного кодека в манифесте - bsdiff4
+DEFAULT_CODEC_ID = 'bsdiff4'
+DEFAULT_CODEC_TIME_BUDGET = 60.0  # Секунды на подбор кодека для одного файла
+
+class DeltaCodec:
+    """Интерфейс кодека бинарных дельт"""
+
+    codec_id = ''
+
+    def is_available(self) -> bool:
+        """Доступен ли кодек в текущем окружении"""
+        return False
+
+    def encode(self, old_data: bytes, new_data: bytes) -> bytes:
+        """Построение дельты old_data -> new_data"""
+        raise NotImplementedError
+
+    def decode(self, old_data: bytes, delta_data: bytes) -> bytes:
+        """Восстановление нового содержимого по старому и дельте"""
+        raise NotImplementedError
+
+class Bsdiff4Codec(DeltaCodec):
+    """bsdiff4: компактные дельты, но медленное построение и ~10 байт памяти на байт"""
+
+    codec_id = 'bsdiff4'
+
+    def is_available(self) -> bool:
+        return BSDIFF4_AVAILABLE
+
+    def encode(self, old_data: bytes, new_data: bytes) -> bytes:
+        return bsdiff4.diff(old_data, new_data)
+
+    def decode(self, old_data: bytes, delta_data: bytes) -> bytes:
+        return bsdiff4.patch(old_data, delta_data)
+
+class ZstdPatchFromCodec(DeltaCodec):
+    """zstd в режиме patch-from: старый файл - словарь сырого содержимого
+
+    Окно сжатия охватывает старый и новый файл целиком, long distance
+    matching находит совпадения на любом расстоянии. Строится в разы
+    быстрее bsdiff при сопоставимом размере дельты.
+    """
+
+    codec_id = 'zstd-patch-from'
+
+    def __init__(self, level: int = 19):
+        self.level = level
+
+    def is_available(self) -> bool:
+        return ZSTD_AVAILABLE
+
+    @staticmethod
+    def _window_log(old_size: int, new_size: int) -> int:
+        return max(10, min(31, (old_size + new_size).bit_length()))
+
+    def encode(self, old_data: bytes, new_data: bytes) -> bytes:
+        dictionary = zstandard.ZstdCompressionDict(old_data, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        params = zstandard.ZstdCompressionParameters.from_level(
+            self.level, source_size=len(new_data),
+            window_log=self._window_log(len(old_data), len(new_data)),
+            enable_ldm=True)
+        compressor = zstandard.ZstdCompressor(dict_data=dictionary, compression_params=params)
+        return compressor.compress(new_data)
+
+    def decode(self, old_data: bytes, delta_data: bytes) -> bytes:
+        dictionary = zstandard.ZstdCompressionDict(old_data, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        decompressor = zstandard.ZstdDecompressor(dict_data=dictionary, max_window_size=1 << 31)
+        return decompressor.decompress(delta_data)
+
+class Xdelta3Codec(DeltaCodec):
+    """xdelta3 (VCDIFF, RFC 3284) через внешнюю утилиту xdelta3"""
+
+    codec_id = 'xdelta3'
+
+    def __init__(self, executable: Optional[str] = None):
+        self.executable = executable or shutil.which('xdelta3')
+
+    def is_available(self) -> bool:
+        return bool(self.executable)
+
+    def _run(self, mode: str, source_data: bytes, input_data: bytes) -> bytes:
+        with tempfile.TemporaryDirectory(prefix='xdelta3_') as temp_dir:
+            source_path = os.path.join(temp_dir, 'source')
+            input_path = os.path.join(temp_dir, 'input')
+            output_path = os.path.join(temp_dir, 'output')
+            with open(source_path, 'wb') as f:
+                f.write(source_data)
+            with open(input_path, 'wb') as f:
+                f.write(input_data)
+            args = [self.executable, mode, '-f', '-s', source_path, input_path, output_path]
+            if mode == '-e':
+                args.insert(2, '-9')
+            subprocess.run(args, check=True, capture_output=True)
+            with open(output_path, 'rb') as f:
+                return f.read()
+
+    def encode(self, old_data: bytes, new_data: bytes) -> bytes:
+        return self._run('-e', old_data, new_data)
+
+    def decode(self, old_data: bytes, delta_data: bytes) -> bytes:
+        return self._run('-d', old_data, delta_data)
+
+# Порядок - от быстрых кодеков к медленным: при исчерпании бюджета
+# времени медленные кодеки не запускаются
+_codecs: Dict[str, DeltaCodec] = {
+    codec.codec_id: codec for codec in (ZstdPatchFromCodec(), Xdelta3Codec(), Bsdiff4Codec())
+}
+
+def register_codec(codec: DeltaCodec):
+    """Регистрация дополнительного кодека"""
+    _codecs[codec.codec_id] = codec
+
+def get_codec(codec_id: Optional[str] = None) -> Optional[DeltaCodec]:
+    """Доступный кодек по идентификатору (None - кодек по умолчанию)"""
+    codec = _codecs.get(codec_id or DEFAULT_CODEC_ID)
+    if codec and codec.is_available():
+        return codec
+    return None
+
+def get_available_codecs() -> List[str]:
+    """Идентификаторы кодеков, доступных в текущем окружении"""
+    return [codec_id for codec_id, codec in _codecs.items() if codec.is_available()]
+
+def select_delta(old_data: bytes, new_data: bytes, codec_ids: Optional[List[str]] = None,
+                 time_budget: float = DEFAULT_CODEC_TIME_BUDGET,
+                 strategy: str = 'smallest') -> Optional[Tuple[bytes, str]]:
+    """Подбор кодека для одного файла
+
+    Кодеки пробуются по порядку, пока не исчерпан ``time_budget``
+    (уже запущенный кодек не прерывается). Стратегия ``smallest``
+    выбирает самую маленькую дельту, ``fastest`` - первую построенную.
+    Возвращает (дельта, идентификатор кодека) или None.
+    """
+    candidates = [codec_id for codec_id in (codec_ids or list(_codecs)) if get_codec(codec_id)]
+    best: Optional[Tuple[bytes, str]] = None
+    spent = 0.0
+
+    for codec_id in candidates:
+        if best and spent >= time_budget:
+            logger.debug(f"Бюджет времени исчерпан, кодек {codec_id} пропущен")
+            break
+        started = time.perf_counter()
+        try:
+            delta = get_codec(codec_id).encode(old_data, new_data)
+        except Exception as e:
+            logger.warning(f"Ошибка кодека {codec_id}: {e}")
+            continue
+        finally:
+            spent += time.perf_counter() - started
+
+        logger.debug(f"Кодек {codec_id}: {len(delta)} байт")
+        if best is None or len(delta) < len(best[0]):
+            best = (delta, codec_id)
+        if strategy == 'fastest':
+            break
+
+    return best
+
+def benchmark_codecs(old_data: bytes, new_data: bytes) -> Dict[str, dict]:
+    """Сравнение доступных кодеков: размер дельты и время построения/применения"""
+    results = {}
+    for codec_id in get_available_codecs():
+        codec = _codecs[codec_id]
+        try:
+            started = time.perf_counter()
+            delta = codec.encode(old_data, new_data)
+            encode_time = time.perf_counter() - started
+            started = time.perf_counter()
+            restored = codec.decode(old_data, delta)
+            decode_time = time.perf_counter() - started
+            results[codec_id] = {
+                'delta_size': len(delta),
+                'encode_seconds': encode_time,
+                'decode_seconds': decode_time,
+                'roundtrip_ok': restored == new_data
+            }
+        except Exception as e:
+            results[codec_id] = {'error': str(e)}
+    return results
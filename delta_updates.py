@@ -3,15 +3,26 @@
 """
 
 import os
+import re
 import json
+import heapq
 import hashlib
 import logging
+import shutil
+import struct
 import zipfile
 import tempfile
-from typing import Dict, List, Optional, Callable
-from dataclasses import dataclass, asdict
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from typing import Dict, List, Optional, Callable, Iterator, Tuple
+from dataclasses import dataclass, asdict, field, fields
 from datetime import datetime
 
+from delta_codecs import (select_delta, get_codec, DEFAULT_CODEC_ID,
+                          DEFAULT_CODEC_TIME_BUDGET)
+from archive_packer import ArchivePacker
+
 try:
     import bsdiff4
     BSDIFF4_AVAILABLE = True
@@ -19,8 +30,34 @@ except ImportError:
     BSDIFF4_AVAILABLE = False
     logging.warning("bsdiff4 недоступен - delta-обновления отключены")
 
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+# Формат сегментированной дельты для больших файлов:
+# заголовок MAGIC + <QQ> (размер сегмента, размер нового файла),
+# далее записи <BQQQQ> (тип, смещение в старом, длина окна старого,
+# длина сегмента нового, длина данных) и данные записи.
+SEGMENTED_DELTA_MAGIC = b'BSDSEG01'
+_SEGMENTED_HEADER = struct.Struct('<QQ')
+_SEGMENT_RECORD = struct.Struct('<BQQQQ')
+SEGMENT_PATCH = 0  # Данные - bsdiff4-патч окна старого файла
+SEGMENT_RAW = 1  # Данные - сегмент нового файла как есть
+
+DEFAULT_STREAMING_THRESHOLD = 256 * 1024 * 1024  # Файлы крупнее - сегментированная дельта
+DEFAULT_MEMORY_LIMIT = 1024 * 1024 * 1024  # Потолок памяти на одну дельту
+
+# Индекс доступных delta-пакетов и полных архивов на сервере
+DELTA_INDEX_FILENAME = 'deltas.json'
+DELTA_INDEX_FORMAT = 'delta-index-v1'
+_DELTA_PACKAGE_PATTERN = re.compile(r'delta_(\d+\.\d+\.\d+)_to_(\d+\.\d+\.\d+)\.zip$')
+_FULL_ARCHIVE_PATTERN = re.compile(r'^files_list_v(\d+\.\d+\.\d+)\.zip$')
+_CHUNK_MANIFEST_PATTERN = re.compile(r'^chunk_manifest_v(\d+\.\d+\.\d+)\.json$')
+
 @dataclass
 class FileChange:
     """Информация об изменении файла"""
@@ -31,15 +68,22 @@ class FileChange:
     old_size: Optional[int] = None
     new_size: Optional[int] = None
     delta_size: Optional[int] = None
+    codec: Optional[str] = None  # None - bsdiff4
     
     def to_dict(self) -> dict:
         """Преобразование в словарь для JSON"""
-        return asdict(self)
+        data = asdict(self)
+        # Поле кодека пишется только для не-bsdiff4 дельт: такие пакеты
+        # старые клиенты не разберут и перейдут на полный архив
+        if data['codec'] is None:
+            del data['codec']
+        return data
     
     @classmethod
     def from_dict(cls, data: dict) -> 'FileChange':
-        """Создание из словаря"""
-        return cls(**data)
+        """Создание из словаря (неизвестные поля игнорируются)"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
 
 @dataclass
 class DeltaInfo:
@@ -51,11 +95,38 @@ class DeltaInfo:
     compression_ratio: float
     files_count: int
     created_at: str
+    file_timings: Dict[str, float] = field(default_factory=dict)  # путь -> секунды
+    generation_time: float = 0.0
+    packing_stats: Dict[str, float] = field(default_factory=dict)  # см. archive_packer.PackingStats
+
+@dataclass
+class DeltaRouteStep:
+    """Шаг маршрута обновления: delta-пакет или полный архив версии"""
+    from_version: str
+    to_version: str
+    kind: str  # 'delta', 'full'
+    file_name: str
+    size: int
+    sha256: Optional[str] = None
 
 class DeltaGenerator:
     """Генератор delta-обновлений"""
     
-    def __init__(self):
+    def __init__(self, streaming_threshold: int = DEFAULT_STREAMING_THRESHOLD,
+                 memory_limit: int = DEFAULT_MEMORY_LIMIT, codecs: Optional[List[str]] = None,
+                 codec_time_budget: float = DEFAULT_CODEC_TIME_BUDGET, codec_strategy: str = 'smallest',
+                 packer: Optional[ArchivePacker] = None):
+        self.streaming_threshold = streaming_threshold
+        self.memory_limit = memory_limit
+        # Кодеки-кандидаты для обычных дельт (None - все доступные), см. delta_codecs
+        self.codecs = codecs
+        self.codec_time_budget = codec_time_budget
+        self.codec_strategy = codec_strategy
+        # Сжатие записей пакета: дельты и уже сжатые файлы хранятся без сжатия
+        self.packer = packer or ArchivePacker()
+        # bsdiff требует ~10 байт памяти на байт окна; окно старого файла
+        # шире сегмента на 2 * margin (сегмент / 8) для учёта сдвигов
+        self.segment_size = max(int(memory_limit / 12.5), 1024 * 1024)
         if not BSDIFF4_AVAILABLE:
             logger.warning("Delta-генератор недоступен без bsdiff4")
     
@@ -71,10 +142,11 @@ class DeltaGenerator:
             logger.error(f"Ошибка хеширования файла {file_path}: {e}")
             return ""
     
-    def create_file_manifest(self, directory: str) -> Dict[str, Dict]:
+    def create_file_manifest(self, directory: str, workers: int = 1) -> Dict[str, Dict]:
         """Создание манифеста файлов директории"""
         manifest = {}
         try:
+            file_paths = []
             for root, dirs, files in os.walk(directory):
                 # Исключаем системные директории
                 dirs[:] = [d for d in dirs if not d.startswith('.') and d not in {'logs', 'launcher_data', 'launcher_backups', '__pycache__'}]
@@ -88,16 +160,29 @@ class DeltaGenerator:
                     
                     # Нормализуем путь для кроссплатформенности
                     relative_path = relative_path.replace('\\', '/')
-                    
+                    file_paths.append((relative_path, file_path))
+            
+            def describe(file_path: str) -> dict:
+                return {
+                    'hash': self.hash_file(file_path),
+                    'size': os.path.getsize(file_path),
+                    'mtime': os.path.getmtime(file_path)
+                }
+            
+            if workers > 1:
+                # hashlib отпускает GIL - потоков достаточно
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    futures = {pool.submit(describe, file_path): (relative_path, file_path)
+                               for relative_path, file_path in file_paths}
+                    for future, (relative_path, file_path) in futures.items():
+                        try:
+                            manifest[relative_path] = future.result()
+                        except Exception as e:
+                            logger.warning(f"Ошибка обработки файла {file_path}: {e}")
+            else:
+                for relative_path, file_path in file_paths:
                     try:
-                        file_hash = self.hash_file(file_path)
-                        file_size = os.path.getsize(file_path)
-                        
-                        manifest[relative_path] = {
-                            'hash': file_hash,
-                            'size': file_size,
-                            'mtime': os.path.getmtime(file_path)
-                        }
+                        manifest[relative_path] = describe(file_path)
                     except Exception as e:
                         logger.warning(f"Ошибка обработки файла {file_path}: {e}")
                         continue
@@ -156,6 +241,11 @@ class DeltaGenerator:
     
     def create_binary_delta(self, old_file: str, new_file: str) -> Optional[bytes]:
         """Создание бинарной дельты между двумя файлами"""
+        result = self.create_codec_delta(old_file, new_file)
+        return result[0] if result else None
+    
+    def create_codec_delta(self, old_file: str, new_file: str) -> Optional[Tuple[bytes, str]]:
+        """Создание дельты с подбором кодека; возвращает (дельта, идентификатор кодека)"""
         if not BSDIFF4_AVAILABLE:
             return None
         
@@ -165,8 +255,11 @@ class DeltaGenerator:
             with open(new_file, 'rb') as f:
                 new_data = f.read()
             
-            # Используем bsdiff4 для создания дельты
-            delta = bsdiff4.diff(old_data, new_data)
+            result = select_delta(old_data, new_data, self.codecs,
+                                  self.codec_time_budget, self.codec_strategy)
+            if not result:
+                return None
+            delta, codec_id = result
             
             # Проверяем эффективность дельты
             compression_ratio = len(delta) / len(new_data) if len(new_data) > 0 else 1.0
@@ -176,27 +269,187 @@ class DeltaGenerator:
                 logger.debug(f"Дельта неэффективна для {os.path.basename(new_file)}: {compression_ratio:.2f}")
                 return None
             
-            logger.debug(f"Создана дельта для {os.path.basename(new_file)}: {len(delta)} байт (коэффициент: {compression_ratio:.2f})")
-            return delta
+            logger.debug(f"Создана дельта для {os.path.basename(new_file)} ({codec_id}): "
+                         f"{len(delta)} байт (коэффициент: {compression_ratio:.2f})")
+            return delta, codec_id
             
         except Exception as e:
             logger.error(f"Ошибка создания дельты для {old_file} -> {new_file}: {e}")
             return None
     
+    def create_segmented_delta(self, old_file: str, new_file: str, output_path: str) -> Optional[int]:
+        """Создание дельты большого файла по сегментам с ограничением памяти
+
+        Новый файл читается сегментами ``segment_size``, для каждого
+        сегмента bsdiff строится по окну старого файла в той же позиции,
+        расширенному на ``segment_size / 8`` в обе стороны. Память
+        ограничена размером окна, а не размером файлов.
+        """
+        if not BSDIFF4_AVAILABLE:
+            return None
+        
+        try:
+            old_size = os.path.getsize(old_file)
+            new_size = os.path.getsize(new_file)
+            segment_size = self.segment_size
+            margin = segment_size // 8
+            delta_size = 0
+            
+            with open(old_file, 'rb') as old_f, open(new_file, 'rb') as new_f, \
+                    open(output_path, 'wb') as out:
+                header = SEGMENTED_DELTA_MAGIC + _SEGMENTED_HEADER.pack(segment_size, new_size)
+                out.write(header)
+                delta_size += len(header)
+                
+                new_offset = 0
+                while True:
+                    new_segment = new_f.read(segment_size)
+                    if not new_segment:
+                        break
+                    
+                    old_offset = max(0, min(new_offset, old_size) - margin)
+                    old_length = min(old_size - old_offset, segment_size + 2 * margin)
+                    old_f.seek(old_offset)
+                    old_segment = old_f.read(old_length)
+                    
+                    patch = bsdiff4.diff(old_segment, new_segment) if old_segment else None
+                    if patch is None or len(patch) >= len(new_segment):
+                        record_type, payload = SEGMENT_RAW, new_segment
+                        old_offset, old_length = 0, 0
+                    else:
+                        record_type, payload = SEGMENT_PATCH, patch
+                    
+                    out.write(_SEGMENT_RECORD.pack(record_type, old_offset, old_length,
+                                                   len(new_segment), len(payload)))
+                    out.write(payload)
+                    delta_size += _SEGMENT_RECORD.size + len(payload)
+                    new_offset += len(new_segment)
+            
+            compression_ratio = delta_size / new_size if new_size > 0 else 1.0
+            if compression_ratio > 0.8:
+                logger.debug(f"Сегментированная дельта неэффективна для {os.path.basename(new_file)}: {compression_ratio:.2f}")
+                os.remove(output_path)
+                return None
+            
+            logger.debug(f"Создана сегментированная дельта для {os.path.basename(new_file)}: "
+                         f"{delta_size} байт (коэффициент: {compression_ratio:.2f})")
+            return delta_size
+            
+        except Exception as e:
+            logger.error(f"Ошибка создания сегментированной дельты для {old_file} -> {new_file}: {e}")
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return None
+    
+    def create_delta_file(self, old_file: str, new_file: str, output_path: str) -> Optional[Tuple[int, str]]:
+        """Создание дельты в файл с выбором движка по размеру
+
+        Возвращает (размер дельты, идентификатор кодека). Сегментированные
+        дельты больших файлов всегда строятся bsdiff4.
+        """
+        if not BSDIFF4_AVAILABLE:
+            return None
+        
+        largest = max(os.path.getsize(old_file), os.path.getsize(new_file))
+        if largest > self.streaming_threshold:
+            logger.info(f"Файл {os.path.basename(new_file)} ({largest} байт) обрабатывается сегментированной дельтой")
+            delta_size = self.create_segmented_delta(old_file, new_file, output_path)
+            return (delta_size, DEFAULT_CODEC_ID) if delta_size else None
+        
+        result = self.create_codec_delta(old_file, new_file)
+        if not result:
+            return None
+        delta_data, codec_id = result
+        with open(output_path, 'wb') as f:
+            f.write(delta_data)
+        return len(delta_data), codec_id
+    
+    def estimate_delta_memory(self, old_size: int, new_size: int) -> int:
+        """Оценка пиковой памяти построения дельты для планировщика"""
+        if max(old_size, new_size) > self.streaming_threshold:
+            return self.memory_limit
+        # Суффиксный массив bsdiff (~8 байт на байт старого) плюс оба файла в памяти
+        return 10 * old_size + 2 * new_size
+    
+    def _default_memory_budget(self) -> int:
+        if PSUTIL_AVAILABLE:
+            return int(psutil.virtual_memory().available * 0.6)
+        return 2 * self.memory_limit
+    
+    def _iter_delta_results(self, jobs: List[tuple], workers: int,
+                            memory_budget: Optional[int]) -> Iterator[Tuple[tuple, Optional[Tuple[int, str]], float]]:
+        """Построение дельт с выдачей результатов по мере готовности
+
+        Каждая задача - (изменение, старый файл, новый файл, путь дельты,
+        оценка памяти). В параллельном режиме задачи запускаются в пуле
+        процессов, пока суммарная оценка памяти выполняющихся задач не
+        превышает бюджет; одна задача запускается всегда.
+        """
+        if workers <= 1:
+            for job in jobs:
+                _, old_file, new_file, delta_path, _ = job
+                started = time.perf_counter()
+                try:
+                    delta_result = self.create_delta_file(old_file, new_file, delta_path)
+                except Exception as e:
+                    logger.error(f"Ошибка построения дельты для {job[0].file_path}: {e}")
+                    delta_result = None
+                yield job, delta_result, time.perf_counter() - started
+            return
+        
+        budget = memory_budget or self._default_memory_budget()
+        # Крупные задачи первыми - они ограничивают параллелизм сильнее всего
+        pending = sorted(jobs, key=lambda job: job[4], reverse=True)
+        in_flight = {}
+        memory_in_use = 0
+        
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while pending or in_flight:
+                index = 0
+                while index < len(pending) and len(in_flight) < workers:
+                    job = pending[index]
+                    if in_flight and memory_in_use + job[4] > budget:
+                        index += 1
+                        continue
+                    _, old_file, new_file, delta_path, cost = pending.pop(index)
+                    future = pool.submit(_create_delta_file_worker, old_file, new_file, delta_path,
+                                         self.streaming_threshold, self.memory_limit, self.codecs,
+                                         self.codec_time_budget, self.codec_strategy)
+                    in_flight[future] = job
+                    memory_in_use += cost
+                
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    memory_in_use -= job[4]
+                    try:
+                        delta_result, elapsed = future.result()
+                    except Exception as e:
+                        logger.error(f"Ошибка построения дельты для {job[0].file_path}: {e}")
+                        delta_result, elapsed = None, 0.0
+                    yield job, delta_result, elapsed
+    
     def generate_delta_package(self, old_dir: str, new_dir: str, 
                               old_version: str, new_version: str,
-                              output_path: str) -> Optional[DeltaInfo]:
-        """Генерация пакета delta-обновления"""
+                              output_path: str, workers: int = 1,
+                              memory_budget: Optional[int] = None) -> Optional[DeltaInfo]:
+        """Генерация пакета delta-обновления
+
+        При ``workers > 1`` файлы хешируются в пуле потоков, а дельты
+        строятся в пуле процессов с ограничением суммарной памяти
+        ``memory_budget``. Готовые дельты сразу дописываются в архив.
+        """
         if not BSDIFF4_AVAILABLE:
             logger.warning("Delta-пакеты недоступны без bsdiff4")
             return None
         
         try:
             logger.info(f"Создание delta-пакета: {old_version} -> {new_version}")
+            generation_started = time.perf_counter()
             
             # Создаем манифесты
-            old_manifest = self.create_file_manifest(old_dir)
-            new_manifest = self.create_file_manifest(new_dir)
+            old_manifest = self.create_file_manifest(old_dir, workers)
+            new_manifest = self.create_file_manifest(new_dir, workers)
             
             if not old_manifest or not new_manifest:
                 logger.error("Не удалось создать манифесты")
@@ -212,29 +465,27 @@ class DeltaGenerator:
             total_delta_size = 0
             total_original_size = 0
             processed_files = 0
+            file_timings: Dict[str, float] = {}
+            failed_changes = set()
+            codecs_used = set()
             
-            # Создаем временную директорию для дельт
-            with tempfile.TemporaryDirectory() as temp_dir:
-                delta_manifest = {
-                    'source_version': old_version,
-                    'target_version': new_version,
-                    'changes': []
-                }
+            # Временная директория только для дельт, которые еще не дописаны в архив
+            with tempfile.TemporaryDirectory() as temp_dir, \
+                    self.packer.open(output_path) as delta_zip:
+                jobs = []
                 
-                for change in changes:
+                for index, change in enumerate(changes):
                     try:
                         if change.change_type == 'add':
                             # Для новых файлов копируем полностью
                             source_file = os.path.join(new_dir, change.file_path)
                             if os.path.exists(source_file):
-                                dest_path = os.path.join(temp_dir, 'files', change.file_path)
-                                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                                
-                                with open(source_file, 'rb') as src, open(dest_path, 'wb') as dst:
-                                    data = src.read()
-                                    dst.write(data)
-                                    total_delta_size += len(data)
-                                    total_original_size += len(data)
+                                started = time.perf_counter()
+                                self.packer.write(delta_zip, source_file, f"files/{change.file_path}")
+                                file_size = os.path.getsize(source_file)
+                                total_delta_size += file_size
+                                total_original_size += file_size
+                                file_timings[change.file_path] = time.perf_counter() - started
                                 
                                 change.delta_size = change.new_size
                                 processed_files += 1
@@ -245,61 +496,55 @@ class DeltaGenerator:
                             new_file = os.path.join(new_dir, change.file_path)
                             
                             if os.path.exists(old_file) and os.path.exists(new_file):
-                                delta_data = self.create_binary_delta(old_file, new_file)
-                                
-                                if delta_data:
-                                    # Сохраняем дельту
-                                    delta_path = os.path.join(temp_dir, 'deltas', f"{change.file_path}.delta")
-                                    os.makedirs(os.path.dirname(delta_path), exist_ok=True)
-                                    
-                                    with open(delta_path, 'wb') as f:
-                                        f.write(delta_data)
-                                    
-                                    change.delta_size = len(delta_data)
-                                    total_delta_size += len(delta_data)
-                                    total_original_size += change.new_size or 0
-                                    processed_files += 1
-                                else:
-                                    # Если дельта неэффективна, копируем полный файл
-                                    dest_path = os.path.join(temp_dir, 'files', change.file_path)
-                                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                                    
-                                    with open(new_file, 'rb') as src, open(dest_path, 'wb') as dst:
-                                        data = src.read()
-                                        dst.write(data)
-                                        total_delta_size += len(data)
-                                        total_original_size += len(data)
-                                    
-                                    change.delta_size = change.new_size
-                                    change.change_type = 'replace'  # Помечаем как полная замена
-                                    processed_files += 1
-                        
-                        # Добавляем изменение в манифест (включая удаления)
-                        delta_manifest['changes'].append(change.to_dict())
-                        
+                                delta_path = os.path.join(temp_dir, f"{index}.delta")
+                                cost = self.estimate_delta_memory(change.old_size or 0, change.new_size or 0)
+                                jobs.append((change, old_file, new_file, delta_path, cost))
+                    
                     except Exception as e:
                         logger.error(f"Ошибка обработки изменения {change.file_path}: {e}")
-                        continue
-                
-                # Сохраняем манифест дельты
-                manifest_path = os.path.join(temp_dir, 'delta_manifest.json')
-                with open(manifest_path, 'w', encoding='utf-8') as f:
-                    json.dump(delta_manifest, f, indent=2, ensure_ascii=False)
+                        failed_changes.add(change.file_path)
                 
-                # Создаем финальный архив
-                with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as delta_zip:
-                    # Добавляем манифест
-                    delta_zip.write(manifest_path, 'delta_manifest.json')
-                    
-                    # Добавляем все файлы из временной директории
-                    for root, dirs, files in os.walk(temp_dir):
-                        for file in files:
-                            if file == 'delta_manifest.json':
-                                continue
+                for job, delta_result, elapsed in self._iter_delta_results(jobs, workers, memory_budget):
+                    change, old_file, new_file, delta_path, _ = job
+                    try:
+                        started = time.perf_counter()
+                        if delta_result:
+                            # Сохраняем дельту
+                            delta_size, codec_id = delta_result
+                            self.packer.write(delta_zip, delta_path, f"deltas/{change.file_path}.delta")
+                            change.delta_size = delta_size
+                            change.codec = None if codec_id == DEFAULT_CODEC_ID else codec_id
+                            codecs_used.add(codec_id)
+                            total_delta_size += delta_size
+                            total_original_size += change.new_size or 0
+                        else:
+                            # Если дельта неэффективна, копируем полный файл
+                            self.packer.write(delta_zip, new_file, f"files/{change.file_path}")
+                            file_size = os.path.getsize(new_file)
+                            total_delta_size += file_size
+                            total_original_size += file_size
                             
-                            file_path = os.path.join(root, file)
-                            arc_path = os.path.relpath(file_path, temp_dir)
-                            delta_zip.write(file_path, arc_path)
+                            change.delta_size = change.new_size
+                            change.change_type = 'replace'  # Помечаем как полная замена
+                        processed_files += 1
+                        file_timings[change.file_path] = elapsed + time.perf_counter() - started
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки изменения {change.file_path}: {e}")
+                        failed_changes.add(change.file_path)
+                    finally:
+                        if os.path.exists(delta_path):
+                            os.remove(delta_path)
+                
+                # Манифест дельты (включая удаления) дописывается последним
+                delta_manifest = {
+                    'source_version': old_version,
+                    'target_version': new_version,
+                    'codecs': sorted(codecs_used),
+                    'changes': [change.to_dict() for change in changes
+                                if change.file_path not in failed_changes]
+                }
+                delta_zip.writestr('delta_manifest.json',
+                                   json.dumps(delta_manifest, indent=2, ensure_ascii=False))
             
             # Вычисляем коэффициент сжатия
             compression_ratio = total_delta_size / total_original_size if total_original_size > 0 else 0.0
@@ -311,18 +556,76 @@ class DeltaGenerator:
                 original_size=total_original_size,
                 compression_ratio=compression_ratio,
                 files_count=processed_files,
-                created_at=datetime.now().isoformat()
+                created_at=datetime.now().isoformat(),
+                file_timings=file_timings,
+                generation_time=time.perf_counter() - generation_started,
+                packing_stats=self.packer.stats.to_dict()
             )
             
             logger.info(f"Delta-пакет создан: {output_path}")
             logger.info(f"Размер дельты: {total_delta_size} байт, оригинал: {total_original_size} байт")
-            logger.info(f"Коэффициент сжатия: {compression_ratio:.2f}, файлов: {processed_files}")
+            logger.info(f"Коэффициент сжатия: {compression_ratio:.2f}, файлов: {processed_files}, "
+                        f"время: {delta_info.generation_time:.1f}с")
+            logger.info(self.packer.stats.summary())
             
             return delta_info
             
         except Exception as e:
             logger.error(f"Ошибка создания delta-пакета: {e}")
             return None
+    
+    def compose_delta_chain(self, base_dir: str, packages: List[str], output_path: str,
+                            workers: int = 1) -> Optional[DeltaInfo]:
+        """Сборка цепочки delta-пакетов в один пакет с пропуском версий
+
+        Патчи bsdiff нельзя сложить напрямую, поэтому цепочка применяется
+        к копии ``base_dir`` (дерево исходной версии) с проверкой хешей,
+        а итоговая дельта строится заново между исходным и полученным деревом.
+        """
+        staging_dir = tempfile.mkdtemp(prefix='delta_chain_')
+        try:
+            versions = []
+            for package in packages:
+                with zipfile.ZipFile(package, 'r') as delta_zip:
+                    delta_manifest = json.loads(delta_zip.read('delta_manifest.json').decode('utf-8'))
+                if versions and versions[-1][1] != delta_manifest['source_version']:
+                    logger.error(f"Разрыв цепочки дельт: {versions[-1][1]} -> {delta_manifest['source_version']}")
+                    return None
+                versions.append((delta_manifest['source_version'], delta_manifest['target_version']))
+            
+            if not versions:
+                logger.error("Пустая цепочка дельт")
+                return None
+            
+            logger.info(f"Сборка цепочки дельт: {' -> '.join([versions[0][0]] + [v[1] for v in versions])}")
+            
+            target_dir = os.path.join(staging_dir, 'tree')
+            shutil.copytree(base_dir, target_dir)
+            applier = DeltaApplier()
+            for package in packages:
+                if not applier.apply_delta_package(package, target_dir, workers=workers):
+                    logger.error(f"Не удалось применить {package} при сборке цепочки")
+                    return None
+            
+            return self.generate_delta_package(base_dir, target_dir, versions[0][0], versions[-1][1],
+                                               output_path, workers)
+            
+        except Exception as e:
+            logger.error(f"Ошибка сборки цепочки дельт: {e}")
+            return None
+        
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+def _create_delta_file_worker(old_file: str, new_file: str, delta_path: str,
+                              streaming_threshold: int, memory_limit: int, codecs: Optional[List[str]],
+                              codec_time_budget: float,
+                              codec_strategy: str) -> Tuple[Optional[Tuple[int, str]], float]:
+    """Построение одной дельты в процессе пула (функция модуля - для pickle)"""
+    started = time.perf_counter()
+    generator = DeltaGenerator(streaming_threshold, memory_limit, codecs, codec_time_budget, codec_strategy)
+    delta_result = generator.create_delta_file(old_file, new_file, delta_path)
+    return delta_result, time.perf_counter() - started
 
 class DeltaApplier:
     """Применение delta-обновлений"""
@@ -332,9 +635,12 @@ class DeltaApplier:
         if not BSDIFF4_AVAILABLE:
             logger.warning("Delta-применение недоступно без bsdiff4")
     
-    def apply_binary_delta(self, old_file: str, delta_data: bytes, output_file: str) -> bool:
-        """Применение бинарной дельты к файлу"""
-        if not BSDIFF4_AVAILABLE:
+    def apply_binary_delta(self, old_file: str, delta_data: bytes, output_file: str,
+                           codec_id: Optional[str] = None) -> bool:
+        """Применение бинарной дельты к файлу кодеком codec_id (None - bsdiff4)"""
+        codec = get_codec(codec_id)
+        if not codec:
+            logger.error(f"Кодек дельты недоступен: {codec_id or DEFAULT_CODEC_ID}")
             return False
         
         try:
@@ -342,7 +648,7 @@ class DeltaApplier:
                 old_data = f.read()
             
             # Применяем дельту
-            new_data = bsdiff4.patch(old_data, delta_data)
+            new_data = codec.decode(old_data, delta_data)
             
             # Записываем результат
             os.makedirs(os.path.dirname(output_file), exist_ok=True)
@@ -356,90 +662,462 @@ class DeltaApplier:
             logger.error(f"Ошибка применения дельты {old_file}: {e}")
             return False
     
+    def apply_delta_file(self, old_file: str, delta_file: str, output_file: str,
+                         codec_id: Optional[str] = None) -> bool:
+        """Применение дельты из файла; сегментированные дельты применяются потоково"""
+        if not BSDIFF4_AVAILABLE:
+            return False
+        
+        try:
+            with open(delta_file, 'rb') as f:
+                return self.apply_delta_stream(old_file, f, output_file, codec_id)
+        except Exception as e:
+            logger.error(f"Ошибка применения дельты {delta_file}: {e}")
+            return False
+    
+    def apply_delta_stream(self, old_file: str, delta_stream, output_file: str,
+                           codec_id: Optional[str] = None) -> bool:
+        """Применение дельты из потока (файл или член zip-архива)"""
+        if not BSDIFF4_AVAILABLE:
+            return False
+        
+        if codec_id not in (None, DEFAULT_CODEC_ID):
+            return self.apply_binary_delta(old_file, delta_stream.read(), output_file, codec_id)
+        
+        magic = delta_stream.read(len(SEGMENTED_DELTA_MAGIC))
+        if magic == SEGMENTED_DELTA_MAGIC:
+            return self.apply_segmented_delta(old_file, delta_stream, output_file)
+        return self.apply_binary_delta(old_file, magic + delta_stream.read(), output_file)
+    
+    def apply_segmented_delta(self, old_file: str, delta_stream, output_file: str) -> bool:
+        """Потоковое применение сегментированной дельты (поток после MAGIC)
+
+        В памяти одновременно находится только одно окно старого файла
+        и один сегмент результата.
+        """
+        try:
+            header = delta_stream.read(_SEGMENTED_HEADER.size)
+            _, new_size = _SEGMENTED_HEADER.unpack(header)
+            written = 0
+            
+            os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+            with open(old_file, 'rb') as old_f, open(output_file, 'wb') as out:
+                while True:
+                    record = delta_stream.read(_SEGMENT_RECORD.size)
+                    if not record:
+                        break
+                    if len(record) != _SEGMENT_RECORD.size:
+                        raise ValueError("Повреждённая запись сегментированной дельты")
+                    record_type, old_offset, old_length, new_length, payload_length = _SEGMENT_RECORD.unpack(record)
+                    payload = delta_stream.read(payload_length)
+                    
+                    if record_type == SEGMENT_RAW:
+                        segment = payload
+                    elif record_type == SEGMENT_PATCH:
+                        old_f.seek(old_offset)
+                        segment = bsdiff4.patch(old_f.read(old_length), payload)
+                    else:
+                        raise ValueError(f"Неизвестный тип сегмента: {record_type}")
+                    
+                    if len(segment) != new_length:
+                        raise ValueError("Размер восстановленного сегмента не совпадает")
+                    out.write(segment)
+                    written += len(segment)
+            
+            if written != new_size:
+                raise ValueError(f"Размер результата {written} != {new_size}")
+            
+            logger.debug(f"Сегментированная дельта применена: {os.path.basename(old_file)} -> {os.path.basename(output_file)}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Ошибка применения сегментированной дельты {old_file}: {e}")
+            return False
+    
+    @staticmethod
+    def _find_member(members: Dict[str, str], name: str) -> Optional[str]:
+        """Поиск члена архива (старые пакеты могли содержать пути с '\\')"""
+        return members.get(name) or members.get(name.replace('/', '\\'))
+    
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """Вычисление SHA-256 хеша файла"""
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    
+    def _prepare_change(self, delta_package: str, members: Dict[str, str], change: FileChange,
+                        target_file: str, staged_file: str, zip_local: threading.local,
+                        opened_zips: List[zipfile.ZipFile]):
+        """Подготовка результата изменения во временном файле и проверка хеша"""
+        # У каждого потока свой дескриптор архива
+        delta_zip = getattr(zip_local, 'zip', None)
+        if delta_zip is None:
+            delta_zip = zip_local.zip = zipfile.ZipFile(delta_package, 'r')
+            opened_zips.append(delta_zip)
+        
+        if change.change_type in ('add', 'replace'):
+            member = self._find_member(members, f"files/{change.file_path}")
+            if not member:
+                raise Exception("Файл отсутствует в пакете")
+            with delta_zip.open(member) as src, open(staged_file, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        
+        elif change.change_type == 'modify':
+            member = self._find_member(members, f"deltas/{change.file_path}.delta")
+            if not member:
+                raise Exception("Дельта отсутствует в пакете")
+            if not os.path.exists(target_file):
+                raise Exception("Исходный файл для дельты отсутствует")
+            with delta_zip.open(member) as delta_stream:
+                if not self.apply_delta_stream(target_file, delta_stream, staged_file, change.codec):
+                    raise Exception("Ошибка применения дельты")
+        
+        # Проверяем результат до фиксации
+        if change.new_hash and self.hash_file(staged_file) != change.new_hash:
+            raise Exception("Хеш результата не совпадает с new_hash")
+    
+    def _commit_changes(self, prepared: List[tuple], staging_dir: str) -> Tuple[bool, bool]:
+        """Фиксация подготовленных изменений с откатом уже зафиксированных при ошибке
+
+        Сначала выполняются удаления (глубокие пути первыми), затем
+        подмены и добавления. Перед подменой или удалением оригинал
+        переносится в staging, чтобы его можно было вернуть.
+
+        Возвращает (изменения зафиксированы, staging можно удалить): при
+        неполном откате в staging остаются резервные копии оригиналов.
+        """
+        deletes = sorted((item for item in prepared if item[0].change_type == 'delete'),
+                         key=lambda item: item[1].count(os.sep), reverse=True)
+        writes = [item for item in prepared if item[0].change_type != 'delete']
+        committed = []  # (целевой файл, резервная копия оригинала или None, созданные директории)
+        
+        try:
+            for index, (change, target_file, staged_file) in enumerate(deletes + writes):
+                backup_file = os.path.join(staging_dir, f"{index}.orig")
+                had_original = os.path.isfile(target_file)
+                if had_original:
+                    os.replace(target_file, backup_file)
+                
+                if change.change_type == 'delete':
+                    if had_original:
+                        committed.append((target_file, backup_file, []))
+                        logger.debug(f"Удален файл: {change.file_path}")
+                    continue
+                
+                created_dirs = []
+                parent = os.path.dirname(target_file)
+                while not os.path.isdir(parent):
+                    created_dirs.append(parent)
+                    parent = os.path.dirname(parent)
+                committed.append((target_file, backup_file if had_original else None, created_dirs))
+                os.makedirs(os.path.dirname(target_file), exist_ok=True)
+                if os.path.isdir(target_file) and not os.listdir(target_file):
+                    os.rmdir(target_file)  # Директория, ставшая файлом после удалений
+                os.replace(staged_file, target_file)
+                logger.debug(f"Зафиксировано изменение: {change.file_path}")
+            
+            return True, True
+            
+        except Exception as e:
+            logger.error(f"Ошибка фиксации изменений, откат {len(committed)} файлов: {e}")
+            rollback_complete = True
+            for target_file, backup_file, created_dirs in reversed(committed):
+                try:
+                    if os.path.isfile(target_file):
+                        os.remove(target_file)
+                    for created_dir in created_dirs:
+                        if os.path.isdir(created_dir) and not os.listdir(created_dir):
+                            os.rmdir(created_dir)
+                    if backup_file:
+                        if os.path.isdir(target_file) and not os.listdir(target_file):
+                            os.rmdir(target_file)
+                        os.makedirs(os.path.dirname(target_file), exist_ok=True)
+                        os.replace(backup_file, target_file)
+                except Exception as rollback_error:
+                    rollback_complete = False
+                    logger.error(f"Не удалось откатить {target_file}: {rollback_error}")
+            return False, rollback_complete
+    
     def apply_delta_package(self, delta_package: str, target_dir: str, 
-                           progress_callback=None) -> bool:
-        """Применение пакета delta-обновления"""
+                           progress_callback=None, workers: int = 1) -> bool:
+        """Применение пакета delta-обновления
+
+        Архив не распаковывается целиком: новые файлы и дельты читаются
+        из zip потоками. На этапе подготовки результаты независимых файлов
+        строятся (при ``workers > 1`` - в пуле потоков) во временной
+        staging-директории внутри ``target_dir`` и сверяются с ``new_hash``.
+        Затем изменения фиксируются через ``os.replace``; при ошибке
+        фиксации откатываются только уже зафиксированные файлы.
+        """
         if not BSDIFF4_AVAILABLE:
             logger.warning("Применение delta-пакетов недоступно без bsdiff4")
             return False
         
+        target_root = os.path.abspath(target_dir)
+        os.makedirs(target_root, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix='.delta_staging_', dir=target_root)
+        keep_staging = False
+        zip_local = threading.local()
+        opened_zips = []
+        
         try:
             logger.info(f"Применение delta-пакета: {delta_package}")
             
-            with tempfile.TemporaryDirectory() as temp_dir:
-                self.temp_dir = temp_dir
-                
-                # Извлекаем архив
-                with zipfile.ZipFile(delta_package, 'r') as delta_zip:
-                    delta_zip.extractall(temp_dir)
+            with zipfile.ZipFile(delta_package, 'r') as delta_zip:
+                members = {name: name for name in delta_zip.namelist()}
                 
                 # Читаем манифест
-                manifest_path = os.path.join(temp_dir, 'delta_manifest.json')
-                if not os.path.exists(manifest_path):
+                if 'delta_manifest.json' not in members:
                     logger.error("Манифест дельты не найден")
                     return False
                 
-                with open(manifest_path, 'r', encoding='utf-8') as f:
-                    delta_manifest = json.load(f)
-                
-                changes = [FileChange.from_dict(change) for change in delta_manifest['changes']]
-                total_changes = len(changes)
-                processed_changes = 0
-                
-                logger.info(f"Применение {total_changes} изменений")
-                
-                for change in changes:
+                delta_manifest = json.loads(delta_zip.read('delta_manifest.json').decode('utf-8'))
+            
+            changes = [FileChange.from_dict(change) for change in delta_manifest['changes']]
+            total_changes = len(changes)
+            
+            missing_codecs = {change.codec for change in changes
+                              if change.change_type == 'modify' and not get_codec(change.codec)}
+            if missing_codecs:
+                logger.error(f"Пакет требует недоступные кодеки: {', '.join(sorted(c or DEFAULT_CODEC_ID for c in missing_codecs))}")
+                return False
+            
+            logger.info(f"Применение {total_changes} изменений")
+            
+            prepared = []
+            for index, change in enumerate(changes):
+                target_file = os.path.abspath(os.path.join(target_root, change.file_path))
+                if not target_file.startswith(target_root + os.sep):
+                    logger.error(f"Путь за пределами целевой директории: {change.file_path}")
+                    return False
+                if change.change_type == 'delete':
+                    prepared.append((change, target_file, None))
+                elif change.change_type in ('add', 'replace', 'modify'):
+                    prepared.append((change, target_file, os.path.join(staging_dir, f"{index}.new")))
+            
+            processed_changes = 0
+            
+            def report_progress():
+                if progress_callback and total_changes > 0:
+                    progress_callback(int((processed_changes / total_changes) * 100))
+            
+            # Удаления не требуют подготовки
+            processed_changes = sum(1 for item in prepared if item[2] is None)
+            report_progress()
+            
+            to_prepare = [item for item in prepared if item[2] is not None]
+            worker_count = max(1, min(workers, len(to_prepare)))
+            with ThreadPoolExecutor(max_workers=worker_count) as pool:
+                futures = {
+                    pool.submit(self._prepare_change, delta_package, members, change,
+                                target_file, staged_file, zip_local, opened_zips): change
+                    for change, target_file, staged_file in to_prepare
+                }
+                failed = False
+                for future in as_completed(futures):
+                    change = futures[future]
+                    if future.cancelled():
+                        continue
                     try:
-                        target_file = os.path.join(target_dir, change.file_path)
-                        
-                        if change.change_type == 'delete':
-                            # Удаляем файл
-                            if os.path.exists(target_file):
-                                os.remove(target_file)
-                                logger.debug(f"Удален файл: {change.file_path}")
-                        
-                        elif change.change_type == 'add' or change.change_type == 'replace':
-                            # Копируем новый файл
-                            source_file = os.path.join(temp_dir, 'files', change.file_path)
-                            if os.path.exists(source_file):
-                                os.makedirs(os.path.dirname(target_file), exist_ok=True)
-                                with open(source_file, 'rb') as src, open(target_file, 'wb') as dst:
-                                    dst.write(src.read())
-                                logger.debug(f"Скопирован файл: {change.file_path}")
-                        
-                        elif change.change_type == 'modify':
-                            # Применяем дельту
-                            delta_file = os.path.join(temp_dir, 'deltas', f"{change.file_path}.delta")
-                            if os.path.exists(delta_file) and os.path.exists(target_file):
-                                with open(delta_file, 'rb') as f:
-                                    delta_data = f.read()
-                                
-                                temp_target = f"{target_file}.tmp"
-                                if self.apply_binary_delta(target_file, delta_data, temp_target):
-                                    os.replace(temp_target, target_file)
-                                    logger.debug(f"Применена дельта: {change.file_path}")
-                                else:
-                                    if os.path.exists(temp_target):
-                                        os.remove(temp_target)
-                                    raise Exception("Ошибка применения дельты")
-                        
-                        processed_changes += 1
-                        
-                        # Обновляем прогресс
-                        if progress_callback:
-                            progress = int((processed_changes / total_changes) * 100)
-                            progress_callback(progress)
-                        
+                        future.result()
                     except Exception as e:
                         logger.error(f"Ошибка применения изменения {change.file_path}: {e}")
-                        return False
-                
-                logger.info(f"Delta-пакет успешно применен: {processed_changes}/{total_changes} изменений")
-                return True
+                        if not failed:
+                            failed = True
+                            for other in futures:
+                                other.cancel()
+                        continue
+                    processed_changes += 1
+                    report_progress()
+            
+            if failed:
+                return False
+            
+            committed, rollback_complete = self._commit_changes(prepared, staging_dir)
+            if not committed:
+                keep_staging = not rollback_complete
+                return False
+            
+            logger.info(f"Delta-пакет успешно применен: {processed_changes}/{total_changes} изменений")
+            return True
                 
         except Exception as e:
             logger.error(f"Ошибка применения delta-пакета: {e}")
             return False
+        
+        finally:
+            for opened_zip in opened_zips:
+                try:
+                    opened_zip.close()
+                except Exception:
+                    pass
+            if keep_staging:
+                # Резервные копии оригиналов - единственный способ восстановить файлы вручную
+                logger.error(f"Откат выполнен не полностью, резервные копии оригиналов сохранены в {staging_dir}")
+            else:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+def version_key(version: str) -> Tuple[int, ...]:
+    """Ключ сортировки версии вида 1.0.10"""
+    return tuple(int(part) for part in re.findall(r'\d+', version))
+
+def delta_index_payload(index: dict) -> bytes:
+    """Каноническое представление индекса дельт для подписи (без поля signature)"""
+    payload = {key: value for key, value in index.items() if key != 'signature'}
+    return json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def build_delta_index(publish_dir: str, output_path: Optional[str] = None,
+                      signer=None) -> Optional[dict]:
+    """Построение индекса delta-пакетов и полных архивов каталога публикации
+
+    Версии дельты берутся из её ``delta_manifest.json``, полные архивы
+    распознаются по имени ``files_list_v<версия>.zip``, манифесты
+    хранилища чанков - по имени ``chunk_manifest_v<версия>.json``. Для
+    каждого файла записываются размер и SHA-256, для дельт - ещё ``compression_ratio``
+    (размер пакета к объёму новых данных). При переданном ``signer``
+    (``crypto_signer.Signer``) индекс подписывается целиком. Индекс
+    записывается в ``deltas.json`` (или ``output_path``).
+    """
+    try:
+        deltas = []
+        full_archives = []
+        chunk_manifests = []
+        
+        for file_name in sorted(os.listdir(publish_dir)):
+            file_path = os.path.join(publish_dir, file_name)
+            if not os.path.isfile(file_path):
+                continue
+            
+            full_match = _FULL_ARCHIVE_PATTERN.match(file_name)
+            if full_match:
+                full_archives.append({
+                    'version': full_match.group(1),
+                    'file': file_name,
+                    'size': os.path.getsize(file_path),
+                    'sha256': DeltaApplier.hash_file(file_path)
+                })
+                continue
+            
+            chunk_match = _CHUNK_MANIFEST_PATTERN.match(file_name)
+            if chunk_match:
+                chunk_manifests.append({
+                    'version': chunk_match.group(1),
+                    'file': file_name,
+                    'size': os.path.getsize(file_path),
+                    'sha256': DeltaApplier.hash_file(file_path)
+                })
+                continue
+            
+            if not _DELTA_PACKAGE_PATTERN.search(file_name):
+                continue
+            try:
+                with zipfile.ZipFile(file_path, 'r') as delta_zip:
+                    delta_manifest = json.loads(delta_zip.read('delta_manifest.json').decode('utf-8'))
+                package_size = os.path.getsize(file_path)
+                new_data_size = sum(change.get('new_size') or 0 for change in delta_manifest['changes']
+                                    if change['change_type'] != 'delete')
+                deltas.append({
+                    'from': delta_manifest['source_version'],
+                    'to': delta_manifest['target_version'],
+                    'file': file_name,
+                    'size': package_size,
+                    'sha256': DeltaApplier.hash_file(file_path),
+                    'compression_ratio': round(package_size / new_data_size, 4) if new_data_size else 0.0,
+                    'codecs': delta_manifest.get('codecs', [DEFAULT_CODEC_ID])
+                })
+            except Exception as e:
+                logger.warning(f"Пропускаем delta-пакет {file_name}: {e}")
+        
+        index = {
+            'format': DELTA_INDEX_FORMAT,
+            'generated_at': datetime.now().isoformat(),
+            'deltas': deltas,
+            'full': full_archives,
+            'chunk_manifests': chunk_manifests
+        }
+        
+        if signer:
+            signature = signer.sign_data(delta_index_payload(index))
+            if signature:
+                index['signature'] = signature
+            else:
+                logger.warning("Не удалось подписать индекс дельт")
+        
+        output_path = output_path or os.path.join(publish_dir, DELTA_INDEX_FILENAME)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2, ensure_ascii=False)
+        
+        logger.info(f"Индекс дельт создан: {output_path} ({len(deltas)} дельт, {len(full_archives)} архивов, "
+                    f"{len(chunk_manifests)} манифестов чанков)")
+        return index
+        
+    except Exception as e:
+        logger.error(f"Ошибка построения индекса дельт: {e}")
+        return None
+
+def find_delta_route(index: dict, current_version: str, target_version: str,
+                     supported_codecs: Optional[List[str]] = None) -> Optional[List[DeltaRouteStep]]:
+    """Поиск самого дешёвого по объёму загрузки маршрута обновления
+
+    Вершины графа - версии, рёбра - delta-пакеты (в том числе с пропуском
+    версий) и полные архивы: полный архив версии содержит всё дерево,
+    поэтому ведёт в неё из любой более ранней версии. Алгоритм Дейкстры
+    минимизирует суммарный размер, при равенстве - число шагов. Дельты,
+    требующие кодеков не из ``supported_codecs``, не рассматриваются.
+    Возвращает None, если целевая версия недостижима.
+    """
+    try:
+        current_key = version_key(current_version)
+        target_key = version_key(target_version)
+        if current_key >= target_key:
+            return []
+        
+        edges: Dict[str, List[DeltaRouteStep]] = {}
+        for delta in index.get('deltas', []):
+            from_key, to_key = version_key(delta['from']), version_key(delta['to'])
+            if supported_codecs is not None and not set(delta.get('codecs', [DEFAULT_CODEC_ID])) <= set(supported_codecs):
+                continue
+            if current_key <= from_key < to_key <= target_key:
+                edges.setdefault(delta['from'], []).append(DeltaRouteStep(
+                    delta['from'], delta['to'], 'delta', delta['file'], int(delta['size']), delta.get('sha256')))
+        full_archives = [archive for archive in index.get('full', [])
+                         if current_key < version_key(archive['version']) <= target_key]
+        
+        best = {current_version: (0, 0)}
+        previous: Dict[str, DeltaRouteStep] = {}
+        queue = [(0, 0, current_key, current_version)]
+        
+        while queue:
+            cost, hops, node_key, node = heapq.heappop(queue)
+            if best.get(node, (cost, hops)) < (cost, hops):
+                continue
+            if node_key == target_key:
+                route = []
+                while node != current_version:
+                    step = previous[node]
+                    route.append(step)
+                    node = step.from_version
+                return list(reversed(route))
+            
+            steps = list(edges.get(node, []))
+            steps.extend(DeltaRouteStep(node, archive['version'], 'full', archive['file'],
+                                        int(archive['size']), archive.get('sha256'))
+                         for archive in full_archives if version_key(archive['version']) > node_key)
+            for step in steps:
+                candidate = (cost + step.size, hops + 1)
+                if candidate < best.get(step.to_version, (float('inf'), 0)):
+                    best[step.to_version] = candidate
+                    previous[step.to_version] = step
+                    heapq.heappush(queue, (*candidate, version_key(step.to_version), step.to_version))
+        
+        return None
+        
+    except Exception as e:
+        logger.error(f"Ошибка поиска маршрута обновления: {e}")
+        return None
 
 # Интеграция с существующей системой обновлений
 def is_delta_update_beneficial(old_size: int, new_size: int, delta_size: int) -> bool:
@@ -4,6 +4,7 @@
 
 import os
 import json
+import hashlib
 import asyncio
 import aiohttp
 import logging
@@ -58,6 +59,10 @@ class ResumableDownload:
         self.is_paused = False
         self.is_cancelled = False
         self.start_time = None
+        
+        # SHA-256 считается по потоку загрузки; после завершения - в sha256
+        self.hasher = None
+        self.sha256: Optional[str] = None
     
     def save_state(self):
         """Сохранение состояния загрузки"""
@@ -91,6 +96,36 @@ class ResumableDownload:
             except Exception as e:
                 logger.warning(f"Не удалось удалить {file_path}: {e}")
     
+    def _restore_hash_state(self):
+        """Хеш уже загруженной части при возобновлении
+
+        Состояние hashlib не сохраняется между запусками, поэтому префикс
+        временного файла хешируется один раз перед докачкой. Хвост,
+        записанный после последнего сохранения состояния, отрезается:
+        докачка продолжится ровно с downloaded_size.
+        """
+        self.hasher = hashlib.sha256()
+        if self.state.downloaded_size <= 0:
+            return
+        try:
+            file_size = os.path.getsize(self.temp_file)
+        except OSError:
+            file_size = 0
+        if file_size < self.state.downloaded_size:
+            logger.info(f"Временный файл короче сохранённого состояния, продолжаем с {file_size}")
+            self.state.downloaded_size = file_size
+        elif file_size > self.state.downloaded_size:
+            os.truncate(self.temp_file, self.state.downloaded_size)
+        
+        remaining = self.state.downloaded_size
+        with open(self.temp_file, 'rb') as f:
+            while remaining > 0:
+                chunk = f.read(min(1024 * 1024, remaining))
+                if not chunk:
+                    break
+                self.hasher.update(chunk)
+                remaining -= len(chunk)
+    
     async def check_resume_support(self, session: aiohttp.ClientSession) -> tuple:
         """Проверка поддержки возобновления загрузки"""
         try:
@@ -141,6 +176,10 @@ class ResumableDownload:
                     if os.path.exists(self.temp_file):
                         os.remove(self.temp_file)
             
+            if not self.state.supports_resume:
+                self.state.downloaded_size = 0
+            self._restore_hash_state()
+            
             # Сохраняем начальное состояние
             self.save_state()
             
@@ -155,6 +194,12 @@ class ResumableDownload:
                 if response.status not in [200, 206]:
                     raise Exception(f"HTTP {response.status}: {response.reason}")
                 
+                # Сервер проигнорировал Range и отдаёт файл целиком - начинаем с нуля
+                if response.status == 200 and self.state.downloaded_size > 0:
+                    logger.info("Сервер не поддержал докачку, загружаем файл заново")
+                    self.state.downloaded_size = 0
+                    self.hasher = hashlib.sha256()
+                
                 # Обновляем размер файла если это частичная загрузка
                 if response.status == 206:
                     content_range = response.headers.get('content-range', '')
@@ -179,6 +224,7 @@ class ResumableDownload:
                 if os.path.exists(self.dest_path):
                     os.remove(self.dest_path)
                 os.rename(self.temp_file, self.dest_path)
+                self.sha256 = self.hasher.hexdigest()
                 
                 # Очищаем временные файлы
                 self.cleanup_state()
@@ -210,6 +256,7 @@ class ResumableDownload:
                 return
             
             await f.write(chunk)
+            self.hasher.update(chunk)
             self.state.downloaded_size += len(chunk)
             
             # Обновляем прогресс
@@ -234,6 +281,7 @@ class ResumableDownload:
                 return
             
             f.write(chunk)
+            self.hasher.update(chunk)
             self.state.downloaded_size += len(chunk)
             
             # Обновляем прогресс
@@ -285,6 +333,8 @@ class DownloadManager:
     
     def __init__(self):
         self.downloads: Dict[str, ResumableDownload] = {}
+        # SHA-256 завершённых загрузок, посчитанные по потоку (id -> хеш)
+        self.completed_hashes: Dict[str, str] = {}
         self.session: Optional[aiohttp.ClientSession] = None
     
     async def __aenter__(self):
@@ -325,6 +375,7 @@ class DownloadManager:
             result = await download.download(self.session)
             if result:
                 # Удаляем завершенную загрузку из списка
+                self.completed_hashes[download_id] = download.sha256
                 del self.downloads[download_id]
             return result
         except Exception as e:
@@ -353,6 +404,10 @@ class DownloadManager:
             return self.downloads[download_id].state
         return None
     
+    def get_download_hash(self, download_id: str) -> Optional[str]:
+        """SHA-256 завершённой загрузки без повторного чтения файла"""
+        return self.completed_hashes.get(download_id)
+    
     def list_active_downloads(self) -> list:
         """Список активных загрузок"""
         return list(self.downloads.keys())
@@ -0,0 +1,304 @@
+"""
+Обнаружение пиров в локальной сети (UDP multicast/broadcast) для компьютерных клубов и LAN
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+LAN_PROTOCOL = 'launcher-lan-v1'
+# Группа из диапазона administratively scoped (239/8): за пределы площадки не уходит,
+# TTL 1 - пакеты не проходят маршрутизатор
+LAN_DISCOVERY_GROUP = '239.255.42.99'
+LAN_DISCOVERY_PORT = 48621
+ANNOUNCE_INTERVAL = 10.0
+# Пир, не анонсировавшийся столько интервалов, считается ушедшим
+LAN_PEER_TTL_INTERVALS = 3
+# Анонс помещается в одну дейтаграмму без фрагментации
+MAX_ANNOUNCE_BYTES = 1400
+# Ответный анонс новому пиру - не чаще раза в секунду
+REPLY_INTERVAL = 1.0
+
+class LanDiscovery(asyncio.DatagramProtocol):
+    """Анонс и приём списка раздаваемых манифестов и файлов в локальной сети
+
+    Каждые ``announce_interval`` секунд в multicast-группу (или
+    широковещательно при ``broadcast=True``) уходит JSON-дейтаграмма с ID
+    пира, портом P2P сервера, корнями манифестов, все файлы которых есть
+    у пира, и хешами отдельных файлов (сколько поместится). Полученные
+    анонсы превращаются в LAN-пиров распределителя: роевая загрузка
+    берёт куски у них раньше, чем у CDN. Новому пиру сразу отправляется
+    ответный анонс, чтобы он не ждал следующего интервала.
+    """
+
+    def __init__(self, distributor, group: str = LAN_DISCOVERY_GROUP, port: int = LAN_DISCOVERY_PORT,
+                 interface: str = '0.0.0.0', announce_interval: float = ANNOUNCE_INTERVAL,
+                 broadcast: bool = False):
+        self.distributor = distributor
+        self.group = group
+        self.port = port
+        self.interface = interface
+        self.announce_interval = announce_interval
+        self.peer_ttl = LAN_PEER_TTL_INTERVALS * announce_interval
+        self.broadcast = broadcast
+        self.transport = None
+        self._announce_task: Optional[asyncio.Task] = None
+        self._last_reply = 0.0
+
+    def _create_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        # Несколько лаунчеров (и тестовых процессов) на одной машине слушают один порт
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if self.broadcast:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind(('', self.port))
+        if not self.broadcast:
+            membership = struct.pack('4s4s', socket.inet_aton(self.group), socket.inet_aton(self.interface))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            if self.interface != '0.0.0.0':
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.interface))
+        sock.setblocking(False)
+        return sock
+
+    async def start(self) -> bool:
+        """Запуск приёма и периодического анонса"""
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.create_datagram_endpoint(lambda: self, sock=self._create_socket())
+            self._announce_task = asyncio.ensure_future(self._announce_loop())
+            mode = "broadcast" if self.broadcast else f"multicast {self.group}"
+            logger.info(f"Обнаружение пиров в локальной сети: {mode}, порт {self.port}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка запуска обнаружения пиров в локальной сети: {e}")
+            return False
+
+    async def stop(self):
+        if self._announce_task:
+            self._announce_task.cancel()
+            await asyncio.gather(self._announce_task, return_exceptions=True)
+            self._announce_task = None
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def build_announcement(self) -> bytes:
+        """Анонс не длиннее MAX_ANNOUNCE_BYTES: корни манифестов важнее отдельных файлов"""
+        message = {
+            'proto': LAN_PROTOCOL,
+            'peer_id': self.distributor.get_peer_id(),
+            'port': self.distributor.port,
+            'manifests': sorted(self.distributor.local_manifests),
+            'files': []
+        }
+        payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+        for file_hash in self.distributor.shared_hashes():
+            # Хеш в кавычках и запятая
+            if len(payload) + len(file_hash) + 3 > MAX_ANNOUNCE_BYTES:
+                break
+            message['files'].append(file_hash)
+            payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+        return payload
+
+    def announce(self):
+        if self.transport is None:
+            return
+        target = '<broadcast>' if self.broadcast else self.group
+        try:
+            self.transport.sendto(self.build_announcement(), (target, self.port))
+        except Exception as e:
+            logger.warning(f"Ошибка отправки анонса в локальную сеть: {e}")
+
+    async def _announce_loop(self):
+        while True:
+            self.announce()
+            self.distributor.expire_lan_peers(self.peer_ttl)
+            await asyncio.sleep(self.announce_interval)
+
+    def datagram_received(self, data: bytes, addr):
+        try:
+            message = json.loads(data.decode('utf-8'))
+            if message.get('proto') != LAN_PROTOCOL:
+                return
+            peer_id = message['peer_id']
+            if peer_id == self.distributor.get_peer_id():
+                return
+            is_new = self.distributor.add_lan_peer(peer_id, addr[0], int(message['port']),
+                                                   message.get('manifests', []), message.get('files', []))
+            now = time.monotonic()
+            if is_new and now - self._last_reply >= REPLY_INTERVAL:
+                self._last_reply = now
+                self.announce()
+        except Exception as e:
+            logger.debug(f"Некорректный анонс от {addr}: {e}")
+
+    def error_received(self, exc):
+        logger.debug(f"Ошибка сокета обнаружения пиров: {exc}")
+
+
+# Проверка на loopback: несколько процессов-лаунчеров в одной multicast-группе
+
+async def _run_node(args) -> dict:
+    """Процесс-лаунчер: раздаёт файл или находит пиров в LAN и загружает файл роем"""
+    from p2p_distribution import P2PDistributor
+
+    with open(args.entry, 'r', encoding='utf-8') as f:
+        entry = json.load(f)
+    distributor = P2PDistributor(port=args.http_port, peer_id=f"node-{args.http_port}")
+    discovery = LanDiscovery(distributor, port=args.discovery_port, interface='127.0.0.1',
+                             announce_interval=args.announce_interval)
+    if args.seed:
+        distributor.add_local_file(args.seed, entry['hash'])
+    if not await distributor.start_server('127.0.0.1') or not await discovery.start():
+        return {'ok': False}
+
+    result = {'ok': True, 'node': distributor.get_peer_id()}
+    if args.download:
+        # Ждём, пока кто-нибудь в LAN объявит файл, и ещё интервал ответных анонсов -
+        # чтобы собрать остальных
+        deadline = time.monotonic() + args.discovery_timeout
+        while time.monotonic() < deadline and not any(
+                distributor.peer_has(peer, entry['hash']) for peer in distributor.peers.values()):
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(REPLY_INTERVAL)
+        result['lan_peers'] = sum(1 for peer in distributor.peers.values() if peer.lan)
+        started = time.perf_counter()
+        result['ok'] = await distributor.download_pieces(entry, args.download, args.piece_size,
+                                                         mirrors=[args.mirror] if args.mirror else None)
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        result['sources'] = distributor.last_swarm_stats.sources if distributor.last_swarm_stats else {}
+        if result['ok']:
+            distributor.add_local_file(args.download, entry['hash'])
+            discovery.announce()
+    print(json.dumps(result, ensure_ascii=False), flush=True)
+    while True:
+        await asyncio.sleep(3600)
+
+async def run_loopback_lan(nodes: int = 6, size: int = 8 * 1024 * 1024, piece_size: int = 256 * 1024,
+                           discovery_port: int = 0, announce_interval: float = 1.0) -> dict:
+    """Клуб на одной машине: один сид, ``nodes`` загружающих процессов и CDN-зеркало
+
+    Загружающие процессы находят друг друга и сида через multicast на
+    127.0.0.1 и загружают файл роем; зеркало (отдельный процесс)
+    считает отданные байты. Возвращает результаты узлов и долю трафика,
+    ушедшую с CDN.
+    """
+    from aiohttp import web
+    from merkle_manifest import hash_pieces, pieces_root
+    from p2p_swarm import _free_port, _wait_port
+
+    cdn_bytes = 0
+
+    @web.middleware
+    async def count_bytes(request, handler):
+        nonlocal cdn_bytes
+        response = await handler(request)
+        rng = request.http_range
+        if rng.start is not None:
+            cdn_bytes += min(rng.stop or size, size) - rng.start
+        elif response.status == 200:
+            cdn_bytes += size
+        return response
+
+    processes = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_path = os.path.join(temp_dir, 'source.bin')
+        with open(source_path, 'wb') as f:
+            f.write(os.urandom(size))
+        file_hash, piece_hashes = hash_pieces(source_path, piece_size)
+        entry = {'size': size, 'hash': file_hash}
+        if len(piece_hashes) > 1:
+            entry.update({'pieces_root': pieces_root(piece_hashes), 'pieces': piece_hashes})
+        entry_path = os.path.join(temp_dir, 'entry.json')
+        with open(entry_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+
+        # CDN в родительском процессе, чтобы считать отданные байты
+        from p2p_distribution import P2PDistributor
+        cdn = P2PDistributor(port=_free_port())
+        cdn.add_local_file(source_path, file_hash)
+        await cdn.start_server('127.0.0.1', middlewares=[count_bytes])
+        mirror = f"http://127.0.0.1:{cdn.port}/download/{file_hash}"
+        discovery_port = discovery_port or _free_port()
+
+        try:
+            def spawn(extra: List[str]) -> subprocess.Popen:
+                port = _free_port()
+                command = [sys.executable, os.path.abspath(__file__), 'node', '--http-port', str(port),
+                           '--discovery-port', str(discovery_port), '--entry', entry_path,
+                           '--piece-size', str(piece_size), '--announce-interval', str(announce_interval)] + extra
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+                if not _wait_port(port):
+                    raise RuntimeError(f"Узел на порту {port} не запустился")
+                return process
+
+            processes.append(spawn(['--seed', source_path]))
+            for number in range(nodes):
+                processes.append(spawn(['--download', os.path.join(temp_dir, f"node_{number}.bin"),
+                                        '--mirror', mirror]))
+
+            loop = asyncio.get_running_loop()
+            results = [json.loads(await loop.run_in_executor(None, process.stdout.readline))
+                       for process in processes[1:]]
+            downloaded = sum(size for result in results if result.get('ok'))
+            return {
+                'ok': all(result.get('ok') for result in results),
+                'nodes': results,
+                'cdn_bytes': cdn_bytes,
+                'downloaded_bytes': downloaded,
+                'cdn_share': round(cdn_bytes / downloaded, 3) if downloaded else 0.0
+            }
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+            await cdn.stop_server()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Проверка обнаружения пиров в LAN на loopback")
+    commands = parser.add_subparsers(dest='command', required=True)
+    node = commands.add_parser('node', help="Процесс-лаунчер")
+    node.add_argument('--http-port', type=int, required=True)
+    node.add_argument('--discovery-port', type=int, default=LAN_DISCOVERY_PORT)
+    node.add_argument('--entry', required=True, help="JSON-запись файла манифеста")
+    node.add_argument('--piece-size', type=int, required=True)
+    node.add_argument('--announce-interval', type=float, default=ANNOUNCE_INTERVAL)
+    node.add_argument('--discovery-timeout', type=float, default=5.0)
+    node.add_argument('--seed', help="Раздавать готовый файл")
+    node.add_argument('--download', help="Загрузить файл по этому пути")
+    node.add_argument('--mirror', help="Адрес CDN-зеркала")
+    loopback = commands.add_parser('loopback', help="Один сид и несколько загружающих узлов")
+    loopback.add_argument('--nodes', type=int, default=6)
+    loopback.add_argument('--size-mb', type=int, default=8)
+    loopback.add_argument('--piece-size', type=int, default=256 * 1024)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'node':
+        return 0 if asyncio.run(_run_node(args)).get('ok') else 1
+    result = asyncio.run(run_loopback_lan(args.nodes, args.size_mb * 1024 * 1024, args.piece_size))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result['ok'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Манифест файлов релиза на дереве Меркла: одна подпись на корень вместо подписи каждого файла
+"""
+
+import json
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+MERKLE_MANIFEST_FORMAT = 'merkle-manifest-v1'
+# Размер куска для P2P и частичных загрузок: файлы крупнее куска
+# описываются списком хешей кусков, каждый кусок проверяется отдельно
+DEFAULT_PIECE_SIZE = 1024 * 1024
+
+# Префиксы разделяют хеши листьев и узлов (как в RFC 6962): лист
+# нельзя выдать за внутренний узел и подделать доказательство
+_LEAF_PREFIX = b'\x00'
+_NODE_PREFIX = b'\x01'
+
+def leaf_hash(relative_path: str, size: int, file_hash: str, pieces_root: Optional[str] = None) -> bytes:
+    """Хеш листа: путь, размер и SHA-256 файла (и корень кусков, если есть)
+
+    Для файлов без кусков лист не меняется - манифесты без кусков
+    проверяются как раньше.
+    """
+    leaf_data = f"{relative_path}\n{size}\n{file_hash}"
+    if pieces_root:
+        leaf_data += f"\n{pieces_root}"
+    return hashlib.sha256(_LEAF_PREFIX + leaf_data.encode('utf-8')).digest()
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    """Хеш внутреннего узла"""
+    return hashlib.sha256(_NODE_PREFIX + left + right).digest()
+
+class MerkleTree:
+    """Двоичное дерево Меркла над списком листьев
+
+    Узел без пары поднимается на уровень выше без изменений, поэтому
+    корень и доказательства определены для любого числа листьев.
+    """
+
+    def __init__(self, leaves: List[bytes]):
+        self.levels: List[List[bytes]] = [list(leaves)]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            parent = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+            if len(level) % 2:
+                parent.append(level[-1])
+            self.levels.append(parent)
+
+    @property
+    def root(self) -> bytes:
+        """Корень дерева (хеш пустой строки для пустого дерева)"""
+        if not self.levels[0]:
+            return hashlib.sha256(b'').digest()
+        return self.levels[-1][0]
+
+    def proof(self, index: int) -> List[List[str]]:
+        """Доказательство включения листа: пары [сторона соседа 'L'/'R', hex-хеш]"""
+        if not 0 <= index < len(self.levels[0]):
+            raise IndexError(f"Нет листа с индексом {index}")
+        path = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                path.append(['L' if sibling < index else 'R', level[sibling].hex()])
+            index //= 2
+        return path
+
+def root_from_proof(leaf: bytes, proof: List[List[str]]) -> bytes:
+    """Корень, получающийся из листа и доказательства включения"""
+    current = leaf
+    for side, sibling_hex in proof:
+        sibling = bytes.fromhex(sibling_hex)
+        current = node_hash(sibling, current) if side == 'L' else node_hash(current, sibling)
+    return current
+
+def manifest_tree(files: Dict[str, dict]) -> MerkleTree:
+    """Дерево по записям манифеста (листья в порядке индексов ``leaf``)"""
+    ordered = sorted(files.items(), key=lambda item: item[1]['leaf'])
+    return MerkleTree([leaf_hash(path, info['size'], info['hash'], info.get('pieces_root'))
+                       for path, info in ordered])
+
+def hash_pieces(file_path: str, piece_size: int = DEFAULT_PIECE_SIZE) -> Tuple[str, List[str]]:
+    """SHA-256 файла и хеши его кусков за одно чтение"""
+    file_hasher = hashlib.sha256()
+    pieces = []
+    with open(file_path, 'rb') as f:
+        for piece in iter(lambda: f.read(piece_size), b''):
+            file_hasher.update(piece)
+            pieces.append(hashlib.sha256(piece).hexdigest())
+    return file_hasher.hexdigest(), pieces
+
+def pieces_root(pieces: List[str]) -> str:
+    """Корень дерева Меркла над хешами кусков"""
+    return MerkleTree([hashlib.sha256(_LEAF_PREFIX + bytes.fromhex(piece)).digest()
+                       for piece in pieces]).root.hex()
+
+def piece_count(size: int, piece_size: int) -> int:
+    """Число кусков файла (у пустого файла один пустой кусок)"""
+    return max(1, -(-size // piece_size))
+
+def piece_range(index: int, size: int, piece_size: int) -> Tuple[int, int]:
+    """Смещение и длина куска в файле"""
+    offset = index * piece_size
+    return offset, max(0, min(piece_size, size - offset))
+
+def file_pieces(entry: dict) -> List[str]:
+    """Хеши кусков записи файла; файл не крупнее куска - один кусок с хешем файла"""
+    return entry.get('pieces') or [entry['hash']]
+
+def check_file_pieces(entry: dict, piece_size: int) -> bool:
+    """Список кусков записи соответствует размеру файла и подписанному корню кусков"""
+    pieces = file_pieces(entry)
+    if len(pieces) != piece_count(entry['size'], piece_size):
+        return False
+    if 'pieces' not in entry:
+        return True
+    return pieces_root(pieces) == entry.get('pieces_root')
+
+def build_manifest(file_hashes: Dict[str, tuple], version: str = '2.0',
+                   pieces: Optional[Dict[str, List[str]]] = None,
+                   piece_size: Optional[int] = None) -> dict:
+    """Манифест без подписи по словарю путь -> (размер, SHA-256)
+
+    Листья упорядочены по пути, индекс листа хранится в записи файла.
+    ``pieces`` (путь -> хеши кусков размера ``piece_size``) добавляет в
+    запись список кусков; корень кусков входит в лист, поэтому список
+    защищён подписью манифеста.
+    """
+    files = {}
+    for index, relative_path in enumerate(sorted(file_hashes)):
+        size, file_hash = file_hashes[relative_path]
+        files[relative_path] = {'size': size, 'hash': file_hash, 'leaf': index}
+        file_piece_hashes = pieces.get(relative_path) if pieces else None
+        if file_piece_hashes and len(file_piece_hashes) > 1:
+            files[relative_path]['pieces_root'] = pieces_root(file_piece_hashes)
+            files[relative_path]['pieces'] = file_piece_hashes
+    manifest = {
+        'format': MERKLE_MANIFEST_FORMAT,
+        'version': version,
+        'created_at': datetime.now().isoformat(),
+        'hash_algorithm': 'sha256',
+        'leaf_count': len(files),
+        'merkle_root': manifest_tree(files).root.hex(),
+        'files': files
+    }
+    if piece_size:
+        manifest['piece_size'] = piece_size
+    return manifest
+
+def manifest_header(manifest: dict) -> dict:
+    """Подписываемая часть манифеста: метаданные и корень без списка файлов"""
+    return {key: manifest[key] for key in ('format', 'version', 'created_at', 'hash_algorithm',
+                                           'leaf_count', 'merkle_root', 'piece_size') if key in manifest}
+
+def manifest_header_payload(manifest: dict) -> bytes:
+    """Каноническое представление заголовка для подписи"""
+    return json.dumps(manifest_header(manifest), sort_keys=True, separators=(',', ':'),
+                      ensure_ascii=False).encode('utf-8')
+
+def is_merkle_manifest(manifest: dict) -> bool:
+    return manifest.get('format') == MERKLE_MANIFEST_FORMAT
+
+def build_inclusion_proof(manifest: dict, relative_path: str,
+                          tree: Optional[MerkleTree] = None) -> Optional[dict]:
+    """Самодостаточное доказательство для одного файла (P2P, частичные обновления)
+
+    Содержит подписанный заголовок, запись файла и путь до корня:
+    получатель проверяет файл одной проверкой подписи без полного манифеста.
+    """
+    entry = manifest['files'].get(relative_path)
+    if entry is None:
+        return None
+    tree = tree or manifest_tree(manifest['files'])
+    bundle = {
+        'header': manifest_header(manifest),
+        'signature': manifest.get('signature'),
+        'path': relative_path,
+        'size': entry['size'],
+        'hash': entry['hash'],
+        'leaf': entry['leaf'],
+        'proof': tree.proof(entry['leaf'])
+    }
+    if 'pieces' in entry:
+        bundle['pieces_root'] = entry['pieces_root']
+        bundle['pieces'] = entry['pieces']
+    return bundle
+
+def check_inclusion_proof(bundle: dict) -> bool:
+    """Проверка, что запись файла входит в дерево с корнем из заголовка (без подписи)"""
+    leaf = leaf_hash(bundle['path'], bundle['size'], bundle['hash'], bundle.get('pieces_root'))
+    if root_from_proof(leaf, bundle['proof']).hex() != bundle['header']['merkle_root']:
+        return False
+    piece_size = bundle['header'].get('piece_size')
+    return not piece_size or check_file_pieces(bundle, piece_size)
@@ -8,12 +8,31 @@ import json
 import logging
 import os
 import time
-from typing import Dict, List, Set, Optional
+import socket
+import tempfile
+from typing import Dict, List, Set, Optional, Tuple
 import aiohttp
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+from merkle_manifest import DEFAULT_PIECE_SIZE
+from p2p_swarm import SwarmDownload, SwarmSource, SwarmStats, SWARM_MAX_REQUESTS, EWMA_ALPHA, ewma, file_sha256
+from lan_discovery import LanDiscovery
 
 logger = logging.getLogger(__name__)
 
+# Блок, которым FileResponse отдаёт файл, если sendfile недоступен
+FILE_RESPONSE_CHUNK = 256 * 1024
+# Адрес /download/<хеш> адресует содержимое: ответ никогда не меняется
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Пул соединений к пирам: всего, на один пир и время жизни простаивающего соединения
+PEER_CONNECTION_LIMIT = 64
+PEER_CONNECTIONS_PER_HOST = 4
+PEER_KEEPALIVE_TIMEOUT = 60.0
+# Кэш пиров между запусками: лучшие по оценке, не старше недели
+PEER_CACHE_PATH = "launcher_data/p2p_peers.json"
+PEER_CACHE_SIZE = 50
+PEER_CACHE_MAX_AGE = 7 * 24 * 3600
+
 @dataclass
 class Peer:
     """Информация о пире"""
@@ -24,42 +43,92 @@ class Peer:
     last_seen: float
     upload_speed: float = 0.0
     download_speed: float = 0.0
+    lan: bool = False  # Найден анонсом в локальной сети
+    manifests: Set[str] = field(default_factory=set)  # Корни манифестов, все файлы которых есть у пира
+    # Измерения загрузок от пира (EWMA): upload_speed - скорость отдачи нам, байт/с
+    latency: float = 0.0  # Время до заголовков ответа, с
+    reliability: float = 1.0  # Доля успешных запросов
+    samples: int = 0  # Успешных запросов; 0 - скорость известна только от трекера
+    last_success: float = 0.0
+
+    @property
+    def score(self) -> float:
+        """Оценка пира для выбора источников: скорость с поправкой на отказы"""
+        return self.upload_speed * self.reliability
 
 class P2PDistributor:
     """P2P распределитель обновлений"""
     
-    def __init__(self, port: int = 8080):
+    def __init__(self, port: int = 8080, peer_id: Optional[str] = None, cache_path: Optional[str] = None):
         self.port = port
+        self.peer_id = peer_id
+        self.cache_path = cache_path  # Файл кэша пиров (None - без сохранения)
+        self._peer_cache: Dict[str, dict] = {}  # id -> запись кэша (в том числе ушедших пиров)
+        self._session: Optional[aiohttp.ClientSession] = None
         self.peers: Dict[str, Peer] = {}
         self.local_files: Set[str] = set()
+        self.file_index: Dict[str, str] = {}  # SHA-256 -> путь раздаваемого файла
+        self._indexed: Dict[str, tuple] = {}  # путь -> (SHA-256, размер, mtime_ns)
+        self._index_task: Optional[asyncio.Future] = None
+        self.partial_downloads: Dict[str, SwarmDownload] = {}  # SHA-256 -> идущая загрузка
+        self.last_swarm_stats: Optional[SwarmStats] = None
+        self.local_manifests: Set[str] = set()  # Корни манифестов, все файлы которых раздаются
+        self.known_manifests: Dict[str, Set[str]] = {}  # Корень манифеста -> хеши его файлов
+        self._runner = None
         self.tracker_url = "https://tracker.example.com/announce"
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Общая сессия с пулом keep-alive соединений к пирам и трекеру"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=PEER_CONNECTION_LIMIT,
+                                             limit_per_host=PEER_CONNECTIONS_PER_HOST,
+                                             keepalive_timeout=PEER_KEEPALIVE_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """Закрытие пула соединений и сохранение кэша пиров"""
+        self.save_peer_cache()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
         
     async def announce_to_tracker(self):
         """Анонсирование в трекере"""
         try:
+            await self.build_file_index()
             data = {
                 'peer_id': self.get_peer_id(),
                 'port': self.port,
-                'files': list(self.local_files)
+                'files': self.shared_hashes()
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.tracker_url, json=data) as response:
-                    if response.status == 200:
-                        tracker_data = await response.json()
-                        await self.update_peer_list(tracker_data.get('peers', []))
+            async with self.get_session().post(self.tracker_url, json=data,
+                                               timeout=aiohttp.ClientTimeout(total=30)) as response:
+                if response.status == 200:
+                    tracker_data = await response.json()
+                    await self.update_peer_list(tracker_data.get('peers', []))
         except Exception as e:
             logger.error(f"Ошибка анонсирования в трекере: {e}")
     
-    async def download_from_peers(self, file_hash: str, file_name: str) -> bool:
-        """Загрузка файла от пиров"""
-        available_peers = [p for p in self.peers.values() if file_hash in p.available_files]
+    async def download_from_peers(self, file_hash: str, file_name: str, file_info: Optional[dict] = None,
+                                  piece_size: int = DEFAULT_PIECE_SIZE,
+                                  mirrors: Optional[List[str]] = None) -> bool:
+        """Загрузка файла от пиров
+
+        С записью файла из манифеста (``file_info``) файл загружается
+        кусками с проверкой каждого куска (download_pieces).
+        """
+        if file_info is not None:
+            return await self.download_pieces(file_info, file_name, piece_size, mirrors)
+
+        available_peers = [p for p in self.peers.values() if self.peer_has(p, file_hash)]
         
         if not available_peers:
             return False
         
-        # Сортируем по скорости загрузки
-        available_peers.sort(key=lambda p: p.upload_speed, reverse=True)
+        # Сначала пиры из локальной сети, затем по оценке (скорость и надёжность)
+        available_peers.sort(key=lambda p: (p.lan, p.score), reverse=True)
         
         for peer in available_peers[:3]:  # Пробуем до 3 лучших пиров
             try:
@@ -72,110 +141,411 @@ class P2PDistributor:
     
     def get_peer_id(self) -> str:
         """Генерация ID пира"""
+        if self.peer_id:
+            return self.peer_id
         import platform
         import getpass
         unique_string = f"{platform.node()}-{getpass.getuser()}-launcher"
         return hashlib.sha256(unique_string.encode()).hexdigest()[:16]
     
     async def update_peer_list(self, peers_data: List[dict]):
-        """Обновление списка пиров"""
+        """Обновление списка пиров
+
+        Известные пиры обновляются на месте: измерения и данные из
+        локальной сети сохраняются, скорость от трекера берётся, только
+        пока своих замеров нет.
+        """
         current_time = time.time()
         
         for peer_data in peers_data:
             try:
                 peer_id = peer_data.get('peer_id')
                 if peer_id and peer_id != self.get_peer_id():
-                    peer = Peer(
-                        id=peer_id,
-                        ip=peer_data.get('ip', ''),
-                        port=peer_data.get('port', 8080),
-                        available_files=set(peer_data.get('files', [])),
-                        last_seen=current_time,
-                        upload_speed=peer_data.get('upload_speed', 0.0),
-                        download_speed=peer_data.get('download_speed', 0.0)
-                    )
-                    self.peers[peer_id] = peer
+                    peer = self.peers.get(peer_id)
+                    if peer is None:
+                        peer = Peer(id=peer_id, ip='', port=8080, available_files=set(), last_seen=current_time)
+                        self.peers[peer_id] = peer
+                    if not peer.lan:
+                        # Адрес из локальной сети точнее адреса, который видит трекер
+                        peer.ip = peer_data.get('ip', peer.ip)
+                        peer.port = peer_data.get('port', peer.port)
+                        peer.available_files = set(peer_data.get('files', []))
+                    else:
+                        peer.available_files |= set(peer_data.get('files', []))
+                    peer.last_seen = current_time
+                    if not peer.samples:
+                        peer.upload_speed = peer_data.get('upload_speed', peer.upload_speed)
+                    peer.download_speed = peer_data.get('download_speed', peer.download_speed)
             except Exception as e:
                 logger.warning(f"Ошибка обработки данных пира: {e}")
+
+    def record_peer_sample(self, peer_id: Optional[str], speed: float, latency: float):
+        """Замер успешного запроса к пиру"""
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            return
+        # Скорость от трекера - не замер: первый собственный замер её заменяет
+        peer.upload_speed = ewma(peer.upload_speed if peer.samples else 0.0, speed)
+        peer.latency = ewma(peer.latency, latency)
+        peer.reliability += EWMA_ALPHA * (1.0 - peer.reliability)
+        peer.samples += 1
+        peer.last_success = time.time()
+
+    def record_peer_failure(self, peer_id: Optional[str], corrupt: bool = False):
+        """Неудачный запрос к пиру: ошибка или неверный статус; ``corrupt`` - данные не прошли проверку хеша"""
+        peer = self.peers.get(peer_id)
+        if peer is not None:
+            # Пир с испорченными данными уходит в конец очереди источников
+            peer.reliability = 0.0 if corrupt else peer.reliability * (1.0 - EWMA_ALPHA)
+
+    def load_peer_cache(self) -> int:
+        """Загрузка пиров, сохранённых прошлым запуском; возвращает их число
+
+        Пиры из кэша сразу доступны загрузкам, не дожидаясь ответа
+        трекера; недоступные уйдут при очистке неактивных.
+        """
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return 0
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f).get('peers', [])
+        except Exception as e:
+            logger.error(f"Ошибка загрузки кэша пиров: {e}")
+            return 0
+
+        current_time = time.time()
+        loaded = 0
+        for entry in entries:
+            try:
+                peer_id = entry['id']
+                if current_time - entry.get('last_success', 0) > PEER_CACHE_MAX_AGE:
+                    continue
+                self._peer_cache[peer_id] = entry
+                if peer_id in self.peers or peer_id == self.get_peer_id():
+                    continue
+                self.peers[peer_id] = Peer(
+                    id=peer_id,
+                    ip=entry['ip'],
+                    port=entry['port'],
+                    available_files=set(entry.get('files', [])),
+                    last_seen=current_time,
+                    upload_speed=entry.get('upload_speed', 0.0),
+                    manifests=set(entry.get('manifests', [])),
+                    latency=entry.get('latency', 0.0),
+                    reliability=entry.get('reliability', 1.0),
+                    samples=entry.get('samples', 0),
+                    last_success=entry.get('last_success', 0.0)
+                )
+                loaded += 1
+            except Exception as e:
+                logger.warning(f"Ошибка записи кэша пиров: {e}")
+        if loaded:
+            logger.info(f"Из кэша загружено пиров: {loaded}")
+        return loaded
+
+    def save_peer_cache(self) -> bool:
+        """Сохранение измеренных пиров (лучшие PEER_CACHE_SIZE по оценке)"""
+        if not self.cache_path:
+            return False
+        try:
+            for peer in self.peers.values():
+                if peer.samples and not peer.lan:
+                    # Адреса из локальной сети меняются: в кэш попадают пиры трекера
+                    self._peer_cache[peer.id] = {
+                        'id': peer.id,
+                        'ip': peer.ip,
+                        'port': peer.port,
+                        'files': sorted(peer.available_files),
+                        'manifests': sorted(peer.manifests),
+                        'upload_speed': peer.upload_speed,
+                        'latency': peer.latency,
+                        'reliability': peer.reliability,
+                        'samples': peer.samples,
+                        'last_success': peer.last_success
+                    }
+            current_time = time.time()
+            entries = [entry for entry in self._peer_cache.values()
+                       if current_time - entry['last_success'] <= PEER_CACHE_MAX_AGE]
+            entries.sort(key=lambda entry: entry['upload_speed'] * entry['reliability'], reverse=True)
+            self._peer_cache = {entry['id']: entry for entry in entries[:PEER_CACHE_SIZE]}
+
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            temp_path = f"{self.cache_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'peers': list(self._peer_cache.values())}, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.cache_path)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения кэша пиров: {e}")
+            return False
+
+    def shared_hashes(self) -> List[str]:
+        """Хеши раздаваемых файлов: сначала загружаемые сейчас (их ищут соседи), затем готовые"""
+        return list(self.partial_downloads) + [h for h in self.file_index if h not in self.partial_downloads]
+
+    def register_manifest(self, manifest: dict, complete: bool = False):
+        """Манифест релиза: анонс по корню вместо списка файлов
+
+        Пир, анонсировавший корень известного манифеста, считается
+        владельцем всех его файлов. ``complete`` - все файлы манифеста
+        есть локально, корень анонсируется в локальной сети.
+        """
+        root = manifest.get('merkle_root')
+        if not root:
+            return
+        self.known_manifests[root] = {info['hash'] for info in manifest.get('files', {}).values()}
+        if complete:
+            self.local_manifests.add(root)
+
+    def peer_has(self, peer: Peer, file_hash: str) -> bool:
+        if file_hash in peer.available_files:
+            return True
+        return any(file_hash in self.known_manifests.get(root, ()) for root in peer.manifests)
+
+    def add_lan_peer(self, peer_id: str, ip: str, port: int, manifests: List[str], files: List[str]) -> bool:
+        """Пир из анонса в локальной сети; True - пир новый"""
+        peer = self.peers.get(peer_id)
+        is_new = peer is None or not peer.lan
+        if peer is None:
+            peer = Peer(id=peer_id, ip=ip, port=port, available_files=set(), last_seen=time.time())
+            self.peers[peer_id] = peer
+            logger.info(f"Найден пир в локальной сети: {peer_id} ({ip}:{port})")
+        peer.ip, peer.port, peer.lan = ip, port, True
+        peer.available_files = set(files)
+        peer.manifests = set(manifests)
+        peer.last_seen = time.time()
+        return is_new
+
+    def expire_lan_peers(self, ttl: float):
+        """Удаление LAN-пиров, переставших анонсироваться"""
+        current_time = time.time()
+        for peer_id in [peer_id for peer_id, peer in self.peers.items()
+                        if peer.lan and current_time - peer.last_seen > ttl]:
+            del self.peers[peer_id]
+            logger.info(f"Пир из локальной сети ушёл: {peer_id}")
     
     async def _download_chunk_from_peer(self, peer: Peer, file_hash: str, file_name: str) -> bool:
-        """Загрузка файла от конкретного пира"""
+        """Загрузка файла от конкретного пира
+
+        Файл пишется на диск во время загрузки с подсчётом хеша и
+        переименовывается только после совпадения хеша.
+        """
+        part_path = f"{file_name}.part"
         try:
             url = f"http://{peer.ip}:{peer.port}/download/{file_hash}"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                    if response.status == 200:
-                        content = await response.read()
-                        
-                        # Проверяем хеш загруженного файла
-                        actual_hash = hashlib.sha256(content).hexdigest()
-                        if actual_hash == file_hash:
-                            # Сохраняем файл
-                            with open(file_name, 'wb') as f:
-                                f.write(content)
-                            
-                            logger.info(f"Файл {file_name} успешно загружен от пира {peer.id}")
-                            return True
-                        else:
-                            logger.error(f"Несоответствие хеша файла от пира {peer.id}")
-                            return False
+            started = time.perf_counter()
+            async with self.get_session().get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                latency = time.perf_counter() - started
+                if response.status == 200:
+                    hasher = hashlib.sha256()
+                    size = 0
+                    with open(part_path, 'wb') as f:
+                        async for chunk in response.content.iter_chunked(64 * 1024):
+                            hasher.update(chunk)
+                            f.write(chunk)
+                            size += len(chunk)
+                    
+                    # Проверяем хеш загруженного файла
+                    if hasher.hexdigest() == file_hash:
+                        os.replace(part_path, file_name)
+                        self.record_peer_sample(peer.id, size / max(time.perf_counter() - started, 1e-6), latency)
+                        logger.info(f"Файл {file_name} успешно загружен от пира {peer.id}")
+                        return True
                     else:
-                        logger.warning(f"Пир {peer.id} вернул статус {response.status}")
+                        os.remove(part_path)
+                        self.record_peer_failure(peer.id, corrupt=True)
+                        logger.error(f"Несоответствие хеша файла от пира {peer.id}")
                         return False
+                else:
+                    self.record_peer_failure(peer.id)
+                    logger.warning(f"Пир {peer.id} вернул статус {response.status}")
+                    return False
                         
         except Exception as e:
+            self.record_peer_failure(peer.id)
             logger.error(f"Ошибка загрузки от пира {peer.id}: {e}")
             return False
-    
-    async def start_server(self):
-        """Запуск P2P сервера для раздачи файлов"""
+
+    def _piece_sources(self, file_hash: str, mirrors: Optional[List[str]]) -> List[SwarmSource]:
+        """Пиры с файлом (из локальной сети и с лучшей оценкой первыми) и зеркала"""
+        peers = sorted((p for p in self.peers.values() if self.peer_has(p, file_hash)),
+                       key=lambda p: (p.lan, p.score), reverse=True)
+        sources = [SwarmSource(f"http://{p.ip}:{p.port}/download/{file_hash}", f"пир {p.id}",
+                               pieces_url=f"http://{p.ip}:{p.port}/pieces/{file_hash}",
+                               lan=p.lan, peer_id=p.id, score=p.score) for p in peers]
+        sources.extend(SwarmSource(url, f"зеркало {url}") for url in mirrors or [])
+        return sources
+
+    async def download_pieces(self, file_info: dict, file_name: str, piece_size: int = DEFAULT_PIECE_SIZE,
+                              mirrors: Optional[List[str]] = None, parallel: int = SWARM_MAX_REQUESTS) -> bool:
+        """Роевая загрузка файла кусками от пиров и зеркал (p2p_swarm.SwarmDownload)
+
+        ``file_info`` - запись файла манифеста на дереве Меркла или
+        доказательство включения (size, hash и pieces, см. merkle_manifest);
+        ``piece_size`` - размер куска из заголовка манифеста. Каждый кусок
+        сверяется с хешем сразу после получения: испорченный пир стоит
+        одного куска, а не всего файла. Пока файл загружается, его
+        проверенные куски раздаются другим пирам. Замеры каждого запроса
+        копятся в оценке пира - порядок источников в следующих загрузках.
+        """
+        swarm = SwarmDownload(file_info, file_name, piece_size, self._piece_sources(file_info['hash'], mirrors),
+                              max_requests=parallel,
+                              source_provider=lambda: self._piece_sources(file_info['hash'], mirrors),
+                              session=self.get_session(),
+                              on_sample=lambda source, size, seconds, latency: self.record_peer_sample(
+                                  source.peer_id, size / max(seconds, 1e-6), latency),
+                              on_failure=lambda source, corrupt: self.record_peer_failure(source.peer_id, corrupt))
+        self.partial_downloads[swarm.file_hash] = swarm
+        try:
+            return await swarm.run()
+        finally:
+            self.partial_downloads.pop(swarm.file_hash, None)
+            self.last_swarm_stats = swarm.stats
+            self.save_peer_cache()
+
+    @staticmethod
+    def _file_signature(file_path: str) -> Tuple[int, int]:
+        stat = os.stat(file_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _drop_from_index(self, file_path: str):
+        entry = self._indexed.pop(file_path, None)
+        if entry and self.file_index.get(entry[0]) == file_path:
+            del self.file_index[entry[0]]
+
+    def _index_file(self, file_path: str, file_hash: Optional[str] = None) -> Optional[str]:
+        """Запись файла в индекс хеш -> путь; файл перечитывается, только если изменился"""
+        try:
+            signature = self._file_signature(file_path)
+            entry = self._indexed.get(file_path)
+            if entry and entry[1:] == signature:
+                return entry[0]
+            file_hash = file_hash or file_sha256(file_path)
+        except OSError as e:
+            logger.warning(f"Файл недоступен для раздачи {file_path}: {e}")
+            self._drop_from_index(file_path)
+            return None
+        self._drop_from_index(file_path)
+        self._indexed[file_path] = (file_hash, *signature)
+        self.file_index[file_hash] = file_path
+        return file_hash
+
+    def _index_pending(self):
+        for file_path in list(self.local_files):
+            if file_path not in self._indexed:
+                self._index_file(file_path)
+
+    async def build_file_index(self):
+        """Хеширование файлов, добавленных без хеша (в пуле потоков, один проход на всех)"""
+        if all(file_path in self._indexed for file_path in self.local_files):
+            return
+        if self._index_task is None or self._index_task.done():
+            self._index_task = asyncio.get_running_loop().run_in_executor(None, self._index_pending)
+        await asyncio.shield(self._index_task)
+
+    async def _resolve_file(self, file_hash: str) -> Optional[str]:
+        """Путь файла по хешу через индекс; изменённый после индексации файл перехешируется"""
+        file_path = self.file_index.get(file_hash)
+        if file_path is None:
+            await self.build_file_index()
+            file_path = self.file_index.get(file_hash)
+            if file_path is None:
+                return None
+        try:
+            signature = self._file_signature(file_path)
+        except OSError:
+            self._drop_from_index(file_path)
+            return None
+        if self._indexed[file_path][1:] != signature:
+            loop = asyncio.get_running_loop()
+            if await loop.run_in_executor(None, self._index_file, file_path) != file_hash:
+                return None
+        return file_path
+
+    async def start_server(self, host: str = '0.0.0.0', middlewares=()) -> bool:
+        """Запуск P2P сервера для раздачи файлов
+
+        Файл ищется по индексу хеш -> путь и отдаётся через
+        web.FileResponse: sendfile или чтение блоками без загрузки в
+        память, Range для загрузки кусками, условные запросы по
+        ETag/Last-Modified. Адрес содержит хеш содержимого, поэтому ответ
+        помечается как неизменяемый и кэшируется прокси без ревалидации.
+
+        Файл, который ещё загружается роем, отдаётся по Range только в
+        пределах проверенных кусков; ``/pieces/<хеш>`` сообщает, какие
+        куски есть у пира.
+        """
         from aiohttp import web
         
         async def handle_download(request):
             file_hash = request.match_info['file_hash']
-            
-            # Поиск файла по хешу
-            for file_path in self.local_files:
-                if os.path.exists(file_path):
-                    with open(file_path, 'rb') as f:
-                        content = f.read()
-                    
-                    actual_hash = hashlib.sha256(content).hexdigest()
-                    if actual_hash == file_hash:
-                        return web.Response(
-                            body=content,
-                            content_type='application/octet-stream',
-                            headers={'Content-Length': str(len(content))}
-                        )
-            
-            return web.Response(status=404, text="File not found")
+            file_path = await self._resolve_file(file_hash)
+            if file_path is None:
+                swarm = self.partial_downloads.get(file_hash)
+                if swarm is None:
+                    return web.Response(status=404, text="File not found")
+                rng = request.http_range
+                if rng.start is None or rng.start < 0:
+                    return web.Response(status=416, text="Only piece ranges are available")
+                stop = swarm.size if rng.stop is None else min(rng.stop, swarm.size)
+                if not swarm.covers(rng.start, stop):
+                    return web.Response(status=416, text="Range is not downloaded yet")
+                file_path = swarm.part_path
+            return web.FileResponse(file_path, chunk_size=FILE_RESPONSE_CHUNK, headers={
+                'Content-Type': 'application/octet-stream',
+                'Cache-Control': IMMUTABLE_CACHE_CONTROL
+            })
+
+        async def handle_pieces(request):
+            file_hash = request.match_info['file_hash']
+            if await self._resolve_file(file_hash) is not None:
+                return web.json_response({'complete': True})
+            swarm = self.partial_downloads.get(file_hash)
+            if swarm is None:
+                return web.Response(status=404, text="File not found")
+            return web.json_response({'complete': False, 'have': sorted(swarm.have)})
         
-        app = web.Application()
+        app = web.Application(middlewares=list(middlewares))
         app.router.add_get('/download/{file_hash}', handle_download)
+        app.router.add_get('/pieces/{file_hash}', handle_pieces)
         
         try:
+            await self.build_file_index()
             runner = web.AppRunner(app)
             await runner.setup()
-            site = web.TCPSite(runner, '0.0.0.0', self.port)
+            site = web.TCPSite(runner, host, self.port)
             await site.start()
+            self._runner = runner
             logger.info(f"P2P сервер запущен на порту {self.port}")
+            return True
         except Exception as e:
             logger.error(f"Ошибка запуска P2P сервера: {e}")
+            return False
+
+    async def stop_server(self):
+        """Остановка P2P сервера"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
     
-    def add_local_file(self, file_path: str):
-        """Добавление локального файла для раздачи"""
+    def add_local_file(self, file_path: str, file_hash: Optional[str] = None):
+        """Добавление локального файла для раздачи
+
+        Известный хеш (например, после проверенной загрузки) сразу попадает
+        в индекс; без него файл хешируется один раз при построении индекса.
+        """
         if os.path.exists(file_path):
             self.local_files.add(file_path)
+            if file_hash:
+                self._index_file(file_path, file_hash)
             logger.info(f"Файл добавлен для раздачи: {file_path}")
     
     def get_file_hash(self, file_path: str) -> Optional[str]:
         """Получение хеша файла"""
         try:
             if os.path.exists(file_path):
-                with open(file_path, 'rb') as f:
-                    content = f.read()
-                return hashlib.sha256(content).hexdigest()
+                return file_sha256(file_path)
         except Exception as e:
             logger.error(f"Ошибка получения хеша файла {file_path}: {e}")
         return None
@@ -200,6 +570,7 @@ class P2PDistributor:
             'local_files': len(self.local_files),
             'available_files_from_peers': sum(len(peer.available_files) for peer in self.peers.values()),
             'average_upload_speed': sum(peer.upload_speed for peer in self.peers.values()) / max(len(self.peers), 1),
+            'measured_peers': sum(1 for peer in self.peers.values() if peer.samples),
             'server_port': self.port
         }
 
@@ -209,36 +580,46 @@ class P2PIntegration:
     
     def __init__(self, launcher):
         self.launcher = launcher
-        self.p2p_distributor = P2PDistributor()
+        self.p2p_distributor = P2PDistributor(cache_path=PEER_CACHE_PATH)
+        self.lan_discovery = LanDiscovery(self.p2p_distributor)
+        self.lan_discovery_enabled = True
         self.enabled = False
+        self._service_tasks: List[asyncio.Future] = []
     
-    def enable_p2p(self, port: int = 8080):
-        """Включение P2P режима"""
+    def enable_p2p(self, port: int = 8080, lan_discovery: bool = True):
+        """Включение P2P режима (``lan_discovery`` - поиск пиров в локальной сети)"""
         try:
             self.p2p_distributor.port = port
+            self.lan_discovery_enabled = lan_discovery
             self.enabled = True
             logger.info("P2P режим включен")
         except Exception as e:
             logger.error(f"Ошибка включения P2P: {e}")
             self.enabled = False
     
-    async def download_with_p2p(self, file_url: str, local_path: str) -> bool:
-        """Загрузка файла с использованием P2P"""
+    async def download_with_p2p(self, file_url: str, local_path: str, file_info: Optional[dict] = None,
+                                piece_size: int = DEFAULT_PIECE_SIZE) -> bool:
+        """Загрузка файла с использованием P2P
+
+        С записью файла из манифеста (``file_info``) файл загружается
+        проверяемыми кусками от пиров, а ``file_url`` служит зеркалом.
+        """
         if not self.enabled:
             return False
         
         try:
-            # Получаем хеш файла из URL или манифеста
-            file_hash = self._extract_hash_from_url(file_url)
+            # Получаем хеш файла из манифеста или URL
+            file_hash = file_info['hash'] if file_info else self._extract_hash_from_url(file_url)
             if not file_hash:
                 return False
             
             # Пытаемся загрузить от пиров
-            success = await self.p2p_distributor.download_from_peers(file_hash, local_path)
+            success = await self.p2p_distributor.download_from_peers(
+                file_hash, local_path, file_info, piece_size, mirrors=[file_url] if file_info else None)
             
             if success:
-                # Добавляем файл для раздачи другим
-                self.p2p_distributor.add_local_file(local_path)
+                # Добавляем файл для раздачи другим (хеш проверен при загрузке)
+                self.p2p_distributor.add_local_file(local_path, file_hash)
                 return True
             
         except Exception as e:
@@ -257,13 +638,29 @@ class P2PIntegration:
         return hashlib.sha256(filename.encode()).hexdigest()
     
     async def start_p2p_services(self):
-        """Запуск P2P сервисов"""
+        """Запуск P2P сервисов (работают до stop_p2p_services)"""
         if self.enabled:
+            # Известные по прошлому запуску пиры доступны до ответа трекера
+            self.p2p_distributor.load_peer_cache()
+            if self.lan_discovery_enabled:
+                await self.lan_discovery.start()
+            self._service_tasks = [asyncio.ensure_future(self._periodic_announce()),
+                                   asyncio.ensure_future(self._periodic_cleanup())]
             await asyncio.gather(
                 self.p2p_distributor.start_server(),
-                self._periodic_announce(),
-                self._periodic_cleanup()
+                *self._service_tasks,
+                return_exceptions=True
             )
+
+    async def stop_p2p_services(self):
+        """Остановка P2P сервисов: анонсы, поиск в LAN, сервер и пул соединений (с сохранением кэша пиров)"""
+        for task in self._service_tasks:
+            task.cancel()
+        await asyncio.gather(*self._service_tasks, return_exceptions=True)
+        self._service_tasks = []
+        await self.lan_discovery.stop()
+        await self.p2p_distributor.stop_server()
+        await self.p2p_distributor.close()
     
     async def _periodic_announce(self):
         """Периодическое анонсирование в трекере"""
@@ -279,8 +676,84 @@ class P2PIntegration:
         """Периодическая очистка неактивных пиров"""
         while self.enabled:
             try:
+                self.p2p_distributor.save_peer_cache()
                 self.p2p_distributor.cleanup_inactive_peers()
                 await asyncio.sleep(600)  # Каждые 10 минут
             except Exception as e:
                 logger.error(f"Ошибка очистки пиров: {e}")
-                await asyncio.sleep(120)
\ No newline at end of file
+                await asyncio.sleep(120)
+
+async def benchmark_file_server(files: int = 20, file_size: int = 4 * 1024 * 1024, requests: int = 1000,
+                                concurrency: int = 300, range_share: float = 0.5,
+                                range_size: int = DEFAULT_PIECE_SIZE) -> dict:
+    """Нагрузочный тест раздачи: сотни одновременных запросов к локальному серверу
+
+    Во временном каталоге создаются ``files`` файлов, сервер слушает
+    127.0.0.1 на свободном порту. Доля ``range_share`` запросов просит
+    кусок по Range (как загрузка кусками), остальные - файл целиком.
+    Возвращает пропускную способность и задержки (секунды).
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        distributor = P2PDistributor()
+        for index in range(files):
+            file_path = os.path.join(temp_dir, f"file_{index}.bin")
+            with open(file_path, 'wb') as f:
+                f.write(os.urandom(file_size))
+            distributor.add_local_file(file_path)
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            distributor.port = probe.getsockname()[1]
+
+        started = time.perf_counter()
+        await distributor.build_file_index()
+        index_seconds = time.perf_counter() - started
+        if not await distributor.start_server('127.0.0.1'):
+            return {}
+
+        hashes = list(distributor.file_index)
+        latencies = []
+        errors = 0
+        received = 0
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(session, number):
+            nonlocal errors, received
+            headers = {}
+            if number % 100 < range_share * 100:
+                offset = (number * range_size) % max(1, file_size - range_size)
+                headers['Range'] = f"bytes={offset}-{offset + range_size - 1}"
+            url = f"http://127.0.0.1:{distributor.port}/download/{hashes[number % len(hashes)]}"
+            async with semaphore:
+                request_started = time.perf_counter()
+                try:
+                    async with session.get(url, headers=headers) as response:
+                        body = await response.read()
+                        if response.status not in (200, 206):
+                            errors += 1
+                        received += len(body)
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - request_started)
+
+        try:
+            connector = aiohttp.TCPConnector(limit=concurrency)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                started = time.perf_counter()
+                await asyncio.gather(*(fetch(session, number) for number in range(requests)))
+                seconds = time.perf_counter() - started
+        finally:
+            await distributor.stop_server()
+
+        latencies.sort()
+        return {
+            'requests': requests,
+            'concurrency': concurrency,
+            'errors': errors,
+            'index_seconds': round(index_seconds, 3),
+            'seconds': round(seconds, 3),
+            'requests_per_second': round(requests / seconds, 1),
+            'mb_per_second': round(received / seconds / (1024 * 1024), 1),
+            'latency_p50': round(latencies[len(latencies) // 2], 4),
+            'latency_p95': round(latencies[int(len(latencies) * 0.95)], 4),
+            'latency_max': round(latencies[-1], 4)
+        }
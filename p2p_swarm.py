@@ -0,0 +1,631 @@
+"""
+Роевая загрузка файла кусками от многих пиров и зеркал одновременно
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import hashlib
+import logging
+import argparse
+import tempfile
+import subprocess
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+from merkle_manifest import (DEFAULT_PIECE_SIZE, check_file_pieces, file_pieces, hash_pieces,
+                             piece_range, pieces_root)
+
+logger = logging.getLogger(__name__)
+
+# Одновременные запросы кусков: всего и к одному источнику
+SWARM_MAX_REQUESTS = 16
+REQUESTS_PER_SOURCE = 2
+# Попытки на кусок и ошибки связи, после которых источник исключается
+MAX_PIECE_ATTEMPTS = 5
+MAX_SOURCE_FAILURES = 3
+# Пересмотр удушения: источник медленнее доли от лучшего перестаёт получать запросы,
+# каждый OPTIMISTIC_UNCHOKE_EVERY-й пересмотр один задушенный получает новый шанс
+CHOKE_INTERVAL = 2.0
+CHOKE_RATIO = 0.25
+MIN_UNCHOKED = 2
+OPTIMISTIC_UNCHOKE_EVERY = 3
+# Обновление карт кусков у пиров, которые сами ещё загружают файл
+BITFIELD_REFRESH_INTERVAL = 5.0
+# Сколько ждать появления кусков, которых нет ни у одного источника
+STALL_TIMEOUT = 30.0
+# Таймауты запроса куска: соединение и пауза в потоке данных
+PIECE_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+# Вес нового замера в скользящем среднем скорости и задержки
+EWMA_ALPHA = 0.3
+
+def ewma(previous: float, sample: float, alpha: float = EWMA_ALPHA) -> float:
+    """Экспоненциальное скользящее среднее; первый замер берётся как есть"""
+    return sample if not previous else previous + alpha * (sample - previous)
+
+def file_sha256(file_path: str) -> str:
+    """SHA-256 файла блоками по 1 МБ"""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def verified_pieces(part_path: str, pieces: List[str], size: int, piece_size: int) -> Set[int]:
+    """Куски недокачанного файла, уже совпадающие со своими хешами"""
+    verified = set()
+    if not os.path.exists(part_path) or os.path.getsize(part_path) != size:
+        return verified
+    with open(part_path, 'rb') as f:
+        for index, piece_hash in enumerate(pieces):
+            offset, length = piece_range(index, size, piece_size)
+            f.seek(offset)
+            if hashlib.sha256(f.read(length)).hexdigest() == piece_hash:
+                verified.add(index)
+    return verified
+
+@dataclass(eq=False)
+class SwarmSource:
+    """Источник кусков: пир или зеркало (CDN) с поддержкой Range"""
+    url: str
+    name: str
+    pieces_url: Optional[str] = None  # Карта кусков пира; у зеркала её нет
+    have: Optional[Set[int]] = None  # None - у источника весь файл
+    partial: bool = False  # Пир сам загружает файл - карта кусков обновляется
+    bitfield_known: bool = False
+    lan: bool = False  # Пир из локальной сети
+    peer_id: Optional[str] = None
+    score: float = 0.0  # Скорость из прошлых загрузок, байт/с - порядок до первых замеров
+    active: int = 0
+    failures: int = 0
+    banned: bool = False
+    choked: bool = False
+    pieces: int = 0
+    bytes: int = 0
+    speed: float = 0.0  # EWMA скорости по запросам, байт/с
+    latency: float = 0.0  # EWMA времени до заголовков ответа, с
+
+    @property
+    def throughput(self) -> float:
+        """Измеренная скорость, байт/с (0 - ещё не измерена)"""
+        return self.speed
+
+    def record(self, size: int, seconds: float, latency: float):
+        """Замер успешного запроса куска"""
+        self.pieces += 1
+        self.bytes += size
+        self.speed = ewma(self.speed, size / max(seconds, 1e-6))
+        self.latency = ewma(self.latency, latency)
+
+    def has(self, index: int) -> bool:
+        return self.have is None or index in self.have
+
+    def reset_measurement(self):
+        self.pieces = 0
+        self.speed = 0.0
+        self.latency = 0.0
+
+@dataclass
+class SwarmStats:
+    """Статистика роевой загрузки"""
+    pieces: int = 0
+    reused_pieces: int = 0
+    downloaded_bytes: int = 0
+    duplicate_requests: int = 0
+    wasted_bytes: int = 0  # Ответы на дублирующие запросы эндшпиля, пришедшие вторыми
+    bad_pieces: int = 0
+    chokes: int = 0
+    seconds: float = 0.0
+    sources: Dict[str, int] = field(default_factory=dict)  # Источник -> загружено кусков
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def summary(self) -> str:
+        by_source = ", ".join(f"{name}: {count}" for name, count in self.sources.items() if count)
+        return (f"кусков: {self.pieces} (уже были: {self.reused_pieces}), {self.downloaded_bytes} байт "
+                f"за {self.seconds:.1f} с; дублей эндшпиля: {self.duplicate_requests}, "
+                f"отбраковано: {self.bad_pieces}, удушено: {self.chokes}; {by_source or 'без загрузки'}")
+
+class SwarmDownload:
+    """Загрузка разных кусков файла от многих источников одновременно
+
+    Куски выбираются по принципу «редкие первыми»: чем у меньшего числа
+    пиров есть кусок, тем раньше он запрашивается, чтобы он не исчез из
+    роя вместе с единственным владельцем. Свободные слоты получают сначала
+    ещё не измеренные, затем самые быстрые источники, пиры из локальной
+    сети раньше остальных. Пока есть работающие LAN-пиры, зеркалу
+    достаются только куски, которых у них нет. Источник, который
+    медленнее ``choke_ratio`` от лучшего, душится (новых запросов не
+    получает), периодически один задушенный источник пробуется снова.
+    Когда все оставшиеся куски уже запрошены (эндшпиль), они дублируются
+    у свободных источников, и первый проверенный ответ отменяет остальные.
+
+    Каждый кусок сверяется с хешем из манифеста, источник с неверными
+    данными исключается. Проверенные куски (``have``) сразу доступны
+    другим пирам через P2P сервер.
+
+    ``session`` - общая сессия с пулом соединений (не закрывается
+    загрузкой). ``on_sample(source, байты, секунды, задержка)`` и
+    ``on_failure(source, испорчены ли данные)`` получают замеры каждого запроса - так
+    распределитель копит статистику пиров между загрузками.
+    """
+
+    def __init__(self, file_info: dict, file_name: str, piece_size: int, sources: List[SwarmSource],
+                 max_requests: int = SWARM_MAX_REQUESTS, requests_per_source: int = REQUESTS_PER_SOURCE,
+                 choke_interval: float = CHOKE_INTERVAL, choke_ratio: float = CHOKE_RATIO,
+                 min_unchoked: int = MIN_UNCHOKED, refresh_interval: float = BITFIELD_REFRESH_INTERVAL,
+                 stall_timeout: float = STALL_TIMEOUT, source_provider=None,
+                 session: Optional[aiohttp.ClientSession] = None, on_sample=None, on_failure=None):
+        self.file_info = file_info
+        self.file_hash = file_info['hash']
+        self.size = file_info['size']
+        self.file_name = file_name
+        self.part_path = f"{file_name}.part"
+        self.piece_size = piece_size
+        self.pieces = file_pieces(file_info)
+        self.sources = sources
+        self.max_requests = max_requests
+        self.requests_per_source = requests_per_source
+        self.choke_interval = choke_interval
+        self.choke_ratio = choke_ratio
+        self.min_unchoked = min_unchoked
+        self.refresh_interval = refresh_interval
+        self.stall_timeout = stall_timeout
+        # Текущий список источников (например, пиры, найденные в LAN во время загрузки)
+        self.source_provider = source_provider
+        self.session = session
+        self.on_sample = on_sample
+        self.on_failure = on_failure
+        self.have: Set[int] = set()
+        self.missing: Set[int] = set()
+        self.stats = SwarmStats()
+        self._tiebreak = {index: random.random() for index in range(len(self.pieces))}
+        self._attempts: Dict[int, int] = {}
+        self._pending: Dict[asyncio.Task, Tuple[int, SwarmSource, float]] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._part_file = None
+        self._reviews = 0
+
+    def covers(self, start: int, stop: int) -> bool:
+        """Байты [start, stop) лежат в уже проверенных кусках"""
+        if stop <= start:
+            return False
+        first, last = start // self.piece_size, (stop - 1) // self.piece_size
+        return all(index in self.have for index in range(first, last + 1))
+
+    def _usable(self) -> List[SwarmSource]:
+        usable = [source for source in self.sources if not source.banned]
+        if usable and all(source.choked for source in usable):
+            for source in usable:
+                source.choked = False
+        return usable
+
+    async def _fetch_piece(self, source: SwarmSource, offset: int,
+                           length: int) -> Tuple[Optional[bytes], float]:
+        """Запрос одного куска по Range: (данные или None, если источник ответил не тем; задержка)"""
+        headers = {'Range': f"bytes={offset}-{offset + length - 1}"} if length else {}
+        started = time.perf_counter()
+        async with self._session.get(source.url, headers=headers, timeout=PIECE_REQUEST_TIMEOUT) as response:
+            latency = time.perf_counter() - started
+            # 200 допустим, только если весь файл - этот кусок
+            if response.status != 206 and not (response.status == 200 and offset == 0):
+                logger.warning(f"{source.name} вернул статус {response.status}")
+                return None, latency
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                data += chunk
+                if len(data) > length:
+                    return None, latency
+            return (bytes(data) if len(data) == length else None), latency
+
+    async def _fetch_bitfield(self, source: SwarmSource):
+        """Карта кусков пира
+
+        Пир без карты (сервер старой версии) считается владельцем всего
+        файла: если это не так, его запросы завершатся ошибками.
+        """
+        try:
+            async with self._session.get(source.pieces_url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                if response.status != 200:
+                    raise ValueError(f"статус {response.status}")
+                data = await response.json()
+            source.partial = not data.get('complete')
+            source.have = None if data.get('complete') else set(data.get('have', []))
+        except Exception as e:
+            logger.debug(f"Карта кусков {source.name} недоступна: {e}")
+            if not source.bitfield_known:
+                source.have = None
+        source.bitfield_known = True
+
+    async def _refresh_bitfields(self, only_partial: bool = False):
+        sources = [source for source in self.sources if source.pieces_url and not source.banned
+                   and (source.partial or not only_partial)]
+        await asyncio.gather(*(self._fetch_bitfield(source) for source in sources))
+
+    async def _add_new_sources(self):
+        """Подключение источников, появившихся после начала загрузки"""
+        if self.source_provider is None:
+            return
+        known = {source.url for source in self.sources}
+        new_sources = [source for source in self.source_provider() if source.url not in known]
+        for source in new_sources:
+            if source.pieces_url:
+                source.have = set()
+            logger.info(f"Новый источник для {self.file_name}: {source.name}")
+        self.sources.extend(new_sources)
+        await asyncio.gather(*(self._fetch_bitfield(source) for source in new_sources if source.pieces_url))
+
+    async def _refresh_loop(self):
+        """Карты кусков: сначала у всех пиров, затем периодически у загружающих и новых"""
+        await self._refresh_bitfields()
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self._add_new_sources()
+            await self._refresh_bitfields(only_partial=True)
+
+    def _start_request(self, index: int, source: SwarmSource):
+        offset, length = piece_range(index, self.size, self.piece_size)
+        task = asyncio.ensure_future(self._fetch_piece(source, offset, length))
+        self._pending[task] = (index, source, time.perf_counter())
+        source.active += 1
+
+    def _schedule(self):
+        """Раздача свободных слотов: редкие куски первыми, быстрые источники первыми"""
+        in_flight: Dict[int, Set[SwarmSource]] = {}
+        for index, source, _ in self._pending.values():
+            in_flight.setdefault(index, set()).add(source)
+        usable = self._usable()
+        peers = [source for source in usable if source.pieces_url]
+        availability = {index: sum(1 for peer in peers if peer.has(index)) for index in self.missing}
+        lan_peers = [peer for peer in peers if peer.lan and not peer.choked]
+        # Ещё не измеренные источники первыми - иначе их скорость не узнать
+        ordered = sorted((source for source in usable if not source.choked),
+                         key=lambda source: (source.pieces > 0, not source.lan,
+                                             -(source.throughput or source.score)))
+
+        for source in ordered:
+            # Трафик CDN - только на то, чего нет у соседей по локальной сети
+            lan_first = source.pieces_url is None and lan_peers
+            while source.active < self.requests_per_source and len(self._pending) < self.max_requests:
+                candidates = [index for index in self.missing if index not in in_flight and source.has(index)
+                              and not (lan_first and any(peer.has(index) for peer in lan_peers))]
+                if candidates:
+                    index = min(candidates, key=lambda index: (availability[index], self._tiebreak[index]))
+                elif all(index in in_flight for index in self.missing):
+                    # Эндшпиль: дублируем запрошенные куски у других источников
+                    candidates = [index for index in self.missing
+                                  if source not in in_flight.get(index, ()) and source.has(index)]
+                    if not candidates:
+                        break
+                    index = min(candidates, key=lambda index: (len(in_flight[index]), self._tiebreak[index]))
+                    self.stats.duplicate_requests += 1
+                else:
+                    break
+                self._start_request(index, source)
+                in_flight.setdefault(index, set()).add(source)
+
+    def _review_chokes(self):
+        """Удушение медленных источников и оптимистичное раскрытие одного задушенного"""
+        self._reviews += 1
+        usable = self._usable()
+        measured = [source for source in usable if source.pieces >= 2 and not source.choked]
+        if len(measured) >= 2:
+            best = max(source.throughput for source in measured)
+            unchoked = sum(1 for source in usable if not source.choked)
+            for source in sorted(measured, key=lambda source: source.throughput):
+                if unchoked <= self.min_unchoked or source.throughput >= best * self.choke_ratio:
+                    break
+                source.choked = True
+                unchoked -= 1
+                self.stats.chokes += 1
+                logger.info(f"{source.name} задушен: {source.throughput / 1024:.0f} КБ/с "
+                            f"против {best / 1024:.0f} КБ/с у лучшего")
+        choked = [source for source in usable if source.choked]
+        if choked and self._reviews % OPTIMISTIC_UNCHOKE_EVERY == 0:
+            source = random.choice(choked)
+            source.choked = False
+            source.reset_measurement()
+
+    def _complete_request(self, task: asyncio.Task) -> bool:
+        """Обработка завершённого запроса; False - загрузку надо прервать"""
+        index, source, started = self._pending.pop(task)
+        source.active -= 1
+        if task.cancelled():
+            return True
+        elapsed = time.perf_counter() - started
+        try:
+            data, latency = task.result()
+        except Exception as e:
+            logger.warning(f"Ошибка загрузки куска {index} от {source.name}: {e}")
+            data, latency = None, 0.0
+
+        if index not in self.missing:
+            self.stats.wasted_bytes += len(data or b'')
+            return True
+        if data is not None and hashlib.sha256(data).hexdigest() == self.pieces[index]:
+            offset, _ = piece_range(index, self.size, self.piece_size)
+            self._part_file.seek(offset)
+            self._part_file.write(data)
+            self.missing.discard(index)
+            self.have.add(index)
+            source.record(len(data), elapsed, latency)
+            if self.on_sample:
+                self.on_sample(source, len(data), elapsed, latency)
+            self.stats.pieces += 1
+            self.stats.downloaded_bytes += len(data)
+            self.stats.sources[source.name] = self.stats.sources.get(source.name, 0) + 1
+            # Дубли эндшпиля больше не нужны
+            for other_task, (other_index, _, _) in self._pending.items():
+                if other_index == index:
+                    other_task.cancel()
+            return True
+
+        if self.on_failure:
+            self.on_failure(source, data is not None)
+        if data is not None:
+            # Данные пришли, но не те - источнику больше не доверяем
+            if not source.banned:
+                logger.error(f"Кусок {index} от {source.name} не прошёл проверку хеша, источник исключён")
+            source.banned = True
+            self.stats.bad_pieces += 1
+        else:
+            source.failures += 1
+            if source.failures >= MAX_SOURCE_FAILURES and not source.banned:
+                logger.warning(f"{source.name} исключён после {source.failures} ошибок")
+                source.banned = True
+        self._attempts[index] = self._attempts.get(index, 0) + 1
+        if self._attempts[index] >= MAX_PIECE_ATTEMPTS:
+            logger.error(f"Кусок {index} не загружен за {MAX_PIECE_ATTEMPTS} попыток")
+            return False
+        return True
+
+    async def _download_missing(self) -> bool:
+        last_progress = last_review = time.monotonic()
+        while self.missing:
+            self._schedule()
+            now = time.monotonic()
+            if not self._pending:
+                if not self._usable():
+                    logger.error(f"Не осталось исправных источников для {self.file_name}")
+                    return False
+                if now - last_progress > self.stall_timeout:
+                    logger.error(f"{len(self.missing)} кусков {self.file_name} нет ни у одного источника")
+                    return False
+                await asyncio.sleep(min(1.0, self.refresh_interval))
+                continue
+
+            done, _ = await asyncio.wait(list(self._pending), timeout=1.0, return_when=asyncio.FIRST_COMPLETED)
+            missing_before = len(self.missing)
+            for task in done:
+                if not self._complete_request(task):
+                    return False
+            now = time.monotonic()
+            if len(self.missing) < missing_before:
+                last_progress = now
+            if now - last_review >= self.choke_interval:
+                self._review_chokes()
+                last_review = now
+        return True
+
+    async def run(self) -> bool:
+        """Загрузка файла; True - файл собран и его SHA-256 совпал"""
+        started = time.perf_counter()
+        try:
+            if not check_file_pieces(self.file_info, self.piece_size):
+                logger.error(f"Список кусков не соответствует файлу {self.file_name}")
+                return False
+            if not self.sources:
+                return False
+
+            loop = asyncio.get_running_loop()
+            self.have = await loop.run_in_executor(None, verified_pieces, self.part_path, self.pieces,
+                                                   self.size, self.piece_size)
+            self.missing = set(range(len(self.pieces))) - self.have
+            self.stats.reused_pieces = len(self.have)
+            if self.have:
+                logger.info(f"{self.file_name}: {len(self.have)} из {len(self.pieces)} кусков уже загружены")
+
+            with open(self.part_path, 'r+b' if os.path.exists(self.part_path) else 'w+b') as part_file:
+                part_file.truncate(self.size)
+                self._part_file = part_file
+                self._session = self.session or aiohttp.ClientSession()
+                # Пока карта кусков пира не получена, запросы к нему не идут -
+                # зеркала и ответившие пиры не ждут медленных
+                for source in self.sources:
+                    if source.pieces_url and not source.bitfield_known:
+                        source.have = set()
+                refresher = asyncio.ensure_future(self._refresh_loop())
+                try:
+                    ok = await self._download_missing()
+                finally:
+                    refresher.cancel()
+                    for task in self._pending:
+                        task.cancel()
+                    await asyncio.gather(refresher, *self._pending, return_exceptions=True)
+                    self._pending.clear()
+                    if self.session is None:
+                        await self._session.close()
+            if not ok:
+                return False
+
+            # Итоговая сверка: список кусков мог прийти без проверенного манифеста
+            if await loop.run_in_executor(None, file_sha256, self.part_path) != self.file_hash:
+                os.remove(self.part_path)
+                logger.error(f"Хеш собранного файла {self.file_name} не совпадает")
+                return False
+            os.replace(self.part_path, self.file_name)
+            self.stats.seconds = time.perf_counter() - started
+            logger.info(f"Файл {self.file_name} загружен роем: {self.stats.summary()}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка роевой загрузки файла {self.file_name}: {e}")
+            return False
+        finally:
+            self._part_file = None
+            self._session = None
+
+
+# Проверка роя на loopback: несколько процессов-пиров на 127.0.0.1
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def _wait_port(port: int, timeout: float = 15.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+async def _serve_peer(args):
+    """Процесс-пир для проверки на loopback (настоящий P2P сервер лаунчера)"""
+    from aiohttp import web
+    from p2p_distribution import P2PDistributor
+
+    with open(args.entry, 'r', encoding='utf-8') as f:
+        entry = json.load(f)
+    distributor = P2PDistributor(port=args.port)
+    middlewares = []
+    if args.rate_kbps:
+        @web.middleware
+        async def throttle(request, handler):
+            # Медленный канал: задержка пропорциональна объёму запрошенного куска
+            if not request.path.startswith('/download/'):
+                return await handler(request)
+            rng = request.http_range
+            length = (rng.stop - rng.start) if rng.start is not None and rng.stop is not None else entry['size']
+            await asyncio.sleep(length / (args.rate_kbps * 1024))
+            return await handler(request)
+        middlewares.append(throttle)
+
+    if args.pieces_fraction < 1.0:
+        # Пир, который сам ещё загружает файл: раздаёт только часть кусков
+        swarm = SwarmDownload(entry, args.file, args.piece_size, [])
+        count = len(swarm.pieces)
+        swarm.part_path = args.file
+        swarm.have = set(random.Random(args.port).sample(range(count), int(count * args.pieces_fraction)))
+        distributor.partial_downloads[entry['hash']] = swarm
+    else:
+        # Хеш передаётся без проверки: пир с испорченной копией выдаёт её за верную
+        distributor.add_local_file(args.file, entry['hash'])
+    if not await distributor.start_server('127.0.0.1', middlewares=middlewares):
+        return 1
+    while True:
+        await asyncio.sleep(3600)
+
+async def run_loopback_swarm(peers: int = 4, slow_peers: int = 1, bad_peers: int = 1, partial_peers: int = 1,
+                             mirror: bool = True, size: int = 16 * 1024 * 1024,
+                             piece_size: int = 256 * 1024, slow_rate_kbps: int = 256) -> dict:
+    """Роевая загрузка с отдельными процессами-пирами на 127.0.0.1
+
+    Поднимаются ``peers`` полных сидов, из них ``slow_peers`` с
+    ограничением скорости и ``bad_peers`` с испорченной копией файла,
+    ``partial_peers`` пиров с половиной кусков и (``mirror``) зеркало.
+    Возвращает статистику загрузки и итог проверки собранного файла.
+    """
+    from p2p_distribution import P2PDistributor, Peer
+
+    processes = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_path = os.path.join(temp_dir, 'source.bin')
+        with open(source_path, 'wb') as f:
+            f.write(os.urandom(size))
+        file_hash, piece_hashes = hash_pieces(source_path, piece_size)
+        entry = {'size': size, 'hash': file_hash}
+        if len(piece_hashes) > 1:
+            entry.update({'pieces_root': pieces_root(piece_hashes), 'pieces': piece_hashes})
+        entry_path = os.path.join(temp_dir, 'entry.json')
+        with open(entry_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        bad_path = os.path.join(temp_dir, 'bad.bin')
+        with open(source_path, 'rb') as src, open(bad_path, 'wb') as dst:
+            dst.write(bytes(byte ^ 0xFF for byte in src.read(piece_size)) + src.read())
+
+        roles = (['bad'] * bad_peers + ['slow'] * slow_peers + ['seed'] * max(0, peers - bad_peers - slow_peers)
+                 + ['partial'] * partial_peers + (['mirror'] if mirror else []))
+        distributor = P2PDistributor(port=_free_port())
+        mirrors = []
+        try:
+            for number, role in enumerate(roles):
+                port = _free_port()
+                command = [sys.executable, os.path.abspath(__file__), 'peer', '--port', str(port),
+                           '--entry', entry_path, '--piece-size', str(piece_size),
+                           '--file', bad_path if role == 'bad' else source_path]
+                if role == 'slow':
+                    command += ['--rate-kbps', str(slow_rate_kbps)]
+                if role == 'partial':
+                    command += ['--pieces-fraction', '0.5']
+                processes.append(subprocess.Popen(command))
+                if not _wait_port(port):
+                    raise RuntimeError(f"Пир {role} на порту {port} не запустился")
+                if role == 'mirror':
+                    mirrors.append(f"http://127.0.0.1:{port}/download/{file_hash}")
+                else:
+                    peer_id = f"{role}-{number}"
+                    distributor.peers[peer_id] = Peer(peer_id, '127.0.0.1', port, {file_hash}, time.time())
+
+            target = os.path.join(temp_dir, 'downloaded.bin')
+            started = time.perf_counter()
+            ok = await distributor.download_pieces(entry, target, piece_size, mirrors)
+            seconds = time.perf_counter() - started
+            stats = distributor.last_swarm_stats.to_dict() if distributor.last_swarm_stats else {}
+            return {
+                'ok': ok and file_sha256(target) == file_hash,
+                'seconds': round(seconds, 3),
+                'roles': roles,
+                'peer_scores': {peer.id: {'speed_kbps': round(peer.upload_speed / 1024),
+                                          'latency_ms': round(peer.latency * 1000, 1),
+                                          'reliability': round(peer.reliability, 2)}
+                                for peer in distributor.peers.values()},
+                **stats
+            }
+        finally:
+            await distributor.close()
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Проверка роевой загрузки на loopback")
+    commands = parser.add_subparsers(dest='command', required=True)
+    peer = commands.add_parser('peer', help="Процесс-пир, раздающий файл")
+    peer.add_argument('--port', type=int, required=True)
+    peer.add_argument('--file', required=True)
+    peer.add_argument('--entry', required=True, help="JSON-запись файла манифеста")
+    peer.add_argument('--piece-size', type=int, default=DEFAULT_PIECE_SIZE)
+    peer.add_argument('--rate-kbps', type=int, default=0, help="Ограничение скорости отдачи")
+    peer.add_argument('--pieces-fraction', type=float, default=1.0, help="Доля кусков у пира")
+    loopback = commands.add_parser('loopback', help="Загрузка от нескольких локальных пиров")
+    loopback.add_argument('--peers', type=int, default=4)
+    loopback.add_argument('--slow-peers', type=int, default=1)
+    loopback.add_argument('--bad-peers', type=int, default=1)
+    loopback.add_argument('--partial-peers', type=int, default=1)
+    loopback.add_argument('--no-mirror', action='store_true')
+    loopback.add_argument('--size-mb', type=int, default=16)
+    loopback.add_argument('--piece-size', type=int, default=256 * 1024)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'peer':
+        return asyncio.run(_serve_peer(args))
+    result = asyncio.run(run_loopback_swarm(args.peers, args.slow_peers, args.bad_peers, args.partial_peers,
+                                            not args.no_mirror, args.size_mb * 1024 * 1024, args.piece_size))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result.get('ok') else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,353 @@
+"""
+Фоновая предзагрузка (prefetch) следующего патча
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import aiohttp
+from pathlib import Path
+from typing import Dict, List, Optional
+from datetime import datetime
+
+from bandwidth_optimizer import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+STAGED_VERSION_KEY = 'StagedVersion='
+_CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+def parse_staged_version(version_content: str) -> Optional[str]:
+    """Извлечение анонсированной версии из содержимого version.txt
+
+    Сервер заранее публикует строку ``StagedVersion=1.0.3``, пока
+    ``GameVersion`` всё ещё указывает на текущий релиз.
+    """
+    for line in version_content.splitlines():
+        line = line.strip()
+        if line.startswith(STAGED_VERSION_KEY):
+            staged_version = line[len(STAGED_VERSION_KEY):].strip()
+            return staged_version or None
+    return None
+
+class PrefetchManager:
+    """Менеджер фоновой предзагрузки архивов и дельт будущей версии
+
+    Предзагружаются ровно файлы маршрута обновления из подписанного
+    индекса дельт (``delta_updates.find_delta_route``) - те же, что
+    запросит ``update_files``. Файлы скачиваются в отдельную
+    staging-директорию (по подкаталогу на версию шага) с ограничением
+    скорости. Во время обновления ``take_staged_file`` сверяет
+    предзагруженный файл с хешем из подписанного индекса и переносит его
+    на место через ``os.replace``, так что ``update_files`` остаётся
+    только применить его.
+    """
+
+    def __init__(self, staging_dir: str = "launcher_data/prefetch",
+                 bandwidth_limit_kbps: float = 512, chunk_size: int = 64 * 1024):
+        self.staging_dir = Path(staging_dir)
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.staging_dir / "prefetch_index.json"
+        self.index = self.load_index()
+        self.chunk_size = chunk_size
+        self.rate_limiter = TokenBucket(bandwidth_limit_kbps * 1024)
+        self.is_cancelled = False
+
+    def load_index(self) -> dict:
+        """Загрузка индекса предзагруженных файлов"""
+        try:
+            if self.index_file.exists():
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки индекса предзагрузки: {e}")
+        return {}
+
+    def save_index(self):
+        """Сохранение индекса предзагруженных файлов"""
+        try:
+            with open(self.index_file, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения индекса предзагрузки: {e}")
+
+    def _version_dir(self, version: str) -> Path:
+        return self.staging_dir / version
+
+    def _drop_unused_files(self, version: str, keep_files: set):
+        """Удаление файлов версии, которых нет в текущем маршруте"""
+        version_entry = self.index.get(version, {})
+        for section in ('files', 'partial'):
+            for file_name in list(version_entry.get(section, {})):
+                if file_name not in keep_files:
+                    del version_entry[section][file_name]
+        version_dir = self._version_dir(version)
+        if version_dir.exists():
+            for file_path in version_dir.iterdir():
+                name = file_path.name[:-len('.part')] if file_path.name.endswith('.part') else file_path.name
+                if name not in keep_files:
+                    file_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _hash_file(file_path: Path) -> str:
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    async def prefetch_version(self, update_url: str, current_version: str,
+                               staged_version: str, route: list) -> bool:
+        """Предзагрузка файлов маршрута до анонсированной версии
+
+        ``route`` - шаги ``delta_updates.DeltaRouteStep`` от текущей
+        версии до ``staged_version`` по подписанному индексу дельт. Файл
+        шага кладётся в подкаталог версии шага (``to_version``) и
+        сверяется с размером и SHA-256 из индекса.
+        """
+        self.is_cancelled = False
+        route_files: Dict[str, set] = {}
+        for step in route:
+            route_files.setdefault(step.to_version, set()).add(step.file_name)
+        for version, file_names in route_files.items():
+            self._drop_unused_files(version, file_names)
+
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+        connector = aiohttp.TCPConnector(limit=1)  # Одно соединение - низкий приоритет
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            for step in route:
+                if self.is_cancelled:
+                    logger.info("Предзагрузка отменена")
+                    return False
+
+                version_entry = self.index.setdefault(step.to_version, {
+                    'base_version': current_version,
+                    'created_at': datetime.now().isoformat(),
+                    'files': {}
+                })
+                version_dir = self._version_dir(step.to_version)
+                version_dir.mkdir(parents=True, exist_ok=True)
+                url = os.path.join(update_url, step.file_name).replace('\\', '/')
+                dest = version_dir / step.file_name
+                partial = version_entry.setdefault('partial', {}).setdefault(step.file_name, {})
+                file_info = await self._download(session, url, dest,
+                                                 version_entry['files'].get(step.file_name), partial)
+                if file_info and step.sha256 and (file_info.get('size') != step.size
+                                                  or self._hash_file(dest) != step.sha256):
+                    logger.warning(f"Предзагруженный {step.file_name} не совпадает с индексом дельт, удалён")
+                    dest.unlink(missing_ok=True)
+                    file_info = None
+                if not file_info:
+                    version_entry['files'].pop(step.file_name, None)
+                    self.save_index()
+                    logger.warning(f"Не удалось предзагрузить {step.file_name}")
+                    return False
+                version_entry['files'][step.file_name] = file_info
+                version_entry['partial'].pop(step.file_name, None)
+                self.save_index()
+                logger.info(f"Предзагружен шаг {step.from_version} -> {step.to_version}: {step.file_name}")
+
+        logger.info(f"Версия {staged_version} предзагружена")
+        return True
+
+    @staticmethod
+    def _range_validator(partial: dict) -> Optional[str]:
+        """Значение If-Range для докачки: сильный ETag или Last-Modified (слабый ETag не допускается)"""
+        etag = partial.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return partial.get('last_modified') or None
+
+    @staticmethod
+    def _validators_changed(partial: dict, headers) -> bool:
+        """Ответ относится к другой версии файла, чем начатый ``.part``"""
+        for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+            if partial.get(key) and headers.get(header) and headers[header] != partial[key]:
+                return True
+        return False
+
+    @staticmethod
+    def _content_range_start(content_range: str) -> Optional[int]:
+        match = _CONTENT_RANGE_PATTERN.match(content_range.strip())
+        return int(match.group(1)) if match else None
+
+    async def _download(self, session: aiohttp.ClientSession, url: str, dest: Path,
+                        previous: Optional[dict], partial: dict) -> Optional[dict]:
+        """Загрузка одного файла с возобновлением, ограничением скорости и ревалидацией
+
+        ``partial`` - ETag/Last-Modified ответа, с которого начат ``.part``
+        (сохраняются в индексе). Докачка идёт только с If-Range по ним и
+        только если Content-Range начинается с размера ``.part``: если
+        файл на сервере изменился, он загружается заново, а не склеивается
+        из двух версий.
+        """
+        part_file = Path(f"{dest}.part")
+        headers = {}
+
+        # Уже предзагруженный файл проверяем условным запросом
+        if previous and dest.exists():
+            if previous.get('etag'):
+                headers['If-None-Match'] = previous['etag']
+            elif previous.get('last_modified'):
+                headers['If-Modified-Since'] = previous['last_modified']
+
+        offset = 0
+        if not headers and part_file.exists():
+            validator = self._range_validator(partial)
+            if validator:
+                offset = part_file.stat().st_size
+                if offset:
+                    headers['Range'] = f'bytes={offset}-'
+                    headers['If-Range'] = validator
+            else:
+                logger.debug(f"Нет валидатора для докачки {part_file.name}, загрузка заново")
+
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    logger.debug(f"Предзагруженный файл актуален: {dest.name}")
+                    return previous
+                if response.status == 404:
+                    logger.debug(f"Файл для предзагрузки отсутствует на сервере: {url}")
+                    return None
+                if response.status not in (200, 206):
+                    raise Exception(f"HTTP {response.status}")
+
+                if response.status == 206:
+                    start = self._content_range_start(response.headers.get('Content-Range', ''))
+                    if not offset or start != offset:
+                        part_file.unlink(missing_ok=True)
+                        raise Exception(f"Content-Range {response.headers.get('Content-Range')!r} "
+                                        f"не продолжает частичный файл ({offset} байт)")
+                    if self._validators_changed(partial, response.headers):
+                        # Сервер проигнорировал If-Range (например, не сравнивает ETag),
+                        # но отдал кусок уже другой версии файла
+                        logger.info(f"Файл {dest.name} изменился на сервере, загрузка заново")
+                        part_file.unlink(missing_ok=True)
+                        partial.clear()
+                        self.save_index()
+                        response.release()
+                        return await self._download(session, url, dest, previous, partial)
+                else:
+                    # Полный ответ: Range не поддержан или файл на сервере изменился
+                    offset = 0
+                    partial.clear()
+                    partial['etag'] = response.headers.get('ETag', '')
+                    partial['last_modified'] = response.headers.get('Last-Modified', '')
+                    self.save_index()
+
+                mode = 'ab' if offset else 'wb'
+                size = offset
+                with open(part_file, mode) as f:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        if self.is_cancelled:
+                            return None
+                        await self.rate_limiter.consume(len(chunk))
+                        f.write(chunk)
+                        size += len(chunk)
+
+                os.replace(part_file, dest)
+                return {
+                    'size': size,
+                    'etag': partial.get('etag', ''),
+                    'last_modified': partial.get('last_modified', ''),
+                    'downloaded_at': time.time()
+                }
+
+        except Exception as e:
+            logger.warning(f"Ошибка предзагрузки {url}: {e}")
+            return None
+
+    def get_staged_file(self, version: str, file_name: str) -> Optional[str]:
+        """Путь к полностью предзагруженному файлу или None"""
+        file_info = self.index.get(version, {}).get('files', {}).get(file_name)
+        if not file_info:
+            return None
+        staged_path = self._version_dir(version) / file_name
+        return str(staged_path) if staged_path.exists() else None
+
+    def take_staged_file(self, version: str, file_name: str, dest: str,
+                         expected_sha256: Optional[str]) -> bool:
+        """Проверка и перенос предзагруженного файла на место назначения
+
+        ``expected_sha256`` - хеш из подписанного индекса дельт: хеш,
+        посчитанный при предзагрузке, подтверждает лишь то, что отдал
+        сервер. Без него предзагруженный файл не используется.
+        """
+        staged_path = self.get_staged_file(version, file_name)
+        if not staged_path:
+            return False
+        if not expected_sha256:
+            logger.info(f"Нет подписанного хеша для {file_name}, предзагруженный файл не используется")
+            return False
+
+        try:
+            hasher = hashlib.sha256()
+            with open(staged_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(chunk)
+            if hasher.hexdigest() != expected_sha256:
+                raise ValueError("хеш не совпадает с подписанным индексом")
+
+            os.replace(staged_path, dest)
+            logger.info(f"Используется предзагруженный файл: {file_name}")
+            return True
+        except Exception as e:
+            logger.warning(f"Предзагруженный файл {file_name} отклонён: {e}")
+            try:
+                os.remove(staged_path)
+            except OSError:
+                pass
+            return False
+        finally:
+            del self.index[version]['files'][file_name]
+            self.save_index()
+
+    def cleanup(self, keep_versions: Optional[List[str]] = None):
+        """Удаление устаревших предзагруженных версий"""
+        keep = set(keep_versions or [])
+        for version in list(self.index.keys()):
+            if version in keep:
+                continue
+            version_dir = self._version_dir(version)
+            if version_dir.exists():
+                for file_path in version_dir.iterdir():
+                    try:
+                        file_path.unlink()
+                    except OSError as e:
+                        logger.warning(f"Не удалось удалить {file_path}: {e}")
+                try:
+                    version_dir.rmdir()
+                except OSError:
+                    pass
+            del self.index[version]
+        self.save_index()
+
+    def cancel(self):
+        """Отмена текущей предзагрузки (частичные файлы сохраняются для возобновления)"""
+        self.is_cancelled = True
+
+    def get_statistics(self) -> Dict[str, dict]:
+        """Сводка предзагруженных версий"""
+        return {
+            version: {
+                'base_version': entry.get('base_version'),
+                'files': len(entry.get('files', {})),
+                'size_bytes': sum(info.get('size', 0) for info in entry.get('files', {}).values())
+            }
+            for version, entry in self.index.items()
+        }
+
+# Глобальный экземпляр менеджера предзагрузки
+_prefetch_manager = None
+
+def get_prefetch_manager(staging_dir: str = "launcher_data/prefetch",
+                         bandwidth_limit_kbps: float = 512) -> PrefetchManager:
+    """Получение глобального экземпляра менеджера предзагрузки"""
+    global _prefetch_manager
+    if _prefetch_manager is None:
+        _prefetch_manager = PrefetchManager(staging_dir, bandwidth_limit_kbps)
+    return _prefetch_manager
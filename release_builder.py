@@ -0,0 +1,324 @@
+"""
+Инкрементальная сборка релиза: список файлов с хешами и архив обновления
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import zipfile
+from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from archive_packer import ArchivePacker, copy_raw_member
+
+logger = logging.getLogger(__name__)
+
+BUILD_CACHE_FILENAME = '.release_build_cache.json'
+BUILD_CACHE_FORMAT = 'build-cache-v1'
+
+@dataclass
+class ReleaseFile:
+    """Файл дерева сборки"""
+    path: str  # Относительный путь с '/'
+    full_path: str
+    size: int
+    mtime_ns: int
+    hash: str = ''
+
+@dataclass
+class BuildStats:
+    """Статистика сборки релиза"""
+    files: int = 0
+    hashed_files: int = 0
+    hashed_bytes: int = 0
+    reused_hashes: int = 0
+    reused_entries: int = 0
+    failed_files: int = 0
+    scan_seconds: float = 0.0
+    hash_seconds: float = 0.0
+    pack_seconds: float = 0.0
+    total_seconds: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def summary(self) -> str:
+        return (f"Файлов: {self.files}, перехешировано: {self.hashed_files} ({self.hashed_bytes} байт), "
+                f"записей из предыдущего архива: {self.reused_entries}; "
+                f"обход {self.scan_seconds:.1f} с, хеширование {self.hash_seconds:.1f} с, "
+                f"упаковка {self.pack_seconds:.1f} с, всего {self.total_seconds:.1f} с")
+
+def scan_release_tree(directory: str) -> List[ReleaseFile]:
+    """Один обход дерева сборки (скрытые папки, скрытые и .tmp файлы пропускаются)"""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in names:
+            if name.startswith('.') or name.endswith('.tmp'):
+                continue
+            full_path = os.path.join(root, name)
+            try:
+                stat = os.stat(full_path)
+            except OSError as e:
+                logger.error(f"Ошибка чтения файла {full_path}: {e}")
+                continue
+            relative_path = os.path.relpath(full_path, directory).replace('\\', '/')
+            files.append(ReleaseFile(relative_path, full_path, stat.st_size, stat.st_mtime_ns))
+    return files
+
+def hash_file(file_path: str) -> str:
+    """Вычисление SHA-256 хеша файла"""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def load_files_list_hashes(files_list_path: str) -> Dict[str, str]:
+    """Хеши из files_list (строки ``путь хеш размер``) для повторного использования при подписи"""
+    file_hashes = {}
+    try:
+        with open(files_list_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[0] != 'version':
+                    file_hashes[parts[0]] = parts[1]
+    except OSError as e:
+        logger.error(f"Ошибка чтения списка файлов {files_list_path}: {e}")
+    return file_hashes
+
+class ReleaseBuilder:
+    """Сборка files_list и архива релиза с кэшем предыдущей сборки
+
+    Кэш (``.release_build_cache.json`` в каталоге архива) хранит для
+    каждого файла размер, mtime и хеш, а также имя архива, в который он
+    попал. Файлы с неизменными размером и mtime не перехешируются, а
+    файлы с неизменным хешем переносятся из предыдущего архива сжатыми
+    записями как есть (``copy_raw_member``), без чтения и сжатия исходника.
+    """
+
+    def __init__(self, directory: str, packer: Optional[ArchivePacker] = None,
+                 cache_path: Optional[str] = None, incremental: bool = True,
+                 progress_callback: Optional[Callable[[int], None]] = None):
+        self.directory = directory
+        self.packer = packer or ArchivePacker()
+        self.cache_path = cache_path
+        self.incremental = incremental
+        self.progress_callback = progress_callback
+
+    def _cache_path_for(self, zip_path: str) -> str:
+        return self.cache_path or os.path.join(os.path.dirname(os.path.abspath(zip_path)), BUILD_CACHE_FILENAME)
+
+    def load_cache(self, cache_path: str) -> dict:
+        """Загрузка кэша предыдущей сборки"""
+        try:
+            if os.path.exists(cache_path):
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+                if cache.get('format') == BUILD_CACHE_FORMAT:
+                    return cache
+                logger.warning(f"Неизвестный формат кэша сборки: {cache_path}")
+        except Exception as e:
+            logger.error(f"Ошибка загрузки кэша сборки: {e}")
+        return {}
+
+    def save_cache(self, cache_path: str, version: str, zip_path: str, files: List[ReleaseFile]):
+        """Сохранение кэша сборки для следующего релиза"""
+        cache = {
+            'format': BUILD_CACHE_FORMAT,
+            'version': version,
+            'archive': os.path.basename(zip_path),
+            'compression': self.packer.spec,
+            'files': {f.path: {'size': f.size, 'mtime_ns': f.mtime_ns, 'hash': f.hash}
+                      for f in files if f.hash}
+        }
+        try:
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения кэша сборки: {e}")
+
+    def _open_previous_archive(self, cache: dict, cache_path: str) -> Optional[zipfile.ZipFile]:
+        """Предыдущий архив, записи которого можно переносить без пересжатия"""
+        if not cache.get('archive') or cache.get('compression') != self.packer.spec:
+            return None
+        archive_path = os.path.join(os.path.dirname(cache_path), cache['archive'])
+        try:
+            return zipfile.ZipFile(archive_path, 'r') if os.path.exists(archive_path) else None
+        except zipfile.BadZipFile as e:
+            logger.warning(f"Предыдущий архив повреждён, записи не переиспользуются: {e}")
+            return None
+
+    def _pack_shard(self, shard_path: str, shard_files: List[ReleaseFile]) -> Tuple[ArchivePacker, List[str]]:
+        """Упаковка части файлов в отдельный архив (выполняется в потоке пула)"""
+        packer = ArchivePacker.from_spec(self.packer.spec)
+        failed = []
+        with packer.open(shard_path) as shard_zip:
+            for release_file in shard_files:
+                try:
+                    packer.write(shard_zip, release_file.full_path, release_file.path)
+                except OSError as e:
+                    logger.error(f"Ошибка упаковки файла {release_file.full_path}: {e}")
+                    failed.append(release_file.path)
+        return packer, failed
+
+    def build(self, version: str, files_list_path: str, zip_path: str,
+              workers: int = 1) -> Optional[BuildStats]:
+        """Сборка списка файлов и архива; возвращает статистику или None при ошибке
+
+        При ``workers > 1`` хеширование идёт в пуле потоков, а сжатие -
+        в отдельные архивы-шарды по одному на поток (zlib, bz2 и lzma
+        отпускают GIL). Затем шарды сливаются в итоговый архив переносом
+        сжатых записей без пересжатия.
+        """
+        stats = BuildStats()
+        started = time.perf_counter()
+        cache_path = self._cache_path_for(zip_path)
+        previous_zip = None
+        temp_zip_path = f"{zip_path}.tmp"
+        shard_paths: List[str] = []
+        shard_zips: List[zipfile.ZipFile] = []
+
+        try:
+            files = scan_release_tree(self.directory)
+            stats.scan_seconds = time.perf_counter() - started
+            if not files:
+                return stats
+
+            cache = self.load_cache(cache_path) if self.incremental else {}
+            cached_files: Dict[str, dict] = cache.get('files', {})
+            previous_zip = self._open_previous_archive(cache, cache_path) if self.incremental else None
+
+            # Хеши: из кэша для файлов с прежними размером и mtime, остальные считаем
+            to_hash = []
+            for release_file in files:
+                cached = cached_files.get(release_file.path)
+                if cached and cached['size'] == release_file.size and cached['mtime_ns'] == release_file.mtime_ns:
+                    release_file.hash = cached['hash']
+                    stats.reused_hashes += 1
+                else:
+                    to_hash.append(release_file)
+
+            progress_total = len(to_hash) + len(files)
+            progress_done = 0
+
+            def report_progress():
+                if self.progress_callback:
+                    self.progress_callback(int(progress_done / progress_total * 100))
+
+            phase_started = time.perf_counter()
+            failed_paths = set()
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                for release_file, result in zip(to_hash, pool.map(_safe_hash, to_hash)):
+                    if isinstance(result, Exception):
+                        logger.error(f"Ошибка хеширования файла {release_file.full_path}: {result}")
+                        failed_paths.add(release_file.path)
+                    else:
+                        release_file.hash = result
+                        stats.hashed_files += 1
+                        stats.hashed_bytes += release_file.size
+                    progress_done += 1
+                    report_progress()
+            stats.hash_seconds = time.perf_counter() - phase_started
+
+            # Записи с прежним хешем переносятся из предыдущего архива
+            plan = []
+            for release_file in files:
+                if release_file.path in failed_paths:
+                    continue
+                cached = cached_files.get(release_file.path)
+                previous_info = None
+                if previous_zip and cached and cached['hash'] == release_file.hash:
+                    previous_info = previous_zip.NameToInfo.get(release_file.path)
+                    if previous_info and previous_info.file_size != release_file.size:
+                        previous_info = None
+                plan.append((release_file, previous_info))
+
+            phase_started = time.perf_counter()
+            shard_of: Dict[str, int] = {}
+            shard_packers: List[ArchivePacker] = []
+            to_pack = [release_file for release_file, previous_info in plan if previous_info is None]
+            if workers > 1 and len(to_pack) > 1:
+                # Жадное распределение по размеру: самый крупный файл - в наименее загруженный шард
+                shard_count = min(workers, len(to_pack))
+                shards: List[List[ReleaseFile]] = [[] for _ in range(shard_count)]
+                loads = [0] * shard_count
+                for release_file in sorted(to_pack, key=lambda f: f.size, reverse=True):
+                    target = loads.index(min(loads))
+                    shards[target].append(release_file)
+                    loads[target] += release_file.size
+                    shard_of[release_file.path] = target
+                shard_paths = [f"{zip_path}.shard{index}.tmp" for index in range(shard_count)]
+                with ThreadPoolExecutor(max_workers=shard_count) as pool:
+                    for packer, failed in pool.map(self._pack_shard, shard_paths, shards):
+                        shard_packers.append(packer)
+                        failed_paths.update(failed)
+                shard_zips = [zipfile.ZipFile(path, 'r') for path in shard_paths]
+
+            # Архив пишется во временный файл: предыдущий архив может иметь то же имя
+            with self.packer.open(temp_zip_path) as zipf, \
+                    open(files_list_path, 'w', encoding='utf-8') as files_list:
+                for packer in shard_packers:
+                    self.packer.stats.merge(packer.stats)
+                files_list.write(f"version {version}\n")
+
+                for release_file, previous_info in plan:
+                    try:
+                        if release_file.path in failed_paths:
+                            raise OSError("файл не упакован")
+                        if previous_info:
+                            self.packer.copy_member(previous_zip, previous_info, zipf)
+                            stats.reused_entries += 1
+                        elif release_file.path in shard_of:
+                            shard_zip = shard_zips[shard_of[release_file.path]]
+                            copy_raw_member(shard_zip, shard_zip.getinfo(release_file.path), zipf)
+                        else:
+                            self.packer.write(zipf, release_file.full_path, release_file.path)
+
+                        files_list.write(f"{release_file.path} {release_file.hash} {release_file.size}\n")
+                        stats.files += 1
+                    except (OSError, zipfile.BadZipFile) as e:
+                        logger.error(f"Ошибка обработки файла {release_file.full_path}: {e}")
+                        failed_paths.add(release_file.path)
+
+                    progress_done += 1
+                    report_progress()
+
+            stats.pack_seconds = time.perf_counter() - phase_started
+            stats.failed_files = len(failed_paths)
+            for release_file in files:
+                if release_file.path in failed_paths:
+                    release_file.hash = ''
+
+            if previous_zip:
+                previous_zip.close()
+                previous_zip = None
+            os.replace(temp_zip_path, zip_path)
+            self.save_cache(cache_path, version, zip_path, files)
+
+            stats.total_seconds = time.perf_counter() - started
+            logger.info(f"Релиз {version} собран: {stats.summary()}")
+            return stats
+
+        except Exception as e:
+            logger.error(f"Ошибка сборки релиза: {e}")
+            return None
+
+        finally:
+            if previous_zip:
+                previous_zip.close()
+            for shard_zip in shard_zips:
+                shard_zip.close()
+            for path in shard_paths + [temp_zip_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+def _safe_hash(release_file: ReleaseFile):
+    """Хеш файла или исключение (для pool.map без прерывания)"""
+    try:
+        return hash_file(release_file.full_path)
+    except OSError as e:
+        return e
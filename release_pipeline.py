@@ -0,0 +1,335 @@
+"""
+Консольный конвейер выпуска релиза без GUI: архив, дельты, подписи и индекс
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple
+
+from archive_packer import ArchivePacker, DEFAULT_COMPRESSION
+from release_builder import ReleaseBuilder, hash_file, load_files_list_hashes
+from merkle_manifest import DEFAULT_PIECE_SIZE
+
+try:
+    from crypto_signer import Signer
+    CRYPTO_AVAILABLE = True
+except ImportError:
+    CRYPTO_AVAILABLE = False
+    Signer = None
+
+try:
+    from delta_updates import DeltaGenerator, build_delta_index, version_key
+    DELTA_AVAILABLE = True
+except ImportError:
+    DELTA_AVAILABLE = False
+    DeltaGenerator = None
+    build_delta_index = None
+    version_key = None
+
+try:
+    from chunk_store import ChunkStoreGenerator
+    CHUNK_STORE_AVAILABLE = True
+except ImportError:
+    CHUNK_STORE_AVAILABLE = False
+    ChunkStoreGenerator = None
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class StageMetrics:
+    """Результат и время одного этапа конвейера"""
+    name: str
+    ok: bool = True
+    seconds: float = 0.0
+    details: Dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+def find_previous_releases(releases_dir: str, version: str, count: int) -> List[Tuple[str, str]]:
+    """N последних релизов старше ``version`` из каталога вида releases/<версия>/
+
+    Возвращает список (версия, путь к дереву), начиная с ближайшей версии.
+    """
+    releases = []
+    try:
+        for name in os.listdir(releases_dir):
+            path = os.path.join(releases_dir, name)
+            if os.path.isdir(path) and version_key(name) and version_key(name) < version_key(version):
+                releases.append((name, path))
+    except OSError as e:
+        logger.error(f"Ошибка чтения каталога релизов {releases_dir}: {e}")
+        return []
+    releases.sort(key=lambda release: version_key(release[0]), reverse=True)
+    return releases[:count]
+
+class ReleasePipeline:
+    """Сборка релиза теми же шагами, что и Update.py, но без Qt
+
+    Этапы: ``build`` (список файлов и архив через ReleaseBuilder),
+    затем параллельно ``sign`` (манифест подписей и .hash архива),
+    ``deltas`` (дельты от предыдущих релизов) и ``chunks`` (манифест
+    версии и новые чанки в хранилище ``chunk_store_dir``), и в конце
+    ``index`` (deltas.json каталога публикации). Время и результат
+    каждого этапа собираются в метрики для CI.
+    """
+
+    def __init__(self, source_dir: str, version: str, output_dir: str,
+                 compression: str = DEFAULT_COMPRESSION, incremental: bool = True,
+                 sign: bool = False, keys_dir: str = "crypto_keys",
+                 previous_releases: Optional[List[Tuple[str, str]]] = None,
+                 workers: Optional[int] = None, merkle_manifest: bool = True,
+                 signature_algorithm: Optional[str] = None, piece_size: Optional[int] = None,
+                 chunk_store_dir: Optional[str] = None):
+        self.source_dir = source_dir
+        self.version = version
+        self.output_dir = output_dir
+        self.compression = compression
+        self.incremental = incremental
+        self.previous_releases = previous_releases or []
+        self.workers = workers or os.cpu_count() or 1
+        self.signer = Signer(keys_dir, signature_algorithm) if CRYPTO_AVAILABLE and sign else None
+        self.sign = sign
+        self.merkle_manifest = merkle_manifest
+        self.piece_size = piece_size
+        self.chunk_store_dir = chunk_store_dir
+        self._keys_lock = threading.Lock()
+        self.files_list_path = os.path.join(output_dir, f"files_list_v{version}.txt")
+        self.zip_path = os.path.join(output_dir, f"files_list_v{version}.zip")
+
+    def _run_stage(self, name: str, func) -> StageMetrics:
+        """Запуск этапа с замером времени; исключение помечает этап как проваленный"""
+        stage = StageMetrics(name)
+        started = time.perf_counter()
+        try:
+            stage.ok = func(stage)
+        except Exception as e:
+            logger.error(f"Ошибка этапа {name}: {e}")
+            stage.ok = False
+            stage.error = str(e)
+        stage.seconds = round(time.perf_counter() - started, 3)
+        return stage
+
+    def _build(self, stage: StageMetrics) -> bool:
+        packer = ArchivePacker.from_spec(self.compression)
+        builder = ReleaseBuilder(self.source_dir, packer, incremental=self.incremental)
+        build_stats = builder.build(self.version, self.files_list_path, self.zip_path, workers=self.workers)
+        if build_stats is None:
+            stage.error = "Ошибка сборки архива обновления"
+            return False
+        stage.details = {
+            'files_list': self.files_list_path,
+            'archive': self.zip_path,
+            'archive_bytes': os.path.getsize(self.zip_path) if os.path.exists(self.zip_path) else 0,
+            'build': build_stats.to_dict(),
+            'packing': packer.stats.to_dict()
+        }
+        if build_stats.files == 0:
+            stage.error = "Каталог пуст или не содержит подходящих файлов"
+            return False
+        return build_stats.failed_files == 0
+
+    def _prepare_signer(self, stage: StageMetrics) -> bool:
+        """Проверка подписанта; ключи генерируются один раз на параллельные этапы"""
+        if not self.signer:
+            stage.error = "Криптографические модули недоступны"
+            return False
+        with self._keys_lock:
+            if not self.signer.private_key_path.exists() and not self.signer.generate_keys():
+                stage.error = "Не удалось сгенерировать пару ключей для подписи"
+                return False
+        return True
+
+    def _sign(self, stage: StageMetrics) -> bool:
+        if not self._prepare_signer(stage):
+            return False
+
+        manifest_path = f"{self.zip_path}.manifest"
+        # Хеши файлов уже посчитаны при сборке - манифест их переиспользует
+        known_hashes = load_files_list_hashes(self.files_list_path)
+        if not self.signer.create_manifest(self.source_dir, manifest_path, merkle=self.merkle_manifest,
+                                           known_hashes=known_hashes, workers=self.workers,
+                                           piece_size=self.piece_size):
+            stage.error = "Ошибка создания манифеста"
+            return False
+        hash_file_path = f"{self.zip_path}.hash"
+        with open(hash_file_path, 'w') as hf:
+            hf.write(hash_file(self.zip_path))
+        stage.details = {'manifest': manifest_path, 'hash_file': hash_file_path,
+                         'manifest_stats': self.signer.stats.to_dict()}
+        return True
+
+    def _deltas(self, stage: StageMetrics) -> bool:
+        if not DELTA_AVAILABLE:
+            stage.error = "Delta-обновления недоступны"
+            return False
+        generator = DeltaGenerator(packer=ArchivePacker.from_spec(self.compression))
+        packages = []
+        ok = True
+        for old_version, old_dir in self.previous_releases:
+            output_path = os.path.join(self.output_dir, f"delta_{old_version}_to_{self.version}.zip")
+            started = time.perf_counter()
+            delta_info = generator.generate_delta_package(old_dir, self.source_dir, old_version, self.version,
+                                                          output_path, workers=self.workers)
+            package = {'from_version': old_version, 'file': output_path,
+                       'seconds': round(time.perf_counter() - started, 3), 'ok': delta_info is not None}
+            if delta_info:
+                package.update({'delta_size': delta_info.delta_size,
+                                'original_size': delta_info.original_size,
+                                'compression_ratio': delta_info.compression_ratio,
+                                'files_count': delta_info.files_count})
+            else:
+                ok = False
+            packages.append(package)
+        stage.details = {'packages': packages}
+        return ok
+
+    def _chunks(self, stage: StageMetrics) -> bool:
+        if not CHUNK_STORE_AVAILABLE:
+            stage.error = "Хранилище чанков недоступно"
+            return False
+        if self.sign and not self._prepare_signer(stage):
+            return False
+        manifest_path = os.path.join(self.output_dir, f"chunk_manifest_v{self.version}.json")
+        info = ChunkStoreGenerator().build_chunk_manifest(self.source_dir, self.version, self.chunk_store_dir,
+                                                          manifest_path, signer=self.signer)
+        if info is None:
+            stage.error = "Ошибка создания манифеста чанков"
+            return False
+        stage.details = {'manifest': manifest_path, 'store': self.chunk_store_dir,
+                         'signed': self.signer is not None, 'store_info': asdict(info)}
+        return True
+
+    def _index(self, stage: StageMetrics) -> bool:
+        if not DELTA_AVAILABLE:
+            stage.error = "Delta-обновления недоступны"
+            return False
+        index = build_delta_index(self.output_dir, signer=self.signer)
+        if index is None:
+            stage.error = "Ошибка построения индекса дельт"
+            return False
+        stage.details = {'deltas': len(index.get('deltas', [])), 'archives': len(index.get('full', [])),
+                         'chunk_manifests': len(index.get('chunk_manifests', [])),
+                         'signed': 'signature' in index}
+        return True
+
+    def run(self) -> dict:
+        """Выполнение конвейера; возвращает метрики всех этапов"""
+        started = time.perf_counter()
+        os.makedirs(self.output_dir, exist_ok=True)
+        stages = [self._run_stage('build', self._build)]
+
+        if stages[0].ok:
+            # Подпись читает исходное дерево и архив, дельты - исходное и старые деревья:
+            # этапы независимы и идут одновременно
+            parallel = []
+            if self.sign:
+                parallel.append(('sign', self._sign))
+            if self.previous_releases:
+                parallel.append(('deltas', self._deltas))
+            if self.chunk_store_dir:
+                parallel.append(('chunks', self._chunks))
+            if parallel:
+                with ThreadPoolExecutor(max_workers=len(parallel)) as pool:
+                    stages.extend(pool.map(lambda item: self._run_stage(*item), parallel))
+            stages.append(self._run_stage('index', self._index))
+
+        return {
+            'version': self.version,
+            'ok': all(stage.ok for stage in stages),
+            'workers': self.workers,
+            'total_seconds': round(time.perf_counter() - started, 3),
+            'stages': {stage.name: asdict(stage) for stage in stages}
+        }
+
+def parse_previous(values: List[str]) -> List[Tuple[str, str]]:
+    """Разбор аргументов ``--previous ВЕРСИЯ=КАТАЛОГ``"""
+    releases = []
+    for value in values:
+        old_version, separator, old_dir = value.partition('=')
+        if not separator or not old_version or not old_dir:
+            raise argparse.ArgumentTypeError(f"Ожидается ВЕРСИЯ=КАТАЛОГ: {value}")
+        releases.append((old_version, old_dir))
+    return releases
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Точка входа консольного режима; код возврата 0 - все этапы успешны"""
+    parser = argparse.ArgumentParser(
+        prog='Update.py',
+        description="Сборка релиза без GUI: архив, дельты от предыдущих релизов, подписи и индекс. "
+                    "Метрики этапов выводятся в JSON.")
+    parser.add_argument('--source', required=True, help="Каталог с файлами новой версии")
+    parser.add_argument('--version', required=True, help="Номер новой версии (например, 1.0.5)")
+    parser.add_argument('--output-dir', required=True, help="Каталог публикации")
+    parser.add_argument('--compression', default=DEFAULT_COMPRESSION,
+                        help="Сжатие архивов: deflate:N, bzip2:N, lzma, stored")
+    parser.add_argument('--no-incremental', action='store_true', help="Собрать архив без кэша предыдущей сборки")
+    parser.add_argument('--sign', action='store_true', help="Создать манифест подписей и .hash архива")
+    parser.add_argument('--legacy-manifest', action='store_true',
+                        help="Манифест с подписью каждого файла (для старых лаунчеров)")
+    parser.add_argument('--signature-algorithm', choices=['RSA-PSS-SHA256', 'Ed25519'],
+                        help="Алгоритм подписи (по умолчанию - алгоритм существующего ключа, для новых ключей RSA)")
+    parser.add_argument('--piece-size', type=int, default=0, metavar='БАЙТ',
+                        help="Хеши кусков этого размера в манифесте для P2P-загрузки "
+                             f"(например, {DEFAULT_PIECE_SIZE}; 0 - без кусков)")
+    parser.add_argument('--keys-dir', default="crypto_keys", help="Каталог ключей подписи")
+    parser.add_argument('--previous', action='append', default=[], metavar='ВЕРСИЯ=КАТАЛОГ',
+                        help="Дерево предыдущего релиза для дельты (можно несколько раз)")
+    parser.add_argument('--releases-dir', help="Каталог деревьев релизов вида <каталог>/<версия>/")
+    parser.add_argument('--delta-count', type=int, default=0,
+                        help="Сколько последних релизов из --releases-dir использовать для дельт")
+    parser.add_argument('--chunk-store', nargs='?', const='', metavar='КАТАЛОГ',
+                        help="Опубликовать манифест хранилища чанков (CDC) и дописать новые чанки в КАТАЛОГ "
+                             "(по умолчанию - каталог публикации)")
+    parser.add_argument('--workers', type=int, default=None, help="Число потоков/процессов (по умолчанию - CPU)")
+    parser.add_argument('--metrics', help="Файл для JSON-метрик (по умолчанию - stdout)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    try:
+        previous_releases = parse_previous(args.previous)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if args.piece_size < 0:
+        parser.error("Размер куска не может быть отрицательным")
+    if args.piece_size and args.legacy_manifest:
+        parser.error("Хеши кусков поддерживаются только манифестом на дереве Меркла")
+    try:
+        ArchivePacker.from_spec(args.compression)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.releases_dir and args.delta_count > 0:
+        if not DELTA_AVAILABLE:
+            parser.error("Delta-обновления недоступны")
+        known_versions = {old_version for old_version, _ in previous_releases}
+        for release in find_previous_releases(args.releases_dir, args.version, args.delta_count):
+            if release[0] not in known_versions:
+                previous_releases.append(release)
+
+    pipeline = ReleasePipeline(args.source, args.version, args.output_dir, args.compression,
+                               incremental=not args.no_incremental, sign=args.sign, keys_dir=args.keys_dir,
+                               previous_releases=previous_releases, workers=args.workers,
+                               merkle_manifest=not args.legacy_manifest,
+                               signature_algorithm=args.signature_algorithm,
+                               piece_size=args.piece_size or None,
+                               chunk_store_dir=(args.chunk_store or args.output_dir)
+                               if args.chunk_store is not None else None)
+    metrics = pipeline.run()
+
+    output = json.dumps(metrics, ensure_ascii=False, indent=2)
+    if args.metrics:
+        with open(args.metrics, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0 if metrics['ok'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
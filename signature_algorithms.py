@@ -0,0 +1,55 @@
+"""
+Алгоритмы подписи обновлений: RSA-PSS-SHA256 (совместимость) и Ed25519
+"""
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, ed25519
+
+# Значение поля ``algorithm`` в подписях. Идентификатор задаёт и ключ,
+# и формат подписи: новые схемы получают новый идентификатор, а
+# неизвестные значения отвергаются при проверке.
+RSA_PSS_SHA256 = 'RSA-PSS-SHA256'
+ED25519 = 'Ed25519'
+SIGNATURE_ALGORITHMS = (RSA_PSS_SHA256, ED25519)
+# Подписи без поля algorithm созданы до его появления - это RSA-PSS
+DEFAULT_SIGNATURE_ALGORITHM = RSA_PSS_SHA256
+
+_PSS_PADDING = padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH)
+
+def generate_private_key(algorithm: str = DEFAULT_SIGNATURE_ALGORITHM):
+    """Новый приватный ключ для алгоритма"""
+    if algorithm == RSA_PSS_SHA256:
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    if algorithm == ED25519:
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Неизвестный алгоритм подписи: {algorithm}")
+
+def key_algorithm(key) -> str:
+    """Алгоритм подписи по типу приватного или публичного ключа"""
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return RSA_PSS_SHA256
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return ED25519
+    raise ValueError(f"Неподдерживаемый тип ключа: {type(key).__name__}")
+
+def sign_message(private_key, message: bytes) -> bytes:
+    """Подпись сообщения алгоритмом, соответствующим ключу"""
+    if key_algorithm(private_key) == ED25519:
+        return private_key.sign(message)
+    return private_key.sign(message, _PSS_PADDING, hashes.SHA256())
+
+def verify_message(public_key, algorithm: str, signature: bytes, message: bytes):
+    """Проверка подписи; при ошибке - InvalidSignature или ValueError
+
+    Алгоритм из подписи должен совпадать с типом ключа: подпись не
+    проверяется «подходящим» алгоритмом, выбранным по ключу.
+    """
+    algorithm = algorithm or DEFAULT_SIGNATURE_ALGORITHM
+    if algorithm not in SIGNATURE_ALGORITHMS:
+        raise ValueError(f"Неизвестный алгоритм подписи: {algorithm}")
+    if key_algorithm(public_key) != algorithm:
+        raise ValueError(f"Алгоритм подписи {algorithm} не соответствует публичному ключу")
+    if algorithm == ED25519:
+        public_key.verify(signature, message)
+    else:
+        public_key.verify(signature, message, _PSS_PADDING, hashes.SHA256())
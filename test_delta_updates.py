@@ -0,0 +1,194 @@
+"""
+Тесты delta-обновлений: выбор маршрута и откат фиксации
+"""
+
+import glob
+import json
+import os
+import zipfile
+
+from delta_updates import find_delta_route, DeltaApplier, FileChange
+from delta_codecs import DEFAULT_CODEC_ID
+
+
+def delta(from_version, to_version, size, codecs=None):
+    return {'from': from_version, 'to': to_version, 'size': size,
+            'file': f"delta_{from_version}_to_{to_version}.zip",
+            'sha256': f"{from_version}-{to_version}", 'codecs': codecs or [DEFAULT_CODEC_ID]}
+
+
+def full(version, size):
+    return {'version': version, 'size': size, 'file': f"files_list_v{version}.zip", 'sha256': version}
+
+
+def route_files(route):
+    return [step.file_name for step in route]
+
+
+def test_skip_delta_beats_cheaper_per_hop_chain():
+    index = {'deltas': [delta('1.0.0', '1.0.1', 40), delta('1.0.1', '1.0.2', 40),
+                        delta('1.0.0', '1.0.2', 60)],
+             'full': [full('1.0.2', 1000)]}
+    route = find_delta_route(index, '1.0.0', '1.0.2')
+    assert route_files(route) == ['delta_1.0.0_to_1.0.2.zip']
+    assert (route[0].kind, route[0].size, route[0].sha256) == ('delta', 60, '1.0.0-1.0.2')
+
+
+def test_chain_beats_larger_skip_delta():
+    index = {'deltas': [delta('1.0.0', '1.0.1', 10), delta('1.0.1', '1.0.2', 10),
+                        delta('1.0.2', '1.0.3', 10), delta('1.0.0', '1.0.3', 50)]}
+    route = find_delta_route(index, '1.0.0', '1.0.3')
+    assert route_files(route) == ['delta_1.0.0_to_1.0.1.zip', 'delta_1.0.1_to_1.0.2.zip',
+                                  'delta_1.0.2_to_1.0.3.zip']
+    assert [(step.from_version, step.to_version) for step in route] == [
+        ('1.0.0', '1.0.1'), ('1.0.1', '1.0.2'), ('1.0.2', '1.0.3')]
+
+
+def test_equal_size_prefers_fewer_hops():
+    index = {'deltas': [delta('1.0.0', '1.0.1', 30), delta('1.0.1', '1.0.2', 30),
+                        delta('1.0.0', '1.0.2', 60)]}
+    assert route_files(find_delta_route(index, '1.0.0', '1.0.2')) == ['delta_1.0.0_to_1.0.2.zip']
+
+
+def test_unsupported_codec_delta_skipped():
+    index = {'deltas': [delta('1.0.0', '1.0.1', 40), delta('1.0.1', '1.0.2', 40),
+                        delta('1.0.0', '1.0.2', 10, codecs=[DEFAULT_CODEC_ID, 'future-codec'])]}
+    assert route_files(find_delta_route(index, '1.0.0', '1.0.2', [DEFAULT_CODEC_ID])) == [
+        'delta_1.0.0_to_1.0.1.zip', 'delta_1.0.1_to_1.0.2.zip']
+    assert route_files(find_delta_route(index, '1.0.0', '1.0.2', [DEFAULT_CODEC_ID, 'future-codec'])) == [
+        'delta_1.0.0_to_1.0.2.zip']
+    # Без списка кодеков фильтрация не выполняется
+    assert route_files(find_delta_route(index, '1.0.0', '1.0.2')) == ['delta_1.0.0_to_1.0.2.zip']
+
+
+def test_full_archive_fallback_when_chain_broken():
+    index = {'deltas': [delta('1.0.0', '1.0.1', 10), delta('1.0.2', '1.0.3', 10)],
+             'full': [full('1.0.2', 500), full('1.0.3', 600)]}
+    route = find_delta_route(index, '1.0.0', '1.0.3')
+    assert [(step.kind, step.file_name) for step in route] == [
+        ('full', 'files_list_v1.0.2.zip'), ('delta', 'delta_1.0.2_to_1.0.3.zip')]
+    assert route[0].from_version == '1.0.0'
+
+
+def test_full_archive_when_cheaper_than_deltas():
+    index = {'deltas': [delta('1.0.0', '1.0.1', 300), delta('1.0.1', '1.0.2', 300)],
+             'full': [full('1.0.2', 500)]}
+    route = find_delta_route(index, '1.0.0', '1.0.2')
+    assert [(step.kind, step.from_version, step.to_version) for step in route] == [('full', '1.0.0', '1.0.2')]
+
+
+def test_full_archive_of_newer_version_not_used():
+    index = {'deltas': [delta('1.0.0', '1.0.1', 10)], 'full': [full('1.0.3', 5)]}
+    assert find_delta_route(index, '1.0.0', '1.0.2') is None
+
+
+def test_unreachable_and_up_to_date():
+    index = {'deltas': [delta('1.0.0', '1.0.1', 10)]}
+    assert find_delta_route(index, '1.0.0', '1.0.2') is None
+    assert find_delta_route(index, '1.0.2', '1.0.2') == []
+    assert find_delta_route(index, '1.0.10', '1.0.9') == []
+
+
+def write_files(directory, files):
+    for relative_path, content in files.items():
+        path = directory / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding='utf-8')
+
+
+def read_files(directory):
+    return {os.path.relpath(path, directory).replace(os.sep, '/'): open(path, encoding='utf-8').read()
+            for path in glob.glob(os.path.join(str(directory), '**', '*'), recursive=True)
+            if os.path.isfile(path) and '.delta_staging_' not in path}
+
+
+def fail_replace(monkeypatch, should_fail):
+    """Подмена os.replace, падающая на выбранных переносах"""
+    real_replace = os.replace
+
+    def replace(src, dst):
+        if should_fail(str(src), str(dst)):
+            raise OSError("сбой переноса")
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', replace)
+
+
+def test_rollback_restores_only_committed_files(tmp_path, monkeypatch):
+    target = tmp_path / 'game'
+    staging = tmp_path / 'staging'
+    staging.mkdir()
+    original = {'a.txt': 'old a', 'b.txt': 'old b', 'c.txt': 'old c', 'gone/old.txt': 'gone'}
+    write_files(target, original)
+    write_files(staging, {'a.new': 'new a', 'b.new': 'new b', 'c.new': 'new c', 'd.new': 'new d'})
+
+    def prepared_item(change_type, relative_path, staged_name=None):
+        return (FileChange(relative_path, change_type),
+                str(target / relative_path), str(staging / staged_name) if staged_name else None)
+
+    prepared = [prepared_item('modify', 'a.txt', 'a.new'),
+                prepared_item('add', 'new/dir/d.txt', 'd.new'),
+                prepared_item('delete', 'gone/old.txt'),
+                prepared_item('modify', 'b.txt', 'b.new'),
+                prepared_item('modify', 'c.txt', 'c.new')]
+    fail_replace(monkeypatch, lambda src, dst: src.endswith('b.new'))
+
+    assert DeltaApplier()._commit_changes(prepared, str(staging)) == (False, True)
+    assert read_files(target) == original
+    assert not (target / 'new').exists()
+    # До c.txt фиксация не дошла: подготовленный файл не тронут
+    assert (staging / 'c.new').read_text(encoding='utf-8') == 'new c'
+    assert not glob.glob(str(staging / '*.orig'))
+
+
+def test_commit_without_errors(tmp_path):
+    target = tmp_path / 'game'
+    staging = tmp_path / 'staging'
+    staging.mkdir()
+    write_files(target, {'a.txt': 'old a', 'gone/old.txt': 'gone'})
+    write_files(staging, {'a.new': 'new a', 'd.new': 'new d'})
+    prepared = [(FileChange('a.txt', 'modify'), str(target / 'a.txt'), str(staging / 'a.new')),
+                (FileChange('gone/old.txt', 'delete'), str(target / 'gone' / 'old.txt'), None),
+                (FileChange('gone', 'add'), str(target / 'gone'), str(staging / 'd.new'))]
+
+    assert DeltaApplier()._commit_changes(prepared, str(staging)) == (True, True)
+    assert read_files(target) == {'a.txt': 'new a', 'gone': 'new d'}
+
+
+def make_package(path, files):
+    changes = [{'file_path': relative_path, 'change_type': 'replace'} for relative_path in files]
+    with zipfile.ZipFile(path, 'w') as package:
+        package.writestr('delta_manifest.json', json.dumps({'source_version': '1.0.0',
+                                                            'target_version': '1.0.1',
+                                                            'changes': changes}))
+        for relative_path, content in files.items():
+            package.writestr(f"files/{relative_path}", content)
+    return str(path)
+
+
+def test_staging_removed_after_complete_rollback(tmp_path, monkeypatch):
+    target = tmp_path / 'game'
+    write_files(target, {'a.txt': 'old a', 'b.txt': 'old b'})
+    package = make_package(tmp_path / 'delta_1.0.0_to_1.0.1.zip', {'a.txt': 'new a', 'b.txt': 'new b'})
+    fail_replace(monkeypatch, lambda src, dst: dst.endswith('b.txt') and src.endswith('.new'))
+
+    assert not DeltaApplier().apply_delta_package(package, str(target))
+    assert read_files(target) == {'a.txt': 'old a', 'b.txt': 'old b'}
+    assert not glob.glob(str(target / '.delta_staging_*'))
+
+
+def test_staging_kept_when_rollback_incomplete(tmp_path, monkeypatch):
+    target = tmp_path / 'game'
+    write_files(target, {'a.txt': 'old a', 'b.txt': 'old b'})
+    package = make_package(tmp_path / 'delta_1.0.0_to_1.0.1.zip', {'a.txt': 'new a', 'b.txt': 'new b'})
+    fail_replace(monkeypatch, lambda src, dst: (dst.endswith('b.txt') and src.endswith('.new'))
+                 or (dst.endswith('a.txt') and src.endswith('.orig')))
+
+    assert not DeltaApplier().apply_delta_package(package, str(target))
+    staging_dirs = glob.glob(str(target / '.delta_staging_*'))
+    assert len(staging_dirs) == 1
+    # Оригинал a.txt не вернулся на место и доступен только в staging
+    assert not (target / 'a.txt').exists()
+    backups = [open(path, encoding='utf-8').read() for path in glob.glob(os.path.join(staging_dirs[0], '*.orig'))]
+    assert 'old a' in backups
+    assert (target / 'b.txt').read_text(encoding='utf-8') == 'old b'
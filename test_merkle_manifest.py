@@ -0,0 +1,200 @@
+"""
+Тесты манифеста на дереве Меркла и проверки его подписи
+"""
+
+import copy
+import hashlib
+import json
+
+import pytest
+
+from merkle_manifest import (MerkleTree, leaf_hash, node_hash, root_from_proof, build_manifest,
+                             build_inclusion_proof, check_inclusion_proof, manifest_tree)
+from crypto_signer import Signer
+from crypto_verifier import Verifier
+
+PIECE_SIZE = 1024
+
+
+def make_leaves(count):
+    return [leaf_hash(f"file_{index}.pak", index, hashlib.sha256(bytes([index])).hexdigest())
+            for index in range(count)]
+
+
+@pytest.fixture(scope='module')
+def keys_dir(tmp_path_factory):
+    keys_dir = tmp_path_factory.mktemp('keys')
+    assert Signer(str(keys_dir)).generate_keys()
+    return keys_dir
+
+
+@pytest.fixture
+def verifier(keys_dir):
+    # Новый экземпляр на тест: кэш проверенных корней не переходит между тестами
+    return Verifier(str(keys_dir))
+
+
+@pytest.fixture
+def release_dir(tmp_path):
+    release_dir = tmp_path / 'release'
+    (release_dir / 'data').mkdir(parents=True)
+    (release_dir / 'game.exe').write_bytes(b'exe' * 100)
+    (release_dir / 'data' / 'big.pak').write_bytes(bytes(range(256)) * 20)  # 5 кусков
+    (release_dir / 'data' / 'small.txt').write_text('small', encoding='utf-8')
+    return release_dir
+
+
+@pytest.fixture
+def signed_manifest(keys_dir, release_dir, tmp_path):
+    manifest_path = tmp_path / 'release.manifest'
+    assert Signer(str(keys_dir)).create_manifest(str(release_dir), str(manifest_path), piece_size=PIECE_SIZE)
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_single_leaf_is_root():
+    leaves = make_leaves(1)
+    tree = MerkleTree(leaves)
+    assert tree.root == leaves[0]
+    assert tree.proof(0) == []
+    assert root_from_proof(leaves[0], []) == tree.root
+
+
+def test_two_leaves():
+    leaves = make_leaves(2)
+    tree = MerkleTree(leaves)
+    assert tree.root == node_hash(leaves[0], leaves[1])
+    assert tree.proof(0) == [['R', leaves[1].hex()]]
+    assert tree.proof(1) == [['L', leaves[0].hex()]]
+
+
+def test_odd_leaf_is_promoted():
+    leaves = make_leaves(3)
+    assert MerkleTree(leaves).root == node_hash(node_hash(leaves[0], leaves[1]), leaves[2])
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 4, 5, 6, 7, 8, 13])
+def test_every_proof_reaches_root(count):
+    leaves = make_leaves(count)
+    tree = MerkleTree(leaves)
+    for index, leaf in enumerate(leaves):
+        assert root_from_proof(leaf, tree.proof(index)) == tree.root
+    with pytest.raises(IndexError):
+        tree.proof(count)
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 4, 7])
+def test_inclusion_proof_for_every_file(count):
+    manifest = build_manifest({f"dir/file_{index}.bin": (index, hashlib.sha256(bytes([index])).hexdigest())
+                               for index in range(count)})
+    for relative_path in manifest['files']:
+        assert check_inclusion_proof(build_inclusion_proof(manifest, relative_path))
+
+
+def test_proof_of_other_leaf_rejected():
+    leaves = make_leaves(4)
+    tree = MerkleTree(leaves)
+    assert root_from_proof(leaves[0], tree.proof(1)) != tree.root
+
+
+def test_leaf_presented_as_internal_node_rejected():
+    leaves = make_leaves(4)
+    tree = MerkleTree(leaves)
+    inner = node_hash(leaves[0], leaves[1])
+    short_proof = tree.proof(0)[1:]
+    # Без проверки листа внутренний узел с укороченным путём дал бы тот же корень
+    assert root_from_proof(inner, short_proof) == tree.root
+
+    manifest = build_manifest({f"file_{index}": (index, hashlib.sha256(bytes([index])).hexdigest())
+                               for index in range(4)})
+    bundle = build_inclusion_proof(manifest, 'file_0')
+    node = manifest_tree(manifest['files']).levels[1][0]
+    bundle['proof'] = bundle['proof'][1:]
+    bundle['hash'] = node.hex()
+    assert not check_inclusion_proof(bundle)
+    # Хеш листа отделён префиксом от хеша узла из тех же байт
+    assert leaf_hash('a', 1, 'b') != hashlib.sha256(b'a\n1\nb').digest()
+    assert node_hash(leaves[0], leaves[1]) != hashlib.sha256(leaves[0] + leaves[1]).digest()
+
+
+def test_signed_manifest_verifies(verifier, signed_manifest, release_dir):
+    assert verifier.verify_manifest_signature(signed_manifest)
+    report = verifier.verify_manifest_report(signed_manifest, str(release_dir))
+    assert report.ok and report.verified_files == 3
+
+
+@pytest.mark.parametrize('field, value', [
+    ('size', 1),
+    ('hash', '0' * 64),
+    ('pieces_root', '0' * 64),
+])
+def test_tampered_file_entry_rejected(verifier, signed_manifest, field, value):
+    tampered = copy.deepcopy(signed_manifest)
+    tampered['files']['data/big.pak'][field] = value
+    assert not verifier.verify_manifest_signature(tampered)
+
+
+def test_tampered_piece_list_rejected(verifier, signed_manifest):
+    tampered = copy.deepcopy(signed_manifest)
+    tampered['files']['data/big.pak']['pieces'][0] = '0' * 64
+    assert not verifier.verify_manifest_signature(tampered)
+
+
+def test_swapped_leaf_order_rejected(verifier, signed_manifest):
+    tampered = copy.deepcopy(signed_manifest)
+    files = tampered['files']
+    files['game.exe']['leaf'], files['data/small.txt']['leaf'] = (files['data/small.txt']['leaf'],
+                                                                  files['game.exe']['leaf'])
+    assert not verifier.verify_manifest_signature(tampered)
+
+
+@pytest.mark.parametrize('field, value', [
+    ('version', '9.9'),
+    ('created_at', '2000-01-01T00:00:00'),
+    ('piece_size', PIECE_SIZE * 2),
+    ('merkle_root', '0' * 64),
+    ('leaf_count', 2),
+])
+def test_tampered_header_rejected(verifier, signed_manifest, field, value):
+    tampered = copy.deepcopy(signed_manifest)
+    tampered[field] = value
+    assert not verifier.verify_manifest_signature(tampered)
+
+
+def test_unsigned_manifest_rejected(verifier, signed_manifest):
+    unsigned = copy.deepcopy(signed_manifest)
+    del unsigned['signature']
+    assert not verifier.verify_manifest_signature(unsigned)
+
+
+def test_inclusion_proof_signature(verifier, signed_manifest, release_dir):
+    bundle = build_inclusion_proof(signed_manifest, 'data/big.pak')
+    assert verifier.verify_inclusion_proof(bundle, str(release_dir / 'data' / 'big.pak'))
+    assert not verifier.verify_inclusion_proof(bundle, str(release_dir / 'game.exe'))
+
+    tampered = copy.deepcopy(bundle)
+    tampered['header']['version'] = '9.9'
+    assert not Verifier(verifier.keys_dir).verify_inclusion_proof(tampered)
+
+    tampered = copy.deepcopy(bundle)
+    tampered['size'] += 1
+    assert not verifier.verify_inclusion_proof(tampered)
+
+
+def test_modified_file_fails_report(verifier, signed_manifest, release_dir):
+    (release_dir / 'data' / 'small.txt').write_text('SMALL', encoding='utf-8')
+    report = verifier.verify_manifest_report(signed_manifest, str(release_dir))
+    assert not report.ok
+    assert report.failures == {'data/small.txt': "хеш не совпадает"}
+
+
+def test_legacy_manifest_still_verifies(keys_dir, verifier, release_dir, tmp_path):
+    manifest_path = tmp_path / 'legacy.manifest'
+    assert Signer(str(keys_dir)).create_manifest(str(release_dir), str(manifest_path), merkle=False)
+    assert verifier.verify_manifest(str(manifest_path), str(release_dir))
+
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['files']['game.exe']['hash'] = '0' * 64
+    report = verifier.verify_manifest_report(manifest, str(release_dir))
+    assert not report.ok and 'game.exe' in report.failures
@@ -14,13 +14,23 @@ def test_imports():
         ("crypto_verifier", "Проверка подписей (клиент)"),
         ("crypto_signer", "Подпись и генерация ключей (офлайн)"),
         ("download_manager", "Менеджер загрузок"), 
+        ("archive_packer", "Упаковка архивов"),
+        ("release_builder", "Инкрементальная сборка релиза"),
+        ("release_pipeline", "Консольный конвейер релиза"),
+        ("merkle_manifest", "Манифест на дереве Меркла"),
+        ("signature_algorithms", "Алгоритмы подписи"),
+        ("p2p_swarm", "Роевая P2P загрузка"),
+        ("lan_discovery", "Обнаружение пиров в LAN"),
         ("backup_manager", "Резервные копии/откат"),
         ("delta_updates", "Delta-обновления"),
+        ("delta_codecs", "Кодеки дельт"),
+        ("chunk_store", "Хранилище чанков (CDC)"),
         ("ui_enhancements", "Улучшения UI"),
         ("cache_manager", "Кэш"),
         ("p2p_distribution", "P2P распределение"),
         ("cdn_manager", "CDN менеджер"),
         ("bandwidth_optimizer", "Оптимизация пропускной способности"),
+        ("prefetch_manager", "Фоновая предзагрузка патчей"),
         ("intelligent_load_balancer", "Интеллектуальный балансировщик")
     ]
     